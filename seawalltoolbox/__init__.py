@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+#---------------------------------------------------------------------------------------------------------------------#
+# SEAWALL TOOLBOX
+# Creates seawall segments within a chosen coastal region and assesses their economic efficiency.
+#
+# The functions are loaded on first use, so "import seawalltoolbox" is instantaneous. arcpy and pandas are only
+# imported by the steps that need them (see _compat.py).
+#---------------------------------------------------------------------------------------------------------------------#
+import sys, importlib
+
+_exports = {
+    # Damages
+    "calculateDistance": "damage",
+    "stormDamage": "damage",
+    "parcel": "damage",
+    "parcel_simulation": "damage",
+    "damageMatrix": "damage",
+    "segmentDamageCurves": "damage",
+    # Economics
+    "class_segment": "economics",
+    "slr_scenarios": "economics",
+    "slrPathways": "economics",
+    "surgeProbability": "economics",
+    "expectedDamages": "economics",
+    "efficientHeights": "economics",
+    "portfolioCurves": "portfolio",
+    "portfolioOptimizer": "portfolio",
+    "parameterSweep": "sweep",
+    "simulateSurges": "catalog",
+    "catalogLosses": "catalog",
+    # Rasters
+    "ArraySource": "raster",
+    "RasterSource": "raster",
+    "tileWindows": "raster",
+    "bilinearSample": "raster",
+    "marchingSquares": "contours",
+    "joinSegments": "contours",
+    "runTiles": "pipeline",
+    "tiledContour": "pipeline",
+    "tiledZonalMean": "pipeline",
+    "tiledFloodMask": "pipeline",
+    "tiledInundationLevels": "pipeline",
+    "tileSize": "pipeline",
+    "ingestDem": "tilecache",
+    "TiledDem": "tilecache",
+    "coarseToFineContour": "tilecache",
+    "coarseToFineFloodMask": "tilecache",
+    # Flooding
+    "seaSeeds": "flood",
+    "inundationLevels": "flood",
+    "InundationIndex": "flood",
+    # Polylines and polygons
+    "smoothLine": "geometry",
+    "douglasPeucker": "geometry",
+    "processContourLines": "geometry",
+    "assemblePolygons": "polygons",
+    "locatePoints": "linref",
+    "splitAtMeasures": "linref",
+    "splitLines": "linref",
+    "pointsInPolygons": "geometry",
+    # Results by segment
+    "groupReduce": "aggregate",
+    "segmentMetrics": "aggregate",
+    # Caches
+    "ElevationCache": "cache",
+    "cachedElevations": "cache",
+    "demFingerprint": "cache",
+    "geometryHash": "cache",
+    # Assessor tables
+    "joinAssessorValues": "assessor",
+    "addAssessorValues": "assessor",
+    # Depth stacks
+    "depthStack": "depthstack",
+    "readStackLevel": "depthstack",
+    # Output writers
+    "writeGeoPackage": "writers",
+    "writeGeoParquet": "writers",
+    "polygonWkb": "writers",
+    # Study session
+    "StudySession": "session",
+    "serve": "session",
+    # Results of the runs
+    "ResultsStore": "results",
+    # Incremental updates
+    "ParcelState": "delta",
+    "updateCurves": "delta",
+    # Worker processes
+    "SharedArrays": "sharedarrays",
+    "SharedPool": "sharedarrays",
+    "sharedArray": "sharedarrays",
+    "parallelDamageCurves": "sharedarrays",
+    "parallelZonalMean": "sharedarrays",
+    "parallelCatalogLosses": "sharedarrays",
+    # Memory
+    "MemoryMonitor": "memory",
+    "processMemory": "memory",
+    # Geoprocessing (arcpy)
+    "spatialJoin": "geoprocessing",
+    "createContour": "geoprocessing",
+    "createSegmentsOfLowLands": "geoprocessing",
+    "parcelElevations": "geoprocessing",
+    "segmentResults": "geoprocessing",
+    "writeResults": "geoprocessing",
+    # The whole tool
+    "reportSegments": "toolbox",
+    "run": "toolbox",
+    "update": "toolbox",
+}
+
+__all__ = sorted(_exports)
+
+def __getattr__(name):
+    if name in _exports:
+        value = getattr(importlib.import_module("." + _exports[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module '{0}' has no attribute '{1}'".format(__name__, name))
+
+# Module level __getattr__ only exists since Python 3.7 (ArcMap still runs Python 2.7)
+if sys.version_info < (3, 7):
+    for _name in _exports:
+        __getattr__(_name)
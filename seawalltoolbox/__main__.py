@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+import sys
+
+from .cli import main
+
+# Worker processes started with spawn (Windows) import this module again: only the parent runs the command
+if __name__ == "__main__":
+    sys.exit(main())
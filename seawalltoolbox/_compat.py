@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import sys, time, importlib
+
+#---------------------------------------------------------------------------------------------------------------------#
+# PYTHON 2 (ArcMap) / PYTHON 3 (ArcGIS Pro) COMPATIBILITY
+#---------------------------------------------------------------------------------------------------------------------#
+# time.clock was removed in Python 3.8
+clock = getattr(time, "perf_counter", None) or time.clock
+
+if sys.version_info[0] >= 3:
+    long = int
+else:
+    long = long
+
+def openCsv(path):
+    # The csv module reads bytes in Python 2 and text (without newline translation) in Python 3;
+    # utf-8-sig also drops the byte order mark of spreadsheet exports
+    if sys.version_info[0] >= 3:
+        return open(path, newline="", encoding="utf-8-sig", errors="replace")
+    return open(path, "rb")
+
+#---------------------------------------------------------------------------------------------------------------------#
+# LAZY IMPORTS
+# arcpy and pandas take seconds to import (arcpy also checks out a licence). They are only imported the first time
+# one of their attributes is used, so the functions that do not need them can be used without paying for them.
+#---------------------------------------------------------------------------------------------------------------------#
+class LazyModule(object):
+    def __init__(self, name, on_import=None):
+        self.__dict__["_name"] = name
+        self.__dict__["_on_import"] = on_import
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        if self._module is None:
+            try:
+                module = importlib.import_module(self._name)
+            except ImportError:
+                raise ImportError("This step of SeaWallToolBox needs the '{0}' package, "
+                                  "which is not available in this Python environment".format(self._name))
+            if self._on_import is not None:
+                self._on_import(module)
+            self.__dict__["_module"] = module
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __setattr__(self, attribute, value):
+        setattr(self._load(), attribute, value)
+
+    def __repr__(self):
+        return "<lazy module '{0}' ({1})>".format(self._name, "loaded" if self._module is not None else "not loaded")
+
+def _arcpy_settings(module):
+    module.env.overwriteOutput = True
+
+arcpy = LazyModule("arcpy", _arcpy_settings)
+pd = LazyModule("pandas")
+
+def isLoaded(name):
+    return name in sys.modules
+
+#---------------------------------------------------------------------------------------------------------------------#
+# MESSAGES
+# Goes to the geoprocessing window when arcpy is already in use, to the console otherwise
+#---------------------------------------------------------------------------------------------------------------------#
+def addMessage(message):
+    if isLoaded("arcpy"):
+        arcpy.AddMessage(message)
+    else:
+        print(message)
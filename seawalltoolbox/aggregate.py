@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+#---------------------------------------------------------------------------------------------------------------------#
+# GROUPED REDUCTIONS
+# Once every parcel knows its segment, the per-segment totals are grouped reductions: one sort of the segment
+# numbers, then every column is reduced at once with reduceat.
+#---------------------------------------------------------------------------------------------------------------------#
+def groupReduce(groups, columns, n_groups):
+    # Sums, maxima and counts of each column (parcels x columns) for the groups 0 to n_groups-1.
+    # Parcels with a negative group (outside every segment) are ignored.
+    groups = np.asarray(groups, dtype=np.int64)
+    columns = np.asarray(columns, dtype=np.float64).reshape(len(groups), -1)
+    sums = np.zeros((n_groups, columns.shape[1]))
+    maxima = np.full((n_groups, columns.shape[1]), np.nan)
+    counts = np.bincount(groups[groups >= 0], minlength=n_groups)[:n_groups]
+    keep = (groups >= 0) & (groups < n_groups)
+    if not keep.any():
+        return sums, maxima, counts
+    order = np.argsort(groups[keep], kind="mergesort")
+    sorted_groups = groups[keep][order]
+    sorted_columns = columns[keep][order]
+    starts = np.flatnonzero(np.concatenate([[True], sorted_groups[1:] != sorted_groups[:-1]]))
+    present = sorted_groups[starts]
+    sums[present] = np.add.reduceat(sorted_columns, starts, axis=0)
+    maxima[present] = np.maximum.reduceat(sorted_columns, starts, axis=0)
+    return sums, maxima, counts
+
+#---------------------------------------------------------------------------------------------------------------------#
+# PER-SEGMENT RESULTS TABLE
+#---------------------------------------------------------------------------------------------------------------------#
+segment_fields = [("Id", np.int32), ("AOI_Length", np.float64), ("T_Damage", np.float64), ("PS_Damage", np.float64),
+                  ("Max_Damage", np.float64), ("Exposed", np.float64), ("Parcels", np.int32)]
+
+def segmentMetrics(segment_ids, wall_lengths, segment_of_parcel, damages, values):
+    # segment_of_parcel is the position (0 to n-1) of each parcel's segment in segment_ids, -1 if outside.
+    # T_Damage: total damage, PS_Damage: damage per meter of seawall, Max_Damage: largest parcel damage,
+    # Exposed: total value of the parcels, Parcels: number of parcels
+    wall_lengths = np.asarray(wall_lengths, dtype=np.float64)
+    sums, maxima, counts = groupReduce(segment_of_parcel, np.stack([damages, values], axis=1), len(segment_ids))
+    table = np.zeros(len(segment_ids), dtype=segment_fields)
+    table["Id"] = segment_ids
+    table["AOI_Length"] = wall_lengths
+    table["T_Damage"] = sums[:, 0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        table["PS_Damage"] = np.where(wall_lengths > 0, sums[:, 0] / wall_lengths, 0.0)
+    table["Max_Damage"] = np.nan_to_num(maxima[:, 0])
+    table["Exposed"] = sums[:, 1]
+    table["Parcels"] = counts
+    return table
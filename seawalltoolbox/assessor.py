@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import csv
+from itertools import islice
+
+import numpy as np
+
+from ._compat import arcpy, openCsv
+
+#---------------------------------------------------------------------------------------------------------------------#
+# ASSESSOR TABLE JOIN
+# Assessor exports (building values by parcel ID) can be far larger than the parcels of the study area. The parcels
+# are the small side of the join: their IDs go into a hash index (ID -> position), and the assessor table is streamed
+# through it by chunks of rows, keeping only the values of known parcels. Memory is the value array of the parcels
+# plus one chunk, whatever the size of the table. Parcels with several assessor rows (e.g. several buildings) get
+# the sum of their values (or the first or largest one).
+#---------------------------------------------------------------------------------------------------------------------#
+def parcelKey(value):
+    # IDs are compared as text; a numeric ID read as 1021.0 from a Double field is the same parcel as "1021"
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+def parseValue(text):
+    # Assessor values as numbers: "$1,250,000" -> 1250000.0, blank or unreadable -> NaN
+    if isinstance(text, (int, float)):
+        return float(text)
+    if text is None:
+        return np.nan
+    try:
+        return float(str(text).replace("$", "").replace(",", "").strip())
+    except ValueError:
+        return np.nan
+
+def assessorChunks(table, id_field, value_field, chunk_rows=100000, delimiter=","):
+    # Lists of (parcel key, value) of at most chunk_rows rows: a CSV file is read with the csv module, anything else
+    # (table, feature class) with an arcpy cursor
+    if table.lower().endswith((".csv", ".txt")):
+        with openCsv(table) as f:
+            reader = csv.reader(f, delimiter=delimiter)
+            header = [name.strip() for name in next(reader)]
+            for field in (id_field, value_field):
+                if field not in header:
+                    raise ValueError("Field {0} is not in {1} (fields: {2})".format(field, table, ", ".join(header)))
+            i, j = header.index(id_field), header.index(value_field)
+            width = max(i, j)
+            while True:
+                # Short (e.g. blank) rows get an empty ID, which matches no parcel
+                chunk = [(row[i].strip(), row[j]) if len(row) > width else ("", "")
+                         for row in islice(reader, chunk_rows)]
+                if not chunk:
+                    break
+                yield chunk
+    else:
+        with arcpy.da.SearchCursor(table, [id_field, value_field]) as rows:
+            while True:
+                chunk = [(parcelKey(row[0]), row[1]) for row in islice(rows, chunk_rows)]
+                if not chunk:
+                    break
+                yield chunk
+
+def joinAssessorValues(parcel_ids, table, id_field, value_field, how="sum", chunk_rows=100000, delimiter=",",
+                       message=None):
+    # Values of parcel_ids (same order) from the assessor table, NaN for the parcels it does not list, and the
+    # number of assessor rows of each parcel
+    index = {}
+    for position, parcel in enumerate(parcel_ids):
+        index.setdefault(parcelKey(parcel), []).append(position)
+    values = np.full(len(parcel_ids), np.nan)
+    counts = np.zeros(len(parcel_ids), dtype=np.int64)
+    n_rows = 0
+    for chunk in assessorChunks(table, id_field, value_field, chunk_rows, delimiter):
+        n_rows += len(chunk)
+        # Probe the index, then accumulate the whole chunk at once
+        matches = [(position, value) for key, value in chunk for position in index.get(key, ())]
+        if not matches:
+            continue
+        positions = np.array([m[0] for m in matches], dtype=np.int64)
+        chunk_values = np.array([parseValue(m[1]) for m in matches])
+        known = ~np.isnan(chunk_values)
+        positions, chunk_values = positions[known], chunk_values[known]
+        if how == "sum":
+            values[positions] = np.where(counts[positions] > 0, values[positions], 0.0)
+            np.add.at(values, positions, chunk_values)
+        elif how == "max":
+            values[positions] = np.where(counts[positions] > 0, values[positions], -np.inf)
+            np.maximum.at(values, positions, chunk_values)
+        elif how == "first":
+            # Last write wins in fancy assignment: assign in reverse to keep the first row of the chunk
+            new = counts[positions] == 0
+            values[positions[new][::-1]] = chunk_values[new][::-1]
+        else:
+            raise ValueError("how must be 'sum', 'max' or 'first'")
+        np.add.at(counts, positions, 1)
+    if message is not None:
+        message("Assessor table: {0} rows read, {1} of {2} parcels matched".format(
+                n_rows, int((counts > 0).sum()), len(parcel_ids)))
+    return values, counts
+
+#---------------------------------------------------------------------------------------------------------------------#
+# JOINED VALUES ON THE PARCELS (arcpy)
+#---------------------------------------------------------------------------------------------------------------------#
+def addAssessorValues(properties, zoneField, table, id_field, value_field, field="ASSESSED", how="sum",
+                      message=None):
+    # Writes the joined values in a new field of the properties (0 for unmatched parcels) and returns its name,
+    # to be used as the building value field
+    with arcpy.da.SearchCursor(properties, [zoneField]) as rows:
+        parcel_ids = [row[0] for row in rows]
+    values, counts = joinAssessorValues(parcel_ids, table, id_field, value_field, how, message=message)
+    values = np.where(counts > 0, values, 0.0)
+    arcpy.AddField_management(properties, field, "DOUBLE")
+    with arcpy.da.UpdateCursor(properties, [field]) as rows:
+        for row, value in zip(rows, values.tolist()):
+            rows.updateRow([value])
+    return field
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import os, hashlib, sqlite3
+
+import numpy as np
+
+from ._compat import addMessage
+from .raster import tileWindows
+
+#---------------------------------------------------------------------------------------------------------------------#
+# FINGERPRINTS
+# The mean elevation of a parcel only changes when the DEM or the parcel geometry change
+#---------------------------------------------------------------------------------------------------------------------#
+def demFingerprint(source, tile_size=2048):
+    # Hash of the DEM content (values and georeferencing), read tile by tile
+    sha = hashlib.sha1()
+    sha.update(repr((source.shape, source.cellsize, source.x_min, source.y_max)).encode("utf-8"))
+    for window in tileWindows(source.shape, tile_size):
+        tile = np.ascontiguousarray(source.read(window.row, window.col, window.nrows, window.ncols), dtype=np.float32)
+        sha.update(tile.tobytes())
+    return sha.hexdigest()
+
+def geometryHash(geometry):
+    # arcpy geometries are hashed through their WKB, anything else as an array of coordinates
+    if hasattr(geometry, "WKB"):
+        data = bytes(geometry.WKB)
+    elif isinstance(geometry, (bytes, bytearray)):
+        data = bytes(geometry)
+    else:
+        data = np.ascontiguousarray(geometry, dtype=np.float64).tobytes()
+    return hashlib.sha1(data).hexdigest()
+
+def fileStamp(path):
+    # (modification time, size) of what holds a raster on disk, None when it is not on disk (e.g. a service).
+    # A raster file is stamped on its own. A raster stored as a folder (Esri Grid) or in a file geodatabase
+    # (C:/data/lidar.gdb/dem is not a file, the .gdb folder is) gets the latest modification and the total size of
+    # the files of that folder. Anything written in the same geodatabase renews the stamp (and the DEM is hashed
+    # again once): keep the DEM out of the workspace of the tool.
+    folder = path
+    while folder and not os.path.exists(folder):
+        if os.path.dirname(folder) == folder:
+            return None
+        folder = os.path.dirname(folder)
+    if not folder or (folder != path and not folder.lower().endswith(".gdb")):
+        return None
+    if os.path.isfile(folder):
+        return os.path.getmtime(folder), os.path.getsize(folder)
+    modified, size = os.path.getmtime(folder), 0
+    for parent, folders, files in os.walk(folder):
+        for name in files:
+            name = os.path.join(parent, name)
+            modified, size = max(modified, os.path.getmtime(name)), size + os.path.getsize(name)
+    return modified, size
+
+#---------------------------------------------------------------------------------------------------------------------#
+# PERSISTENT ELEVATION CACHE
+# One SQLite file, one row per (DEM fingerprint, parcel ID, geometry hash)
+#---------------------------------------------------------------------------------------------------------------------#
+class ElevationCache(object):
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS elevations "
+                                "(dem TEXT, parcel TEXT, geometry TEXT, mean REAL, PRIMARY KEY (dem, parcel, geometry))")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS dem_fingerprints "
+                                "(path TEXT, modified REAL, size INTEGER, fingerprint TEXT, PRIMARY KEY (path))")
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def demFingerprint(self, source, path=None):
+        # Hashing a DEM means reading all of it: remember the fingerprint as long as its files are unchanged
+        stamp = fileStamp(path) if path else None
+        if stamp is None:
+            return demFingerprint(source)
+        modified, size = stamp
+        row = self.connection.execute("SELECT modified, size, fingerprint FROM dem_fingerprints WHERE path = ?",
+                                      (path,)).fetchone()
+        if row is not None and row[0] == modified and row[1] == size:
+            return row[2]
+        fingerprint = demFingerprint(source)
+        self.connection.execute("INSERT OR REPLACE INTO dem_fingerprints VALUES (?, ?, ?, ?)",
+                                (path, modified, size, fingerprint))
+        self.connection.commit()
+        return fingerprint
+
+    def lookup(self, dem, parcel_ids, geometry_hashes):
+        # Cached elevations (NaN where missing) and a mask of the hits
+        parcel_ids = [str(p) for p in parcel_ids]
+        found = {}
+        # Only pull the rows of this DEM, in chunks of IDs to stay below the SQLite variable limit
+        for start in range(0, len(parcel_ids), 500):
+            chunk = parcel_ids[start:start+500]
+            query = "SELECT parcel, geometry, mean FROM elevations WHERE dem = ? AND parcel IN ({0})".format(
+                ",".join("?"*len(chunk)))
+            for parcel, geometry, mean in self.connection.execute(query, [dem] + chunk):
+                found[(parcel, geometry)] = mean
+        elevations = np.array([found.get((p, g), np.nan) for p, g in zip(parcel_ids, geometry_hashes)], dtype=float)
+        hit = np.array([(p, g) in found for p, g in zip(parcel_ids, geometry_hashes)], dtype=bool)
+        self.hits += int(hit.sum())
+        self.misses += int((~hit).sum())
+        return elevations, hit
+
+    def store(self, dem, parcel_ids, geometry_hashes, elevations):
+        rows = [(dem, str(p), g, None if e is None or np.isnan(e) else float(e))
+                for p, g, e in zip(parcel_ids, geometry_hashes, elevations)]
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO elevations VALUES (?, ?, ?, ?)", rows)
+
+    def hitRate(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+    def report(self, message=addMessage):
+        message("Elevation cache: {0} parcels reused, {1} resampled (hit rate {2:.1f}%)".format(
+                self.hits, self.misses, 100*self.hitRate()))
+
+    def close(self):
+        self.connection.close()
+
+def cachedElevations(cache, dem, parcel_ids, geometry_hashes, compute):
+    # Mean elevation of every parcel. compute(indices) is only called for the parcels missing from the cache and
+    # returns their elevations in the same order.
+    elevations, hit = cache.lookup(dem, parcel_ids, geometry_hashes)
+    missing = np.nonzero(~hit)[0]
+    if len(missing):
+        computed = np.asarray(compute(missing), dtype=float)
+        elevations[missing] = computed
+        cache.store(dem, [parcel_ids[i] for i in missing], [geometry_hashes[i] for i in missing], computed)
+    return elevations
+
+def defaultCachePath(workspace):
+    # Next to the workspace (a file geodatabase cannot hold other files)
+    folder = os.path.dirname(workspace) if workspace.lower().endswith(".gdb") else workspace
+    return os.path.join(folder, "seawall_cache.sqlite")
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from .economics import mu_location, sigma_scale, k_shape, slr_scenarios, slrPathways
+
+#---------------------------------------------------------------------------------------------------------------------#
+# STOCHASTIC STORM CATALOG
+# Instead of weighting each surge level by its probability, draw many synthetic planning horizons: one annual maximum
+# surge per year from the fitted GEV, raised by the sea level rise pathway. Each segment's damage curve is then
+# evaluated at every event, without a wall and behind each candidate wall (a wall stops every surge up to its
+# height; an overtopped wall does not reduce the damage). The whole GEV is sampled: the linear model used below the
+# inflection point by surgeProbability is a fit of the probabilities per 0.01 m step, not a distribution to draw from.
+# The same random numbers are used under every pathway, so the pathways are compared on the same storms.
+#---------------------------------------------------------------------------------------------------------------------#
+def simulateSurges(n_simulations, years=30, scenarios=slr_scenarios, seed=None):
+    # Annual maximum surges: scenarios x simulations x years
+    u = np.random.RandomState(seed).uniform(size=(n_simulations, years))
+    u = np.clip(u, 1e-300, 1.0)
+    # Inverse of F(x) = exp(-(1 + k(x-mu)/sigma)^(-1/k))
+    surges = mu_location + sigma_scale * ((-np.log(u))**(-k_shape) - 1) / k_shape
+    return surges[None, :, :] + slrPathways(scenarios, years)[:, None, :]
+
+def interpolateCurves(surges, damage_curves, events):
+    # Damages of every segment at every event (segments x events.shape); no damage below the first surge level,
+    # the last damage above the last one
+    surges = np.asarray(surges, dtype=float)
+    damage_curves = np.asarray(damage_curves, dtype=float).reshape(-1, len(surges))
+    events = np.asarray(events, dtype=float)
+    # One search for all the segments: they share the surge levels
+    upper = np.clip(np.searchsorted(surges, events, side="right"), 1, len(surges)-1)
+    lower = upper - 1
+    span = surges[upper] - surges[lower]
+    weight = np.clip((events - surges[lower]) / np.where(span > 0, span, 1.0), 0.0, 1.0)
+    damages = damage_curves[:, lower] * (1-weight) + damage_curves[:, upper] * weight
+    return np.where(events >= surges[0], damages, 0.0)
+
+def catalogLosses(surges, damage_curves, events, heights=None, discount_rate=0.04, percentiles=(50, 90, 99, 99.5),
+                  max_cells=2e7):
+    # Loss distributions of each segment for each option: no wall, then a wall at each of heights (default: every
+    # 0.25 m of the surge levels). events are the annual maxima of one pathway (simulations x years).
+    # Returns a dictionary of arrays:
+    #   heights        options (NaN for no wall)
+    #   aal            average annual loss, segments x options
+    #   pv             mean discounted loss over the horizon, segments x options
+    #   pv_percentiles discounted loss over the horizon at each percentile, percentiles x segments x options
+    #   benefits       mean discounted loss avoided by each wall, segments x options
+    surges = np.asarray(surges, dtype=float)
+    damage_curves = np.asarray(damage_curves, dtype=float).reshape(-1, len(surges))
+    events = np.atleast_2d(np.asarray(events, dtype=float))
+    heights = surges[::25] if heights is None else np.asarray(heights, dtype=float)
+    options = np.concatenate([[-np.inf], heights])     # no wall: every surge gets through
+    n_simulations, years = events.shape
+    n_segments = len(damage_curves)
+    discount = np.exp(-discount_rate*(np.arange(years)+1))     # as expectedDamages
+
+    totals = np.zeros((n_segments, len(options)))
+    pv = np.empty((n_segments, len(options), n_simulations))
+    chunk = max(1, int(max_cells // (years * n_segments * len(options))))
+    for first in range(0, n_simulations, chunk):
+        batch = events[first:first+chunk]                                       # simulations x years
+        damages = interpolateCurves(surges, damage_curves, batch)               # segments x simulations x years
+        overtopped = (batch[None, :, :] > options[:, None, None]).astype(float)  # options x simulations x years
+        totals += np.einsum("scy,ocy->so", damages, overtopped)
+        pv[:, :, first:first+chunk] = np.einsum("scy,ocy,y->soc", damages, overtopped, discount)
+
+    mean_pv = pv.mean(axis=2)
+    return {"heights": np.concatenate([[np.nan], heights]),
+            "aal": totals / (n_simulations * years),
+            "pv": mean_pv,
+            "pv_percentiles": np.percentile(pv, percentiles, axis=2),
+            "benefits": mean_pv[:, :1] - mean_pv}
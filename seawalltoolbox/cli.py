@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+#---------------------------------------------------------------------------------------------------------------------#
+# COMMAND LINE
+#   python -m seawalltoolbox run --dem ... --contours ... --mhw 4 --surge 15 --properties ... \
+#          --value-field VALUE_BLDG --id-field UNIQUE_ID --workspace ... --output ...
+#   python -m seawalltoolbox economics --curves damage_curves.csv [--years 100] [--budget 5e6]
+#   python -m seawalltoolbox sweep --curves damage_curves.csv --discount-rates 0.02,0.04,0.07 --output sweep.csv
+#   python -m seawalltoolbox simulate --curves damage_curves.csv --simulations 20000 --output losses.csv [--processes 0]
+#   python -m seawalltoolbox ingest --dem ... --cache dem_tiles [--tile-size 256] [--levels 4]
+#   python -m seawalltoolbox history --results seawall_results.sqlite [--run 3] [--compare 2 3]
+#   python -m seawalltoolbox depths --tiles dem_tiles --surges 1:4:0.1 --mhw 0.5 --output depths.zarr [--connected]
+#   python -m seawalltoolbox serve --workspace ... [--tiles dem_tiles] [--port 8765]
+#   python -m seawalltoolbox update --changed ... --deleted 1021,1022 --value-field VALUE_BLDG --id-field UNIQUE_ID \
+#          --workspace ...
+#
+# Only the modules of the chosen command are imported: "economics" never imports arcpy or pandas.
+#---------------------------------------------------------------------------------------------------------------------#
+import sys, argparse, csv, json
+
+def floatList(text):
+    return [float(value) for value in text.split(",") if value.strip()]
+
+def surgeLevels(text):
+    # "1,1.5,2" or a range "start:stop:step" (stop included)
+    if ":" not in text:
+        return floatList(text)
+    start, stop, step = [float(value) for value in text.split(":")]
+    return [round(start + i*step, 4) for i in range(int(round((stop-start)/step)) + 1)]
+
+def buildParser():
+    parser = argparse.ArgumentParser(prog="seawalltoolbox",
+                                     description="Create seawall segments and assess their economic efficiency")
+    commands = parser.add_subparsers(dest="command")
+
+    run = commands.add_parser("run", help="Run the whole tool (needs arcpy and the Spatial Analyst extension)")
+    run.add_argument("--dem", required=True, help="Raster elevation data")
+    run.add_argument("--contours", default=None, help="Pre-created contours of the DEM (not needed with --tile-size)")
+    run.add_argument("--mhw", required=True, help="Mean high water")
+    run.add_argument("--surge", required=True, help="Chosen surge level")
+    run.add_argument("--properties", required=True, help="Shapefile of the properties")
+    run.add_argument("--value-field", required=True, help="Field with building values")
+    run.add_argument("--id-field", required=True, help="Unique ID field of buildings")
+    run.add_argument("--workspace", required=True, help="Workspace for the results")
+    run.add_argument("--output", required=True,
+                     help="Final output feature class, or a .gpkg or .parquet file (with the parcels)")
+    run.add_argument("--no-curves", action="store_true",
+                     help="Do not write the damage curves of the segments in a .gpkg or .parquet output")
+    run.add_argument("--cache", default=None,
+                     help="Parcel elevation cache (default: seawall_cache.sqlite next to the workspace)")
+    run.add_argument("--no-cache", action="store_true", help="Resample the elevation of every parcel")
+    run.add_argument("--results", default=None,
+                     help="Results store of the runs (default: seawall_results.sqlite next to the workspace)")
+    run.add_argument("--state", default=None,
+                     help="Parcel state for later updates (default: seawall_state.sqlite next to the workspace)")
+    run.add_argument("--elevation-mode", choices=["zonal", "point"], default="zonal",
+                     help="Mean elevation over each parcel (default) or elevation at its centroid")
+    run.add_argument("--elevation-points", default=None,
+                     help="Points (with the ID field) to sample instead of the centroids in point mode")
+    run.add_argument("--assessor", default=None,
+                     help="Assessor table (CSV or table) with the building values, joined on the parcel IDs")
+    run.add_argument("--assessor-id", default=None, help="Parcel ID field of the assessor table (default: --id-field)")
+    run.add_argument("--assessor-value", default=None,
+                     help="Building value field of the assessor table (default: --value-field)")
+    run.add_argument("--memory-budget", type=float, default=None,
+                     help="Memory budget in MB: chunked steps take smaller chunks to stay within it")
+    run.add_argument("--tile-size", type=int, default=None,
+                     help="Tiled mode: contours and zonal elevations from the DEM by tiles of at most this many cells "
+                          "(smaller if --memory-budget needs it)")
+    run.add_argument("--trace-memory", action="store_true",
+                     help="Also report the Python allocations of each step (slower)")
+
+    update = commands.add_parser("update", help="Re-evaluate only the segments touched by changed parcels "
+                                                "(needs arcpy and a previous run)")
+    update.add_argument("--changed", required=True, help="Feature class of the new and changed parcels")
+    update.add_argument("--deleted", default="", help="IDs of the removed parcels, e.g. 1021,1022")
+    update.add_argument("--value-field", required=True, help="Field with building values")
+    update.add_argument("--id-field", required=True, help="Unique ID field of buildings")
+    update.add_argument("--workspace", required=True, help="Workspace of the previous run")
+    update.add_argument("--dem", default=None, help="Raster elevation data (default: the one of the previous run)")
+
+    economics = commands.add_parser("economics", help="Efficient wall heights from per-segment damage curves")
+    economics.add_argument("--curves", required=True,
+                           help="CSV with columns Id, AOI_Length, then the damages at each surge level "
+                                "(the header of these columns being the surge levels in meter)")
+    economics.add_argument("--results", default=None, help="Results store where the run is also recorded")
+
+    history = commands.add_parser("history", help="Runs recorded in a results store")
+    history.add_argument("--results", required=True, help="Results store (seawall_results.sqlite)")
+    history.add_argument("--run", type=int, default=None, help="Efficient heights of this run")
+    history.add_argument("--compare", type=int, nargs=2, default=None, metavar=("RUN_A", "RUN_B"),
+                         help="Highest efficient height of each segment in two runs")
+
+    sweep = commands.add_parser("sweep", help="Efficient wall heights for every combination of economic parameters")
+    sweep.add_argument("--curves", required=True, help="CSV of damage curves, as for economics")
+    sweep.add_argument("--output", required=True, help="CSV of the results, one row per combination and segment")
+    sweep.add_argument("--discount-rates", type=floatList, default=[0.04], help="e.g. 0.02,0.04 (default: 0.04)")
+    sweep.add_argument("--useful-lives", type=floatList, default=[30], help="Years (default: 30)")
+    sweep.add_argument("--capex", type=floatList, default=[0.02], help="Annual maintenance rate (default: 0.02)")
+    sweep.add_argument("--base-heights", type=floatList, default=[1.07], help="Wall base height (default: 1.07)")
+    sweep.add_argument("--unit-costs", type=floatList, default=[3881.4], help="Wall unit cost (default: 3881.4)")
+    sweep.add_argument("--years", type=int, default=30, help="Planning horizon (default: 30)")
+
+    simulate = commands.add_parser("simulate", help="Loss distributions from a stochastic storm catalog")
+    simulate.add_argument("--curves", required=True, help="CSV of damage curves, as for economics")
+    simulate.add_argument("--output", required=True,
+                          help="CSV of the results, one row per pathway, segment and wall height")
+    simulate.add_argument("--simulations", type=int, default=20000, help="Synthetic horizons (default: 20000)")
+    simulate.add_argument("--heights", type=floatList, default=None,
+                          help="Candidate wall heights, e.g. 2,2.5,3 (default: every 0.25 m)")
+    simulate.add_argument("--seed", type=int, default=None, help="Seed of the random numbers")
+    simulate.add_argument("--years", type=int, default=30, help="Planning horizon (default: 30)")
+    simulate.add_argument("--discount-rate", type=float, default=0.04, help="Discount rate (default: 0.04)")
+    simulate.add_argument("--processes", type=int, default=1,
+                          help="Worker processes sharing the curves and storms (default: 1, 0: one per core)")
+
+    ingest = commands.add_parser("ingest", help="Convert a DEM into a tiled, memory-mapped cache (needs arcpy)")
+    ingest.add_argument("--dem", required=True, help="Raster elevation data")
+    ingest.add_argument("--cache", required=True, help="Folder of the tiled DEM cache")
+    ingest.add_argument("--tile-size", type=int, default=256, help="Tile size in cells (default: 256)")
+    ingest.add_argument("--levels", type=int, default=4, help="Number of overview levels (default: 4)")
+
+    depths = commands.add_parser("depths", help="Flood depth rasters at many surge levels in one pass over the DEM")
+    depths.add_argument("--tiles", default=None, help="Tiled DEM cache (see ingest)")
+    depths.add_argument("--dem", default=None, help="Raster elevation data instead of a tiled cache (needs arcpy)")
+    depths.add_argument("--surges", required=True, type=surgeLevels, help="Surge levels, e.g. 1:4:0.1 or 2,2.5,3")
+    depths.add_argument("--mhw", type=float, default=None, help="Mean high water: cells at or below it are masked")
+    depths.add_argument("--output", required=True,
+                        help="Depth stack: a .zarr folder, or a .h5 file (needs h5py)")
+    depths.add_argument("--connected", action="store_true",
+                        help="Only flood the cells connected to the sea (runs the priority-flood first, needs --mhw)")
+    depths.add_argument("--tile-size", type=int, default=512, help="Tile and chunk size in cells (default: 512)")
+    depths.add_argument("--level-chunk", type=int, default=8, help="Surge levels per chunk (default: 8)")
+
+    serve = commands.add_parser("serve", help="Keep a study area in memory and answer queries on localhost")
+    serve.add_argument("--workspace", default=None, help="Workspace of a previous run (its parcel state is loaded)")
+    serve.add_argument("--state", default=None, help="Parcel state to load instead (seawall_state.sqlite)")
+    serve.add_argument("--tiles", default=None, help="Tiled DEM cache (see ingest) for flood and contour queries")
+    serve.add_argument("--dem", default=None, help="Raster elevation data instead of a tiled cache (needs arcpy)")
+    serve.add_argument("--port", type=int, default=8765, help="Port on localhost (default: 8765)")
+
+    for command in (run, economics, update):
+        command.add_argument("--years", type=int, default=30, help="Planning horizon (default: 30)")
+        command.add_argument("--discount-rate", type=float, default=0.04, help="Discount rate (default: 0.04)")
+        command.add_argument("--budget", type=float, default=None, help="Capital budget for the portfolio (USD)")
+    return parser
+
+def readDamageCurves(path):
+    segment_ids, wall_lengths, damage_curves = [], [], []
+    with open(path) as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        surges = [round(float(h), 2) for h in header[2:]]
+        for row in reader:
+            if not row:
+                continue
+            segment_ids.append(row[0])
+            wall_lengths.append(float(row[1]))
+            damage_curves.append([float(v) for v in row[2:]])
+    return surges, segment_ids, wall_lengths, damage_curves
+
+def economicsCommand(args):
+    from .economics import class_segment
+    from .toolbox import reportSegments
+
+    surges, segment_ids, wall_lengths, damage_curves = readDamageCurves(args.curves)
+    # Maintenance discounted at the same rate as the benefits
+    marginal_costs = [class_segment(s_id, length).wall_cost(surges, args.discount_rate)[1]
+                      for s_id, length in zip(segment_ids, wall_lengths)]
+    marginal_benefits = reportSegments(segment_ids, surges, damage_curves, marginal_costs, args.years,
+                                       args.discount_rate, args.budget)
+    if args.results:
+        from .results import ResultsStore
+        results = ResultsStore(args.results)
+        try:
+            parameters = {"curves": args.curves, "years": args.years, "discount_rate": args.discount_rate,
+                          "budget": args.budget}
+            results.saveRun(parameters, surges, segment_ids, wall_lengths, damage_curves, marginal_costs,
+                            marginal_benefits, args.budget)
+        finally:
+            results.close()
+
+def historyCommand(args):
+    from ._compat import addMessage
+    from .results import ResultsStore
+
+    results = ResultsStore(args.results)
+    try:
+        if args.compare:
+            addMessage("scenario,Id,height_{0},height_{1}".format(*args.compare))
+            for scenario, segment, a, b in results.compareHeights(*args.compare):
+                addMessage("{0},{1},{2},{3}".format(scenario, segment, "" if a is None else a, "" if b is None else b))
+        elif args.run is not None:
+            addMessage("scenario,Id,height,benefits")
+            for scenario, segment, height, benefits in results.heights(args.run):
+                addMessage("{0},{1},{2},{3}".format(scenario, segment, height, round(benefits, 2)))
+        else:
+            for run, created, label, parameters in results.runs():
+                addMessage("{0} {1} {2}{3}".format(run, created, json.dumps(parameters, sort_keys=True),
+                                                   "" if label is None else " " + label))
+    finally:
+        results.close()
+
+def sweepCommand(args):
+    import numpy as np
+    from .economics import slr_scenarios
+    from .sweep import parameterSweep
+
+    surges, segment_ids, wall_lengths, damage_curves = readDamageCurves(args.curves)
+    grid = [args.discount_rates, args.useful_lives, args.capex, args.base_heights, args.unit_costs]
+    heights, net, choice = parameterSweep(surges, damage_curves, wall_lengths, *grid, years=args.years)
+    with open(args.output, "w") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(["discount_rate", "useful_life", "capex", "wall_base_height", "unit_cost", "scenario", "Id",
+                         "height", "net_benefits"])
+        for index in zip(*[axis.ravel() for axis in np.indices(heights.shape)]):
+            parameters = [grid[axis][i] for axis, i in enumerate(index[:5])]
+            height = heights[index]
+            writer.writerow(parameters + [slr_scenarios[index[5]][0], segment_ids[index[6]],
+                                          "" if height != height else height, round(net[index], 2)])
+
+def simulateCommand(args):
+    from .economics import slr_scenarios
+    from .catalog import simulateSurges, catalogLosses
+    from .sharedarrays import parallelCatalogLosses
+
+    surges, segment_ids, wall_lengths, damage_curves = readDamageCurves(args.curves)
+    events = simulateSurges(args.simulations, args.years, slr_scenarios, args.seed)
+    percentiles = (50, 90, 99, 99.5)
+    with open(args.output, "w") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(["scenario", "Id", "height", "aal", "pv", "benefits"] +
+                        ["pv_p" + str(p) for p in percentiles])
+        # With worker processes, every pathway is evaluated before writing
+        by_pathway = None
+        if args.processes != 1:
+            by_pathway = parallelCatalogLosses(surges, damage_curves, events, args.heights, args.discount_rate,
+                                               percentiles, args.processes or None)
+        for k, scenario in enumerate(slr_scenarios):
+            losses = by_pathway[k] if by_pathway else catalogLosses(surges, damage_curves, events[k], args.heights,
+                                                                     args.discount_rate, percentiles)
+            for j, s_id in enumerate(segment_ids):
+                for o, height in enumerate(losses["heights"]):
+                    writer.writerow([scenario[0], s_id, "" if height != height else round(height, 2),
+                                     round(losses["aal"][j, o], 2), round(losses["pv"][j, o], 2),
+                                     round(losses["benefits"][j, o], 2)] +
+                                    [round(v, 2) for v in losses["pv_percentiles"][:, j, o]])
+
+def runCommand(args):
+    from ._compat import arcpy
+    from .cache import ElevationCache, defaultCachePath
+    from .delta import ParcelState, defaultStatePath
+    from .memory import MemoryMonitor
+    from .results import ResultsStore, defaultResultsPath
+    from .toolbox import run
+
+    if not args.contours and not args.tile_size:
+        sys.stderr.write("run needs --contours, or --tile-size to trace the contours from the DEM\n")
+        return 2
+    if arcpy.CheckExtension("spatial") != "Available":
+        sys.stderr.write("Spatial Analyst license is unavailable\n")
+        return 1
+    arcpy.CheckOutExtension("spatial")
+    cache = None if args.no_cache else ElevationCache(args.cache or defaultCachePath(args.workspace))
+    state = ParcelState(args.state or defaultStatePath(args.workspace))
+    results = ResultsStore(args.results or defaultResultsPath(args.workspace))
+    budget = args.memory_budget * 1048576 if args.memory_budget else None
+    try:
+        run(args.dem, args.contours, args.mhw, args.surge, args.properties, args.value_field, args.id_field,\
+            args.workspace, args.output, years=args.years, discount_rate=args.discount_rate, budget=args.budget,\
+            cache=cache, add_to_map=False, elevation_mode=args.elevation_mode,\
+            elevation_points=args.elevation_points, memory=MemoryMonitor(budget, args.trace_memory), state=state,\
+            results=results, assessor=args.assessor, assessor_id=args.assessor_id,\
+            assessor_value=args.assessor_value, write_curves=not args.no_curves, tile_size=args.tile_size)
+    finally:
+        if cache is not None:
+            cache.close()
+        state.close()
+        results.close()
+
+def updateCommand(args):
+    from ._compat import arcpy
+    from .delta import ParcelState, defaultStatePath
+    from .toolbox import update
+
+    if arcpy.CheckExtension("spatial") != "Available":
+        sys.stderr.write("Spatial Analyst license is unavailable\n")
+        return 1
+    arcpy.CheckOutExtension("spatial")
+    state = ParcelState(defaultStatePath(args.workspace))
+    deleted = [value.strip() for value in args.deleted.split(",") if value.strip()]
+    try:
+        update(args.changed, args.value_field, args.id_field, args.workspace, state, deleted, raster_dem=args.dem,\
+               years=args.years, discount_rate=args.discount_rate, budget=args.budget)
+    finally:
+        state.close()
+
+def depthsCommand(args):
+    from ._compat import addMessage
+
+    if args.tiles:
+        from .tilecache import TiledDem
+        dem = TiledDem(args.tiles)
+    elif args.dem:
+        from .raster import RasterSource
+        dem = RasterSource(args.dem)
+    else:
+        sys.stderr.write("depths needs --tiles or --dem\n")
+        return 2
+    if args.connected and args.mhw is None:
+        sys.stderr.write("--connected needs --mhw\n")
+        return 2
+    import os, shutil, tempfile
+    import numpy as np
+    from .raster import ArraySource
+    from .pipeline import tiledInundationLevels
+    from .depthstack import depthStack
+
+    scratch = tempfile.mkdtemp(prefix="seawall_")
+    try:
+        onset = None
+        if args.connected:
+            # Inundation levels on disk, read tile by tile like the DEM
+            levels = np.lib.format.open_memmap(os.path.join(scratch, "levels.npy"), "w+", np.float32, dem.shape)
+            tiledInundationLevels(dem, args.mhw, levels, tile_size=2048, message=addMessage, scratch=scratch)
+            onset = ArraySource(levels, dem.x_min, dem.y_max, dem.cellsize)
+        depthStack(dem, args.surges, args.output, args.mhw, onset, args.tile_size, args.level_chunk,
+                   message=addMessage)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+def serveCommand(args):
+    from .delta import defaultStatePath
+    from .session import StudySession, serve
+
+    if not (args.state or args.workspace):
+        sys.stderr.write("serve needs --workspace or --state\n")
+        return 2
+    dem = None
+    if args.tiles:
+        from .tilecache import TiledDem
+        dem = TiledDem(args.tiles)
+    elif args.dem:
+        from .raster import RasterSource
+        dem = RasterSource(args.dem)
+    serve(StudySession(args.state or defaultStatePath(args.workspace), dem), args.port)
+
+def ingestCommand(args):
+    from ._compat import addMessage
+    from .raster import RasterSource
+    from .tilecache import ingestDem
+
+    dem = ingestDem(RasterSource(args.dem), args.cache, args.tile_size, args.levels, message=addMessage)
+    addMessage("{0} x {1} cells in {2} tiles of {3} cells".format(dem.shape[0], dem.shape[1], dem.stats.size,
+                                                                  dem.tile_size))
+
+def main(argv=None):
+    parser = buildParser()
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        return runCommand(args)
+    elif args.command == "economics":
+        return economicsCommand(args)
+    elif args.command == "sweep":
+        return sweepCommand(args)
+    elif args.command == "simulate":
+        return simulateCommand(args)
+    elif args.command == "ingest":
+        return ingestCommand(args)
+    elif args.command == "history":
+        return historyCommand(args)
+    elif args.command == "depths":
+        return depthsCommand(args)
+    elif args.command == "serve":
+        return serveCommand(args)
+    elif args.command == "update":
+        return updateCommand(args)
+    parser.print_help()
+    return 2
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+from collections import deque
+
+import numpy as np
+
+#---------------------------------------------------------------------------------------------------------------------#
+# CONTOUR LINES FROM A DEM (MARCHING SQUARES)
+# Each square is made of 4 cell centers: a (top left), b (top right), c (bottom right) and d (bottom left).
+# Edges are always interpolated in the same direction (top/bottom: left to right, left/right: top to bottom) so that
+# two squares sharing an edge compute exactly the same point, which is what allows joining them (even across tiles).
+#---------------------------------------------------------------------------------------------------------------------#
+TOP, RIGHT, BOTTOM, LEFT = 0, 1, 2, 3
+
+# Edges crossed by the contour for each case (a>=level)*8 + (b>=level)*4 + (c>=level)*2 + (d>=level)*1
+# Saddles (5 and 10) are listed for a center below the level; they are flipped when the center is above it
+_cases = {1: [(LEFT, BOTTOM)], 2: [(BOTTOM, RIGHT)], 3: [(LEFT, RIGHT)], 4: [(TOP, RIGHT)],
+          5: [(TOP, RIGHT), (LEFT, BOTTOM)], 6: [(TOP, BOTTOM)], 7: [(LEFT, TOP)], 8: [(LEFT, TOP)],
+          9: [(TOP, BOTTOM)], 10: [(LEFT, TOP), (BOTTOM, RIGHT)], 11: [(TOP, RIGHT)], 12: [(LEFT, RIGHT)],
+          13: [(BOTTOM, RIGHT)], 14: [(LEFT, BOTTOM)]}
+_saddles = {5: [(LEFT, TOP), (BOTTOM, RIGHT)], 10: [(TOP, RIGHT), (LEFT, BOTTOM)]}
+
+def _interpolate(z0, z1, level):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = (level - z0) / (z1 - z0)
+    return np.where(np.isfinite(t), t, 0.5)
+
+def marchingSquares(dem, level, x, y, rows=None, cols=None):
+    # Contour segments (n x 2 points x (x, y)) of the squares whose top left cell is in rows x cols
+    # (all the squares by default). x and y are the coordinates of the columns and rows of dem.
+    dem = np.asarray(dem, dtype=np.float64)
+    rows = slice(0, dem.shape[0]-1) if rows is None else rows
+    cols = slice(0, dem.shape[1]-1) if cols is None else cols
+    r = np.arange(dem.shape[0])[rows]
+    c = np.arange(dem.shape[1])[cols]
+    r = r[r < dem.shape[0]-1]
+    c = c[c < dem.shape[1]-1]
+    if len(r) == 0 or len(c) == 0:
+        return np.zeros((0, 2, 2))
+    a = dem[r[0]:r[-1]+1, c[0]:c[-1]+1]
+    b = dem[r[0]:r[-1]+1, c[0]+1:c[-1]+2]
+    cc = dem[r[0]+1:r[-1]+2, c[0]+1:c[-1]+2]
+    d = dem[r[0]+1:r[-1]+2, c[0]:c[-1]+1]
+    case = (a >= level)*8 + (b >= level)*4 + (cc >= level)*2 + (d >= level)*1
+    valid = np.isfinite(a) & np.isfinite(b) & np.isfinite(cc) & np.isfinite(d) & (case > 0) & (case < 15)
+    ii, jj = np.nonzero(valid)
+    if len(ii) == 0:
+        return np.zeros((0, 2, 2))
+    a, b, cc, d, case = a[ii, jj], b[ii, jj], cc[ii, jj], d[ii, jj], case[ii, jj]
+    x0, x1 = x[c[jj]], x[c[jj]+1]
+    y0, y1 = y[r[ii]], y[r[ii]+1]
+
+    # Crossing point on each of the 4 edges of every square
+    points = np.empty((4, len(ii), 2))
+    t = _interpolate(a, b, level)
+    points[TOP] = np.stack([x0 + t*(x1-x0), y0], axis=1)
+    t = _interpolate(b, cc, level)
+    points[RIGHT] = np.stack([x1, y0 + t*(y1-y0)], axis=1)
+    t = _interpolate(d, cc, level)
+    points[BOTTOM] = np.stack([x0 + t*(x1-x0), y1], axis=1)
+    t = _interpolate(a, d, level)
+    points[LEFT] = np.stack([x0, y0 + t*(y1-y0)], axis=1)
+
+    center_above = (a + b + cc + d) / 4 >= level
+    segments = []
+    for code, edges in _cases.items():
+        selected = case == code
+        if code in _saddles:
+            flipped = np.nonzero(selected & center_above)[0]
+            for start, end in _saddles[code]:
+                segments.append(np.stack([points[start, flipped], points[end, flipped]], axis=1))
+            selected = selected & ~center_above
+        selected = np.nonzero(selected)[0]
+        for start, end in edges:
+            segments.append(np.stack([points[start, selected], points[end, selected]], axis=1))
+    return np.concatenate(segments) if segments else np.zeros((0, 2, 2))
+
+#---------------------------------------------------------------------------------------------------------------------#
+# FUNCTION TO JOIN CONTOUR SEGMENTS INTO POLYLINES
+# Segments meet at exactly equal points, so they are matched by their coordinates
+#---------------------------------------------------------------------------------------------------------------------#
+def joinSegments(segments):
+    segments = np.asarray(segments, dtype=np.float64).reshape(-1, 2, 2)
+    ends = {}
+    for i in range(len(segments)):
+        for side in (0, 1):
+            ends.setdefault(tuple(segments[i, side]), []).append((i, side))
+
+    used = np.zeros(len(segments), dtype=bool)
+    polylines = []
+    for i in range(len(segments)):
+        if used[i]:
+            continue
+        used[i] = True
+        line = deque([tuple(segments[i, 0]), tuple(segments[i, 1])])
+        # Grow the line from its end, then from its start
+        for grow_end in (True, False):
+            while True:
+                point = line[-1] if grow_end else line[0]
+                following = [(j, side) for j, side in ends[point] if not used[j]]
+                if not following:
+                    break
+                j, side = following[0]
+                used[j] = True
+                other = tuple(segments[j, 1-side])
+                if grow_end:
+                    line.append(other)
+                else:
+                    line.appendleft(other)
+        polylines.append(np.array(list(line)))
+    return polylines
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import math
+
+import numpy as np
+
+from .aggregate import groupReduce
+
+#---------------------------------------------------------------------------------------------------------------------#
+# FUNCTION TO CALCULATE DISTANCE BETWEEN POINTS
+# https://community.esri.com/thread/158038
+#---------------------------------------------------------------------------------------------------------------------#
+def calculateDistance(x1,y1,x2,y2):
+    dist = math.sqrt((x2 - x1)**2 + (y2 - y1)**2)
+    return dist
+
+#---------------------------------------------------------------------------------------------------------------------#
+# FUNCTION TO CALCULATE DAMAGES FROM STORM
+# From FES Coastal Defense class (https://environment.yale.edu)
+#---------------------------------------------------------------------------------------------------------------------#
+def stormDamage(value, dem, surge):
+    value = float(value)
+    dem = float(dem)
+    surge = float(surge)
+    flooded = surge-dem
+    lower = dem-2
+    upper = dem+7
+    percent = max(min(flooded/(upper-lower),1),0)
+    damage = value*percent
+    return damage
+
+#---------------------------------------------------------------------------------------------------------------------#
+# Object based geoprocessing
+#---------------------------------------------------------------------------------------------------------------------#
+class parcel:
+    def __init__(self, unique_id, value, dem):
+        self.unique_id = unique_id
+        self.value = value
+        self.dem = dem
+
+class parcel_simulation:
+    def __init__(self, surges, parcel):
+        self.surges = surges
+        self.parcel = parcel
+    #def storm_damage(parcel):
+        damages = []
+        for surge in surges:
+            flooded = surge-parcel.dem
+            lower = parcel.dem-2 # meter
+            upper = parcel.dem+7
+            percent = max(min(flooded/(upper-lower),1),0)
+            damages.append(parcel.value*percent)
+        self.damages = damages
+
+#---------------------------------------------------------------------------------------------------------------------#
+# DAMAGE CURVES OF THE SEGMENTS
+# Same damages as parcel_simulation for all the parcels and surges at once (parcels x surges), summed by segment.
+# The matrix is built by chunks of parcels: chunk_size bounds its memory (about 3 x 8 bytes per parcel and surge).
+#---------------------------------------------------------------------------------------------------------------------#
+def damageMatrix(values, dems, surges):
+    values = np.asarray(values, dtype=float)[:, None]
+    dems = np.asarray(dems, dtype=float)[:, None]
+    percent = np.clip((np.asarray(surges, dtype=float)[None, :] - dems) / 9.0, 0, 1)     # (dem+7) - (dem-2)
+    return np.nan_to_num(values * percent)       # parcels without elevation (NULL MEAN) have no damage
+
+def segmentDamageCurves(segment_of_parcel, values, dems, surges, n_segments, chunk_size=None):
+    # Damage curve of each segment (segments x surges). A parcel can be listed once for each segment it touches.
+    segment_of_parcel = np.asarray(segment_of_parcel, dtype=np.int64)
+    chunk_size = chunk_size or max(len(segment_of_parcel), 1)
+    curves = np.zeros((n_segments, len(surges)))
+    for first in range(0, len(segment_of_parcel), chunk_size):
+        chunk = slice(first, first+chunk_size)
+        curves += groupReduce(segment_of_parcel[chunk], damageMatrix(values[chunk], dems[chunk], surges),
+                              n_segments)[0]
+    return curves
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+import os, json, sqlite3
+
+import numpy as np
+
+from .damage import segmentDamageCurves
+
+#---------------------------------------------------------------------------------------------------------------------#
+# PARCEL STATE OF THE LAST RUN
+# A segment's damage curve is the sum of the curves of its parcels, so a changed parcel only needs its old curve
+# subtracted and its new one added. The state keeps what that takes: each parcel's geometry hash, value, elevation
+# and segments, and each segment's wall length, ring and damage curve (one SQLite file next to the workspace).
+#---------------------------------------------------------------------------------------------------------------------#
+class ParcelState(object):
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS parcels "
+                                    "(parcel TEXT PRIMARY KEY, geometry TEXT, value REAL, elevation REAL)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS memberships (parcel TEXT, segment INTEGER)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS memberships_parcel ON memberships (parcel)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS segments "
+                                    "(segment INTEGER PRIMARY KEY, id TEXT, wall_length REAL, ring BLOB, curve BLOB)")
+
+    def isEmpty(self):
+        return self.connection.execute("SELECT COUNT(*) FROM segments").fetchone()[0] == 0
+
+    def save(self, parameters, surges, segment_ids, wall_lengths, rings, curves, parcels, memberships):
+        # Replaces the whole state. parameters: dictionary of the run settings (JSON), parcels: rows of
+        # (parcel ID, geometry hash, value, elevation), memberships: (parcel ID, segment number) pairs
+        with self.connection:
+            for table in ("meta", "parcels", "memberships", "segments"):
+                self.connection.execute("DELETE FROM " + table)
+            self.connection.executemany("INSERT INTO meta VALUES (?, ?)",
+                                        [("parameters", json.dumps(parameters)), ("surges", json.dumps(list(surges)))])
+            self.connection.executemany("INSERT INTO segments VALUES (?, ?, ?, ?, ?)", [
+                (k, str(s_id), float(length), np.asarray(ring, dtype=np.float64).tobytes(),
+                 np.asarray(curve, dtype=np.float64).tobytes())
+                for k, (s_id, length, ring, curve) in enumerate(zip(segment_ids, wall_lengths, rings, curves))])
+            self._storeParcels(parcels, memberships)
+
+    def _storeParcels(self, parcels, memberships):
+        self.connection.executemany("INSERT OR REPLACE INTO parcels VALUES (?, ?, ?, ?)", [
+            (str(p), g, float(v), None if e is None or e != e else float(e)) for p, g, v, e in parcels])
+        self.connection.executemany("INSERT INTO memberships VALUES (?, ?)",
+                                    [(str(p), int(k)) for p, k in memberships])
+
+    def parameters(self):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'parameters'").fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def surges(self):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'surges'").fetchone()
+        return json.loads(row[0]) if row else []
+
+    def segments(self):
+        # Segment IDs, wall lengths, rings and damage curves (segments x surges), in segment number order
+        rows = self.connection.execute("SELECT id, wall_length, ring, curve FROM segments ORDER BY segment").fetchall()
+        return ([row[0] for row in rows], np.array([row[1] for row in rows]),
+                [np.frombuffer(row[2], dtype=np.float64).reshape(-1, 2) for row in rows],
+                np.array([np.frombuffer(row[3], dtype=np.float64) for row in rows]).reshape(len(rows), -1))
+
+    def parcels(self, parcel_ids):
+        # {parcel ID: (geometry hash, value, elevation, [segment numbers])} of the known parcels among parcel_ids
+        parcel_ids = [str(p) for p in parcel_ids]
+        found = {}
+        for start in range(0, len(parcel_ids), 500):
+            chunk = parcel_ids[start:start+500]
+            marks = ",".join("?"*len(chunk))
+            for p, g, v, e in self.connection.execute(
+                    "SELECT parcel, geometry, value, elevation FROM parcels WHERE parcel IN ({0})".format(marks), chunk):
+                found[p] = (g, v, np.nan if e is None else e, [])
+            for p, k in self.connection.execute(
+                    "SELECT parcel, segment FROM memberships WHERE parcel IN ({0})".format(marks), chunk):
+                found[p][3].append(k)
+        return found
+
+    def arrays(self):
+        # Every parcel as arrays (IDs, values, elevations) and its memberships as (parcel row, segment number) arrays
+        rows = self.connection.execute("SELECT parcel, value, elevation FROM parcels ORDER BY rowid").fetchall()
+        ids = [row[0] for row in rows]
+        values = np.array([row[1] for row in rows], dtype=float)
+        elevations = np.array([np.nan if row[2] is None else row[2] for row in rows], dtype=float)
+        position = dict((p, i) for i, p in enumerate(ids))
+        memberships = [(position[p], k) for p, k in self.connection.execute("SELECT parcel, segment FROM memberships")
+                       if p in position]
+        parcel_of = np.array([m[0] for m in memberships], dtype=np.int64)
+        segment_of = np.array([m[1] for m in memberships], dtype=np.int64)
+        return ids, values, elevations, parcel_of, segment_of
+
+    def applyDelta(self, parcels, memberships, deleted, curves):
+        # Replaces the changed parcels (same rows as save), removes the deleted ones, and stores the new damage
+        # curves ({segment number: curve})
+        with self.connection:
+            ids = [str(p[0]) for p in parcels] + [str(p) for p in deleted]
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start+500]
+                marks = ",".join("?"*len(chunk))
+                self.connection.execute("DELETE FROM memberships WHERE parcel IN ({0})".format(marks), chunk)
+                self.connection.execute("DELETE FROM parcels WHERE parcel IN ({0})".format(marks), chunk)
+            self._storeParcels(parcels, memberships)
+            self.connection.executemany("UPDATE segments SET curve = ? WHERE segment = ?", [
+                (np.asarray(curve, dtype=np.float64).tobytes(), int(k)) for k, curve in curves.items()])
+
+    def close(self):
+        self.connection.close()
+
+def defaultStatePath(workspace):
+    # Next to the workspace, like the elevation cache
+    folder = os.path.dirname(workspace) if workspace.lower().endswith(".gdb") else workspace
+    return os.path.join(folder, "seawall_state.sqlite")
+
+#---------------------------------------------------------------------------------------------------------------------#
+# DELTA OF THE DAMAGE CURVES
+#---------------------------------------------------------------------------------------------------------------------#
+def membershipRows(parcels):
+    # (segment numbers, values, elevations) with one row per parcel and segment, from {ID: (hash, value, elev, segs)}
+    rows = [(k, v, e) for g, v, e, segments in parcels.values() for k in segments]
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0)
+    segments, values, elevations = zip(*rows)
+    return np.array(segments, dtype=np.int64), np.array(values, dtype=float), np.array(elevations, dtype=float)
+
+def updateCurves(curves, surges, old_parcels, new_parcels):
+    # Damage curves after replacing old_parcels by new_parcels (both {ID: (hash, value, elevation, segments)},
+    # deleted parcels are only in old_parcels). Returns the new curves and the segment numbers that changed.
+    curves = np.array(curves, dtype=float)
+    old = membershipRows(old_parcels)
+    new = membershipRows(new_parcels)
+    curves -= segmentDamageCurves(old[0], old[1], old[2], surges, len(curves))
+    curves += segmentDamageCurves(new[0], new[1], new[2], surges, len(curves))
+    affected = np.unique(np.concatenate([old[0], new[0]]))
+    return curves, affected
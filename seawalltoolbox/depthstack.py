@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+import os, json, zlib
+
+import numpy as np
+
+from ._compat import LazyModule
+from .raster import tileWindows
+from .pipeline import runTiles, tileSize
+
+h5py = LazyModule("h5py")
+
+#---------------------------------------------------------------------------------------------------------------------#
+# DEPTH STACK STORES
+# A 3-D array (surge levels x rows x columns) written chunk by chunk, each chunk being (level_chunk x tile x tile).
+# A directory is written in the Zarr v2 format with the zlib of the standard library (readable by zarr, xarray and
+# GDAL, or by readStackLevel below); a .h5 file with h5py when it is installed. Chunks of zeros (dry land) are not
+# written: zero is the fill value.
+#---------------------------------------------------------------------------------------------------------------------#
+class ZarrStore(object):
+    def __init__(self, path, shape, chunks, attributes, compression=5):
+        self.path = path
+        self.chunks = chunks
+        self.compression = compression
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        with open(os.path.join(path, ".zarray"), "w") as f:
+            json.dump({"zarr_format": 2, "shape": list(shape), "chunks": list(chunks), "dtype": "<f4",
+                       "compressor": {"id": "zlib", "level": compression}, "fill_value": 0.0, "order": "C",
+                       "filters": None, "dimension_separator": "."}, f)
+        with open(os.path.join(path, ".zattrs"), "w") as f:
+            json.dump(dict(attributes, _ARRAY_DIMENSIONS=["surge", "y", "x"]), f)
+
+    def write(self, level, row, col, block):
+        # Edge chunks are stored at the full chunk size (Zarr v2), padded with the fill value
+        if block.shape != tuple(self.chunks):
+            full = np.zeros(self.chunks, dtype="<f4")
+            full[:block.shape[0], :block.shape[1], :block.shape[2]] = block
+            block = full
+        key = "{0}.{1}.{2}".format(level // self.chunks[0], row // self.chunks[1], col // self.chunks[2])
+        with open(os.path.join(self.path, key), "wb") as f:
+            f.write(zlib.compress(np.ascontiguousarray(block, dtype="<f4").tobytes(), self.compression))
+
+    def close(self):
+        pass
+
+class HDF5Store(object):
+    def __init__(self, path, shape, chunks, attributes, compression=5):
+        self.file = h5py.File(path, "w")
+        self.dataset = self.file.create_dataset("depth", shape, dtype="f4", chunks=tuple(chunks), fillvalue=0.0,
+                                                compression="gzip", compression_opts=compression)
+        for key, value in attributes.items():
+            self.dataset.attrs[key] = np.nan if value is None else value
+
+    def write(self, level, row, col, block):
+        self.dataset[level:level+block.shape[0], row:row+block.shape[1], col:col+block.shape[2]] = block
+
+    def close(self):
+        self.file.close()
+
+def readStackLevel(path, level):
+    # One level (depths at one surge) of a Zarr depth stack as a 2-D array, without zarr
+    with open(os.path.join(path, ".zarray")) as f:
+        header = json.load(f)
+    (nrows, ncols), (lc, tr, tc) = header["shape"][1:], header["chunks"]
+    depths = np.full((nrows, ncols), header["fill_value"], dtype=np.float32)
+    for row in range(0, nrows, tr):
+        for col in range(0, ncols, tc):
+            key = os.path.join(path, "{0}.{1}.{2}".format(level // lc, row // tr, col // tc))
+            if os.path.exists(key):
+                with open(key, "rb") as f:
+                    block = np.frombuffer(zlib.decompress(f.read()), dtype="<f4").reshape(lc, tr, tc)
+                depths[row:row+tr, col:col+tc] = block[level % lc, :min(tr, nrows-row), :min(tc, ncols-col)]
+    return depths
+
+#---------------------------------------------------------------------------------------------------------------------#
+# DEPTH STACK
+# The DEM is read once, tile by tile; each tile gives the depths at every surge level, level_chunk levels at a time,
+# and each block is compressed and written before the next one is computed. Memory is the tiles in the pipeline plus
+# one block, whatever the number of levels.
+#   depth = max(surge - elevation, 0), NaN at or below mean high water (permanent water) and where there is no data
+# With onset (a raster source of inundation levels on the same grid, e.g. from tiledInundationLevels), only the
+# cells connected to the sea at that surge get water; without it every cell below the surge does (bathtub).
+# Depths compress well: zlib level 1 is about a third faster than level 5 for a few percent more space.
+#---------------------------------------------------------------------------------------------------------------------#
+def depthStack(source, surges, output, mean_high_water=None, onset=None, tile_size=512, level_chunk=8, compression=1,
+               depth=2, io_threads=1, message=None, memory_cap=None):
+    surges = np.asarray(surges, dtype=np.float32)
+    level_chunk = max(1, min(int(level_chunk), len(surges)))
+    # Per cell: the DEM (and onset) tile in the pipeline, the block being computed and its temporaries
+    tile_size = tileSize(tile_size, memory_cap, "depth stack", depth, cell_bytes=8 + 12*level_chunk)
+    shape = (len(surges),) + tuple(source.shape)
+    chunks = (level_chunk, min(tile_size, shape[1]), min(tile_size, shape[2]))
+    attributes = {"surges": [round(float(s), 4) for s in surges], "x_min": source.x_min, "y_max": source.y_max,
+                  "cellsize": source.cellsize, "units": "m",
+                  "mean_high_water": None if mean_high_water is None else float(mean_high_water),
+                  "connected": onset is not None}
+    store = (HDF5Store if output.lower().endswith((".h5", ".hdf5")) else ZarrStore)(output, shape, chunks, attributes,
+                                                                                   compression)
+    highest = float(surges.max())
+
+    def load(window):
+        # Tiles entirely above the highest surge are dry at every level: not read, unless they have NoData cells
+        # (NaN in the stack, not the fill value)
+        if hasattr(source, "valueRange") and hasattr(source, "readMask"):
+            vmin = source.valueRange(window.row, window.col, window.nrows, window.ncols)[0]
+            if vmin > highest and not source.readMask(window.row, window.col, window.nrows, window.ncols).any():
+                return None
+        dem = source.read(window.row, window.col, window.nrows, window.ncols)
+        levels = None if onset is None else onset.read(window.row, window.col, window.nrows, window.ncols)
+        return dem, levels
+
+    def compute(window, data):
+        if data is None:
+            return 0
+        dem, levels = data
+        masked = np.isnan(dem)
+        if mean_high_water is not None:
+            masked |= dem <= float(mean_high_water)
+        written = 0
+        for first in range(0, len(surges), level_chunk):
+            chunk = surges[first:first+level_chunk, None, None]
+            block = np.maximum(chunk - dem[None, :, :], 0)
+            if levels is not None:
+                block[levels[None, :, :] > chunk] = 0
+            block[:, masked] = np.nan
+            # NaN counts as written: only blocks of dry land are left to the fill value
+            if (block != 0).any():
+                store.write(first, window.row, window.col, block)
+                written += 1
+        return written
+
+    try:
+        results, timer = runTiles(tileWindows(source.shape, tile_size), load, compute, None, depth, io_threads,
+                                  "Depth stack ({0} levels)".format(len(surges)), message)
+    finally:
+        store.close()
+    if message is not None:
+        message("{0} of {1} blocks written to {2}".format(sum(results), len(results) * -(-len(surges)//level_chunk),
+                                                          output))
+    return output
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import math
+
+import numpy as np
+
+#---------------------------------------------------------------------------------------------------------------------#
+# SEAWALL SEGMENTS
+#---------------------------------------------------------------------------------------------------------------------#
+class class_segment:
+    # Wall cost
+    wall_base_height = 1.07
+    wall_altitude = 2.08
+    capex = 0.02
+    unit_cost = 3881.4
+    def __init__(self, s_id, wall_length):
+        #self.list_parcel = list_parcel
+        self.s_id = s_id
+        self.wall_length = wall_length
+
+    def wall_cost(segment, surges, discount_rate=0.04, useful_life=30):
+        total_wall_cost = []
+        marginal_wall_cost = [0]
+        for surge in surges:
+            wall_cost = segment.unit_cost * ((surge-segment.wall_base_height)**2) * segment.wall_length
+            annual_maintenance = wall_cost * segment.capex
+            wall_maintenance = annual_maintenance * (1-math.exp(-discount_rate * useful_life)) / discount_rate
+            total_wall_cost.append(wall_cost + wall_maintenance)
+        for i in range(len(total_wall_cost)-1):
+            marginal_wall_cost.append(total_wall_cost[i+1]-total_wall_cost[i])
+        return [total_wall_cost, marginal_wall_cost]
+#---------------------------------------------------------------------------------------------------------------------#
+
+#---------------------------------------------------------------------------------------------------------------------#
+# STORM SURGE PROBABILITY AND SEA LEVEL RISE PATHWAYS
+# GEV parameters fitted on the New Haven tide gauge annual maxima (FES Coastal Defense class)
+#---------------------------------------------------------------------------------------------------------------------#
+mu_location = 1.8181056
+sigma_scale = 0.1468738
+k_shape = 0.2965298
+inflection_point = 2.04     # below this level the GEV fit is replaced by the linear model
+slr_trend = 0.002933765     # m/year
+
+# Each pathway is (name, linear rate in m/year, acceleration in m/year^2): offset(t) = rate*t + acceleration*t^2
+# The accelerations bring the offsets to about 0.3 m, 1.0 m and 2.0 m after 100 years
+slr_scenarios = [("low", slr_trend, 0.0),
+                 ("intermediate", slr_trend, 0.0000707),
+                 ("high", slr_trend, 0.000171)]
+
+def slrPathways(scenarios, years):
+    # Sea level offsets for each scenario and year: scenarios x years array (year 0 has no offset)
+    t = np.arange(years, dtype=float)
+    rates = np.array([float(s[1]) for s in scenarios])
+    accelerations = np.array([float(s[2]) for s in scenarios])
+    return rates[:, None] * t[None, :] + accelerations[:, None] * t[None, :]**2
+
+def surgeProbability(surges, p_slr):
+    # Probability of each surge level for every sea level offset: p_slr.shape + (len(surges),)
+    surges = np.asarray(surges, dtype=float)
+    p = np.asarray(p_slr, dtype=float)[..., None]
+    # Clip the GEV support so that the branch not taken by np.where does not produce NaNs
+    upper = np.maximum(1+k_shape*((surges+0.01)-(mu_location+p))/sigma_scale, 1e-12)
+    lower = np.maximum(1+k_shape*((surges-0.01)-(mu_location+p))/sigma_scale, 1e-12)
+    gev = np.exp(-1*upper**(-1/k_shape)) - np.exp(-1*lower**(-1/k_shape))
+    linear = 1.25-1.11*(surges-p)+0.25*(surges-p)**2 # linear model
+    return np.where(surges > (inflection_point+p), gev, linear)
+
+def expectedDamages(damages_by_surge, surges, p_slr, discount_rate=0.04):
+    # Discounted expected damages of every damage curve under every SLR pathway in one evaluation
+    # damages_by_surge is (..., surges) (e.g. segments x surges) and p_slr is scenarios x years
+    # The result is scenarios x ... x surges
+    damages_by_surge = np.asarray(damages_by_surge, dtype=float)
+    p_slr = np.atleast_2d(p_slr)
+    discount = np.exp(-discount_rate*(np.arange(p_slr.shape[1])+1)) # (year+1) to be verified
+    # Collapse the years first so that the damage curves are only touched once per scenario
+    weights = (surgeProbability(surges, p_slr) * discount[None, :, None]).sum(axis=1)
+    weights = weights.reshape((weights.shape[0],) + (1,)*(damages_by_surge.ndim-1) + (weights.shape[1],))
+    return weights * damages_by_surge[None, ...]
+
+def efficientHeights(surges, marginal_benefits, marginal_costs):
+    # Wall heights where marginal benefits cross marginal costs, with the net benefits up to that height
+    # Works on any leading shape: returns the index of each crossing, the heights and the net benefits
+    difference = np.asarray(marginal_benefits, dtype=float) - np.asarray(marginal_costs, dtype=float)
+    net_benefits = np.cumsum(difference, axis=-1)
+    crossings = np.nonzero(np.diff(np.sign(difference), axis=-1))
+    i = crossings[-1]
+    # Benefits totalling sum(marginal_benefits[0:i]) - sum(marginal_costs[0:i])
+    totals = np.where(i > 0, net_benefits[crossings[:-1] + (np.maximum(i-1, 0),)], 0.0)
+    return crossings, np.asarray(surges)[i], totals
+#---------------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+import heapq
+from collections import deque
+
+import numpy as np
+
+#---------------------------------------------------------------------------------------------------------------------#
+# INUNDATION LEVEL INDEX (PRIORITY-FLOOD)
+# For every DEM cell, the lowest water level at which the cell is connected to the sea: the highest elevation on the
+# best path from the sea to the cell. Depressions below the surge that are not connected to the sea stay dry until the
+# water passes over their rim. Computed once, any surge then becomes a threshold: flooded = levels <= surge.
+#
+# Barnes, Lehman & Mulla (2014) Priority-Flood, with the plain queue for cells inside depressions (Algorithm 3):
+# cells below the current water level do not need the priority queue.
+#---------------------------------------------------------------------------------------------------------------------#
+def seaSeeds(dem, mean_high_water):
+    # Default sea: the cells on the edge of the DEM at or below mean high water
+    dem = np.asarray(dem)
+    seeds = np.zeros(dem.shape, dtype=bool)
+    border = np.zeros(dem.shape, dtype=bool)
+    border[0, :] = border[-1, :] = border[:, 0] = border[:, -1] = True
+    with np.errstate(invalid="ignore"):
+        seeds[border] = dem[border] <= float(mean_high_water)
+    return seeds
+
+def inundationLevels(dem, seeds, connectivity=8):
+    # NoData (NaN) cells are never flooded and block the water
+    dem = np.asarray(dem, dtype=np.float64)
+    nrows, ncols = dem.shape
+    # Padding with one NoData ring removes all the bound checks
+    width = ncols + 2
+    padded = np.full((nrows+2, width), np.nan)
+    padded[1:-1, 1:-1] = dem
+    elevation = padded.ravel().tolist()
+    closed = np.isnan(padded).ravel()
+    levels = np.full(padded.size, np.inf)
+
+    if connectivity == 8:
+        offsets = [-width-1, -width, -width+1, -1, 1, width-1, width, width+1]
+    else:
+        offsets = [-width, -1, 1, width]
+
+    heap = []
+    seed_cells = np.flatnonzero(np.pad(np.asarray(seeds, dtype=bool), 1).ravel() & ~closed)
+    for cell in seed_cells.tolist():
+        heap.append((elevation[cell], cell))
+        levels[cell] = elevation[cell]
+    closed[seed_cells] = True
+    heapq.heapify(heap)
+    closed = closed.tolist()
+    levels = levels.tolist()
+
+    pit = deque()
+    while heap or pit:
+        if pit:
+            level, cell = pit.popleft()
+        else:
+            level, cell = heapq.heappop(heap)
+        for offset in offsets:
+            neighbour = cell + offset
+            if closed[neighbour]:
+                continue
+            closed[neighbour] = True
+            if elevation[neighbour] <= level:
+                # Inside a depression: filled at the current level
+                levels[neighbour] = level
+                pit.append((level, neighbour))
+            else:
+                levels[neighbour] = elevation[neighbour]
+                heapq.heappush(heap, (elevation[neighbour], neighbour))
+
+    return np.array(levels, dtype=np.float64).reshape(nrows+2, width)[1:-1, 1:-1]
+
+#---------------------------------------------------------------------------------------------------------------------#
+# ONE TILE OF A LARGER DEM
+# Barnes (2016) Parallel Priority-Flood: each tile is flooded from its own edge. Every edge cell that is not reached
+# first by a lower one starts a new watershed label (label 0 is the sea). Where two watersheds touch, the water level
+# needed to pass from one to the other is recorded (spill edges). Once all the tiles and the edges between tiles are
+# known, the level at which the sea reaches each label is a small graph problem (see pipeline.py).
+#---------------------------------------------------------------------------------------------------------------------#
+def labelledFlood(dem, seeds, connectivity=8):
+    # Returns the levels within the tile, the labels (-1 where never reached), the number of labels, and the spill
+    # edges {(label a, label b): level}
+    dem = np.asarray(dem, dtype=np.float64)
+    nrows, ncols = dem.shape
+    width = ncols + 2
+    padded = np.full((nrows+2, width), np.nan)
+    padded[1:-1, 1:-1] = dem
+    elevation = padded.ravel().tolist()
+    nodata = np.isnan(padded).ravel()
+    levels = np.full(padded.size, np.inf)
+    labels = np.full(padded.size, -1, dtype=np.int64)
+
+    if connectivity == 8:
+        offsets = [-width-1, -width, -width+1, -1, 1, width-1, width, width+1]
+    else:
+        offsets = [-width, -1, 1, width]
+
+    edge = np.zeros((nrows+2, width), dtype=bool)
+    edge[1, 1:-1] = edge[-2, 1:-1] = edge[1:-1, 1] = edge[1:-1, -2] = True
+    sea = np.pad(np.asarray(seeds, dtype=bool), 1).ravel() & ~nodata
+    edge = edge.ravel() & ~nodata & ~sea
+    heap = []
+    for cell in np.flatnonzero(sea | edge).tolist():
+        heap.append((elevation[cell], cell))
+    sea_cells = np.flatnonzero(sea)
+    levels[sea_cells] = padded.ravel()[sea_cells]
+    labels[sea_cells] = 0
+    heapq.heapify(heap)
+    levels = levels.tolist()
+    labels = labels.tolist()
+    nodata = nodata.tolist()
+    edge = edge.tolist()
+
+    n_labels = 1
+    spills = {}
+    pit = deque()
+    while heap or pit:
+        if pit:
+            cell = pit.popleft()
+        else:
+            cell = heapq.heappop(heap)[1]
+            if labels[cell] < 0:
+                # An edge cell no lower watershed has reached: a new one
+                labels[cell] = n_labels
+                levels[cell] = elevation[cell]
+                n_labels += 1
+        level, label = levels[cell], labels[cell]
+        for offset in offsets:
+            neighbour = cell + offset
+            if nodata[neighbour]:
+                continue
+            other = labels[neighbour]
+            if other >= 0:
+                if other != label:
+                    key = (label, other) if label < other else (other, label)
+                    spill = max(level, levels[neighbour])
+                    if spill < spills.get(key, np.inf):
+                        spills[key] = spill
+                continue
+            labels[neighbour] = label
+            if edge[neighbour]:
+                # Already waiting in the priority queue
+                levels[neighbour] = max(elevation[neighbour], level)
+            elif elevation[neighbour] <= level:
+                levels[neighbour] = level
+                pit.append(neighbour)
+            else:
+                levels[neighbour] = elevation[neighbour]
+                heapq.heappush(heap, (elevation[neighbour], neighbour))
+
+    levels = np.array(levels, dtype=np.float64).reshape(nrows+2, width)[1:-1, 1:-1]
+    labels = np.array(labels, dtype=np.int64).reshape(nrows+2, width)[1:-1, 1:-1]
+    return levels, labels, n_labels, spills
+
+def spillLevels(n_labels, spills):
+    # Level at which the sea (label 0) reaches each label: lowest possible highest spill on the way (inf if never)
+    neighbours = [[] for i in range(n_labels)]
+    for (a, b), level in spills.items():
+        neighbours[a].append((b, level))
+        neighbours[b].append((a, level))
+    reached = [np.inf] * n_labels
+    reached[0] = -np.inf
+    heap = [(-np.inf, 0)]
+    while heap:
+        level, label = heapq.heappop(heap)
+        if level > reached[label]:
+            continue
+        for other, spill in neighbours[label]:
+            spill = max(level, spill)
+            if spill < reached[other]:
+                reached[other] = spill
+                heapq.heappush(heap, (spill, other))
+    return np.array(reached)
+
+#---------------------------------------------------------------------------------------------------------------------#
+# QUERIES ON THE INDEX
+#---------------------------------------------------------------------------------------------------------------------#
+class InundationIndex(object):
+    def __init__(self, levels, x_min=0.0, y_max=0.0, cellsize=1.0):
+        self.levels = np.asarray(levels, dtype=np.float32)
+        self.x_min = float(x_min)
+        self.y_max = float(y_max)
+        self.cellsize = float(cellsize)
+        self._sorted = None
+
+    @classmethod
+    def fromSource(cls, source, mean_high_water, sea=None, connectivity=8, tile_size=None, memory_cap=None,
+                   output=None):
+        # Runs the priority-flood once over a whole raster source (see raster.py). With a tile size or a memory cap
+        # (bytes), the DEM is flooded tile by tile into output (e.g. numpy.lib.format.open_memmap), with the same result.
+        if tile_size or memory_cap:
+            from .pipeline import tiledInundationLevels
+            levels = tiledInundationLevels(source, mean_high_water, output, sea, tile_size, connectivity,
+                                           memory_cap=memory_cap)
+            return cls(levels, source.x_min, source.y_max, source.cellsize)
+        dem = source.read(0, 0, source.shape[0], source.shape[1])
+        seeds = seaSeeds(dem, mean_high_water) if sea is None else sea
+        return cls(inundationLevels(dem, seeds, connectivity), source.x_min, source.y_max, source.cellsize)
+
+    def flooded(self, surge):
+        return self.levels <= float(surge)
+
+    def floodedArea(self, surges):
+        # Flooded area for any number of surge levels with one sort and a binary search
+        if self._sorted is None:
+            values = self.levels.ravel()
+            self._sorted = np.sort(values[np.isfinite(values)])
+        return np.searchsorted(self._sorted, np.asarray(surges, dtype=np.float32), side="right") * self.cellsize**2
+
+    def cellOf(self, x, y):
+        rows = np.floor((self.y_max - np.asarray(y, dtype=float)) / self.cellsize).astype(np.int64)
+        cols = np.floor((np.asarray(x, dtype=float) - self.x_min) / self.cellsize).astype(np.int64)
+        inside = (rows >= 0) & (rows < self.levels.shape[0]) & (cols >= 0) & (cols < self.levels.shape[1])
+        return rows, cols, inside
+
+    def onsetAtPoints(self, x, y):
+        # Water level at which each point (e.g. parcel centroids) gets flooded; NaN outside the DEM
+        rows, cols, inside = self.cellOf(x, y)
+        onset = np.full(rows.shape, np.nan)
+        onset[inside] = self.levels[rows[inside], cols[inside]]
+        return onset
+
+    def onsetByZone(self, zones, n_zones):
+        # Water level at which the first cell of each zone (e.g. parcels rasterized on the DEM grid) gets flooded
+        zones = np.asarray(zones)
+        inside = np.isfinite(zones) & (zones >= 0) & np.isfinite(self.levels)
+        onset = np.full(n_zones, np.inf)
+        np.minimum.at(onset, zones[inside].astype(np.int64), self.levels[inside])
+        return onset
+
+    def save(self, path):
+        np.savez_compressed(path, levels=self.levels, georeference=[self.x_min, self.y_max, self.cellsize])
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        x_min, y_max, cellsize = data["georeference"]
+        return cls(data["levels"], x_min, y_max, cellsize)
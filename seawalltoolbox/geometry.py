@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+#---------------------------------------------------------------------------------------------------------------------#
+# POLYLINES AS ARRAYS
+# A polyline is an (n, 2) array of coordinates. A closed polyline repeats its first vertex at the end.
+#---------------------------------------------------------------------------------------------------------------------#
+def dropRepeatedVertices(line):
+    line = np.asarray(line, dtype=np.float64).reshape(-1, 2)
+    if len(line) < 2:
+        return line
+    keep = np.concatenate([[True], np.any(np.diff(line, axis=0) != 0, axis=1)])
+    return line[keep]
+
+def isClosed(line):
+    return len(line) > 3 and np.array_equal(line[0], line[-1])
+
+def cumulativeLength(line):
+    return np.concatenate([[0.0], np.cumsum(np.sqrt((np.diff(line, axis=0)**2).sum(axis=1)))])
+
+def lineLengths(lines):
+    return np.array([cumulativeLength(line)[-1] if len(line) > 1 else 0.0 for line in lines])
+
+#---------------------------------------------------------------------------------------------------------------------#
+# SMOOTHING (PAEK-LIKE)
+# Like PAEK (Polynomial Approximation with Exponential Kernel), each vertex is replaced by an average of the line
+# around it weighted by exp(-distance along the line / tolerance). The line is first resampled at a regular step so
+# that the average is a plain convolution.
+#---------------------------------------------------------------------------------------------------------------------#
+def smoothLine(line, tolerance, step=None):
+    line = dropRepeatedVertices(line)
+    if len(line) < 3 or not tolerance:
+        return line
+    closed = isClosed(line)
+    step = float(step) if step else tolerance/4.0
+    distance = cumulativeLength(line)
+    n = max(int(np.ceil(distance[-1]/step)), 2)
+    s = np.linspace(0.0, distance[-1], n+1)
+    x = np.interp(s, distance, line[:, 0])
+    y = np.interp(s, distance, line[:, 1])
+
+    half = int(np.ceil(3*tolerance/step))
+    kernel = np.exp(-np.abs(np.arange(-half, half+1)) * (distance[-1]/n) / tolerance)
+    if closed:
+        # Wrap around so that the ring stays closed and smooth where it starts
+        x, y = x[:-1], y[:-1]
+        half = min(half, len(x)-1)
+        kernel = kernel[len(kernel)//2-half:len(kernel)//2+half+1]
+        wrap = lambda values: np.concatenate([values[-half:], values, values[:half]])
+        x = np.convolve(wrap(x), kernel, "valid") / kernel.sum()
+        y = np.convolve(wrap(y), kernel, "valid") / kernel.sum()
+        smoothed = np.stack([x, y], axis=1)
+        return np.concatenate([smoothed, smoothed[:1]])
+    # Open lines: normalized convolution, and the ends do not move
+    weights = np.convolve(np.ones(len(x)), kernel, "same")
+    smoothed = np.stack([np.convolve(x, kernel, "same") / weights, np.convolve(y, kernel, "same") / weights], axis=1)
+    smoothed[0], smoothed[-1] = line[0], line[-1]
+    return smoothed
+
+#---------------------------------------------------------------------------------------------------------------------#
+# SIMPLIFICATION (DOUGLAS-PEUCKER)
+# One pending range at a time, but the distances of all the vertices of a range are computed at once
+#---------------------------------------------------------------------------------------------------------------------#
+def douglasPeucker(line, tolerance):
+    line = dropRepeatedVertices(line)
+    if len(line) < 3 or not tolerance:
+        return line
+    if isClosed(line):
+        # Split the ring at its farthest vertex from the start so that both halves have distinct ends
+        far = int(np.argmax(((line - line[0])**2).sum(axis=1)))
+        first = douglasPeucker(line[:far+1], tolerance)
+        second = douglasPeucker(line[far:], tolerance)
+        return np.concatenate([first, second[1:]])
+    keep = np.zeros(len(line), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(line)-1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a, b = line[start], line[end]
+        points = line[start+1:end]
+        ab = b - a
+        length = np.hypot(ab[0], ab[1])
+        if length == 0:
+            distances = np.hypot(points[:, 0]-a[0], points[:, 1]-a[1])
+        else:
+            distances = np.abs(ab[0]*(points[:, 1]-a[1]) - ab[1]*(points[:, 0]-a[0])) / length
+        i = int(np.argmax(distances))
+        if distances[i] > tolerance:
+            middle = start + 1 + i
+            keep[middle] = True
+            stack.append((start, middle))
+            stack.append((middle, end))
+    return line[keep]
+
+#---------------------------------------------------------------------------------------------------------------------#
+# CONTOUR POST-PROCESSING
+# Same steps as the two SmoothLine passes of createContour: smooth, drop the short lines, smooth again, then
+# optionally simplify so that the segmentation has fewer vertices to work with
+#---------------------------------------------------------------------------------------------------------------------#
+def filterByLength(lines, min_length):
+    lengths = lineLengths(lines)
+    return [line for line, length in zip(lines, lengths) if length >= min_length]
+
+def processContourLines(lines, smoothing=10.0, min_length=0.0, simplify=None):
+    lines = [smoothLine(line, smoothing) for line in lines]
+    lines = filterByLength(lines, min_length)
+    lines = [smoothLine(line, smoothing) for line in lines]
+    if simplify:
+        lines = [douglasPeucker(line, simplify) for line in lines]
+    return lines
+
+def defaultContourLength(demValue):
+    # Values given are based on visual analysis of the Branford case
+    return 5000 if float(demValue) < 5 else 2000
+
+#---------------------------------------------------------------------------------------------------------------------#
+# POINTS IN POLYGONS
+# Even-odd rule, all the candidate points against all the edges of one polygon at a time
+#---------------------------------------------------------------------------------------------------------------------#
+def pointsInPolygons(points, rings, max_pairs=2000000):
+    # Index of the first ring containing each point, -1 when none does
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    inside_of = np.full(len(points), -1, dtype=np.int64)
+    for k, ring in enumerate(rings):
+        ring = np.asarray(ring, dtype=np.float64)
+        if len(ring) < 3:
+            continue
+        x_min, y_min = ring.min(axis=0)
+        x_max, y_max = ring.max(axis=0)
+        candidates = np.nonzero((inside_of < 0) & (points[:, 0] >= x_min) & (points[:, 0] <= x_max) &
+                                (points[:, 1] >= y_min) & (points[:, 1] <= y_max))[0]
+        if len(candidates) == 0:
+            continue
+        a, b = ring, np.roll(ring, -1, axis=0)
+        chunk = max(1, int(max_pairs // len(ring)))
+        for first in range(0, len(candidates), chunk):
+            chosen = candidates[first:first+chunk]
+            px, py = points[chosen, 0][:, None], points[chosen, 1][:, None]
+            straddle = (a[None, :, 1] > py) != (b[None, :, 1] > py)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                crossing_x = a[None, :, 0] + (py - a[None, :, 1]) * (b[None, :, 0] - a[None, :, 0]) / \
+                             (b[None, :, 1] - a[None, :, 1])
+            inside = (np.count_nonzero(straddle & (px < crossing_x), axis=1) % 2) == 1
+            inside_of[chosen[inside]] = k
+    return inside_of
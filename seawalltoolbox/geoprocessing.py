@@ -0,0 +1,667 @@
+# -*- coding: utf-8 -*-
+import os
+from datetime import datetime
+
+import numpy as np
+
+from ._compat import arcpy, clock, long
+from .damage import calculateDistance
+from .cache import geometryHash, cachedElevations
+from .assessor import parcelKey
+from .raster import RasterSource, bilinearSample
+from .pipeline import tiledContour, tiledZonalMean
+from .polygons import assemblePolygons
+from .geometry import processContourLines, defaultContourLength, pointsInPolygons
+from .aggregate import segmentMetrics
+from .linref import splitLines
+from .writers import writeGeoPackage, writeGeoParquet, wkbTypes, projjson, parquetPath
+
+#---------------------------------------------------------------------------------------------------------------------#
+# FUNCTION FOR SPATIAL JOIN
+# http://pro.arcgis.com/en/pro-app/tool-reference/analysis/spatial-join.htm
+# https://gis.stackexchange.com/questions/199754/arcpy-field-mapping-for-a-spatial-join-keep-only-specific-columns
+#---------------------------------------------------------------------------------------------------------------------#
+def spatialJoin(target_feature, source_feature, in_field, out_field, match_option, stats, output):
+    fieldmappings = arcpy.FieldMappings()
+    fieldmappings.addTable(target_feature)
+    fieldmappings.addTable(source_feature)
+
+    # Remove unnecessary fields
+    # We'll ultimately use length and ID so we keep it here
+    #keepers = [in_field, "Id"]
+    keepers = ["Id"] + in_field     # list ==> easier way of keeping all the necessary columns
+    for field in fieldmappings.fields:
+        if field.name not in keepers:
+             fieldmappings.removeFieldMap(fieldmappings.findFieldMapIndex(field.name))
+
+    zonal_field_stats = fieldmappings.findFieldMapIndex(in_field[0])    # get the field of interest from the field list
+    fieldmap = fieldmappings.getFieldMap(zonal_field_stats)
+    field = fieldmap.outputField
+    field.name = out_field
+    field.aliasName = out_field
+    fieldmap.outputField = field
+    fieldmap.mergeRule = stats
+    fieldmappings.replaceFieldMap(zonal_field_stats, fieldmap)
+
+    # Now joining. 10 Feet is my assumption of tolerance based on my method
+    return arcpy.SpatialJoin_analysis(target_features=target_feature, join_features=source_feature,\
+                                    out_feature_class=output, join_operation="JOIN_ONE_TO_ONE",\
+                                    join_type="KEEP_ALL", field_mapping=fieldmappings,\
+                                    match_option=match_option)#, "10 Feet") # using INTERSECT may extract unnecessary segments
+
+#---------------------------------------------------------------------------------------------------------------------#
+# FUNCTION TO CREATE CONTOUR LINES FROM A SPECIFIC DEM VALUE
+#---------------------------------------------------------------------------------------------------------------------#
+def createContour(contourLines, demValue, smoothing=10, min_length=None, simplify=1, dem=None, tile_size=2048,\
+                  memory_cap=None):
+    # smoothing (PAEK-like tolerance), min_length (shorter lines are noise) and simplify (Douglas-Peucker tolerance,
+    # None to keep every vertex) are in map units (Feet). By default min_length is 5000 below 5 Feet and 2000 above,
+    # the values of my visual analysis of the Branford case.
+    # With dem, the contour is traced from the DEM tile by tile (pipeline.py, pieces joined across the tile edges)
+    # instead of being selected from the pre-created contourLines: the DEM is never read at once.
+    # Start a timer
+    time1 = clock()
+    arcpy.AddMessage("\nCreating countour line at "+str(demValue)+" Feet. "+str(datetime.now()))
+    if min_length is None:
+        min_length = defaultContourLength(demValue)
+
+    if dem is not None:
+        raw_contours = tiledContour(RasterSource(dem), float(demValue), tile_size, message=arcpy.AddMessage,\
+                                    memory_cap=memory_cap)
+        spatial_reference = arcpy.Describe(dem).spatialReference
+    else:
+        # Select the corresponding contour lines, straight into arrays
+        field = arcpy.AddFieldDelimiters(contourLines, "dem")    # rechange back to 'Contour'
+        raw_contours = readPolylines(contourLines, "{0} = {1}".format(field, demValue))
+        spatial_reference = arcpy.Describe(contourLines).spatialReference
+
+    # Smooth, remove the small lines, smooth again to remove other noises and for better visualization,
+    # then simplify: every following step works on fewer vertices
+    contours = processContourLines(raw_contours, smoothing, min_length, simplify)
+
+    # Write the remaining polylines as only one feature (Necessary for coastal segment delimitation)
+    dissolved = writePolylines(contours, 'contours'+str(demValue)+'.shp', spatial_reference)
+
+    # Get the time (Stop the timer). And send success message.
+    time2 = clock()
+    arcpy.AddMessage("Contour line successfully created at "+str(demValue)+" Feet ("\
+                     +str(sum(len(line) for line in raw_contours))+" vertices in, "\
+                     +str(sum(len(line) for line in contours))+" vertices out). It took "\
+                     +str(time2-time1)+" seconds")
+
+    return dissolved
+
+#---------------------------------------------------------------------------------------------------------------------#
+# FUNCTIONS TO MOVE GEOMETRIES BETWEEN FEATURE CLASSES AND ARRAYS
+#---------------------------------------------------------------------------------------------------------------------#
+def readPolylines(feature_class, where_clause=None):
+    # One array of coordinates per part of each polyline
+    lines = []
+    with arcpy.da.SearchCursor(feature_class, ["SHAPE@"], where_clause) as features:
+        for feature in features:
+            if feature[0] is None:
+                continue
+            for part in feature[0]:
+                lines.append(np.array([(point.X, point.Y) for point in part if point is not None]))
+    return lines
+
+def readPoints(feature_class):
+    return np.array([row[0] for row in arcpy.da.SearchCursor(feature_class, ["SHAPE@XY"])], dtype=float).reshape(-1, 2)
+
+def writePolylines(lines, output, spatial_reference):
+    # All the lines as the parts of one polyline feature
+    arcpy.CreateFeatureclass_management(arcpy.env.workspace, output, "POLYLINE", spatial_reference=spatial_reference)
+    parts = arcpy.Array([arcpy.Array([arcpy.Point(x, y) for x, y in line]) for line in lines])
+    with arcpy.da.InsertCursor(output, ["SHAPE@"]) as rows:
+        rows.insertRow([arcpy.Polyline(parts, spatial_reference)])
+    return output
+
+def writePolygons(polygons, output, spatial_reference):
+    # Polygons from assemblePolygons, with their Id and seawall length (AOI_Length)
+    arcpy.CreateFeatureclass_management(arcpy.env.workspace, output, "POLYGON", spatial_reference=spatial_reference)
+    arcpy.AddField_management(output, "Id", "LONG")
+    arcpy.AddField_management(output, "AOI_Length", "LONG")
+    with arcpy.da.InsertCursor(output, ["SHAPE@", "Id", "AOI_Length"]) as rows:
+        for i, polygon in enumerate(polygons):
+            ring = arcpy.Array([arcpy.Point(x, y) for x, y in polygon["ring"]])
+            rows.insertRow([arcpy.Polygon(ring, spatial_reference), i, int(round(polygon["wall_length"]))])
+    return output
+
+def readPolygons(feature_class, fields):
+    # Outer ring of the first part of each polygon, and the requested fields
+    rings, rows = [], []
+    with arcpy.da.SearchCursor(feature_class, ["SHAPE@"] + fields) as features:
+        for feature in features:
+            part = feature[0].getPart(0) if feature[0] is not None else []
+            ring = []
+            for point in part:
+                if point is None:
+                    break           # the inner rings come after a null point
+                ring.append((point.X, point.Y))
+            rings.append(np.array(ring, dtype=float).reshape(-1, 2))
+            rows.append(feature[1:])
+    return rings, rows
+
+#---------------------------------------------------------------------------------------------------------------------#
+# FUNCTION TO DELIMITE THE SEGMENTS
+#---------------------------------------------------------------------------------------------------------------------#
+def createSegmentsOfLowLands(contour_at_mean_high_water, contour_at_surge):
+    # Start a timer
+    time1 = clock()
+    arcpy.AddMessage("\nSegmentation of the coastline started at "+str(datetime.now()))
+
+    # Specify a tolerance distance or minimum length of a seawall
+    # Users are not yet given control of this
+    th = 150
+
+    # Create random points along the lines (mean high water and the surge of choice)
+    # The numbers used are just my choice based on iterative observations
+    random0 = arcpy.CreateRandomPoints_management(out_path= arcpy.env.workspace, \
+                                                out_name= "random0", \
+                                                constraining_feature_class= contour_at_mean_high_water, \
+                                                number_of_points_or_field= long(1600), \
+                                                  minimum_allowed_distance = "{0} Feet".format(th))
+
+    random1 = arcpy.CreateRandomPoints_management(out_path= arcpy.env.workspace, \
+                                                    out_name= "random1", \
+                                                    constraining_feature_class= contour_at_surge, \
+                                                    number_of_points_or_field= long(1600), \
+                                                  minimum_allowed_distance = "{0} Feet".format(th))
+
+    # Perform a proximity analysis with the NEAR tool
+    arcpy.Near_analysis(random0, random1)
+    # Give each point a fixed unique ID
+    # Create the ID field
+    arcpy.AddField_management (random0, "UniqueID", "SHORT")
+    arcpy.AddField_management (random1, "UniqueID", "SHORT")
+    # Add Unique IDs
+    arcpy.CalculateField_management(random0, "UniqueID", "[FID]")
+    arcpy.CalculateField_management(random1, "UniqueID", "[FID]")
+
+    # Categorize/Separate each feature based on their near feature
+    # Crate a table view of random0
+    table0 = arcpy.MakeTableView_management(random0, "random0_table")
+    #table1 = arcpy.MakeTableView_management(random1, "random1_table")
+    # Sort the near feature for each points in random0
+    random0_sorted = arcpy.Sort_management(table0, "random0_sorted.dbf", [["NEAR_FID", "ASCENDING"]])
+
+
+    # Create "long enough" lists for each of the field of interests: ID, NEAR_ID, and NEAR_DIST
+    # (distance to closest point). I added [99999] here to extend the list length and avoid IndexError
+    list_fid = [r.getValue("UniqueID") for r in arcpy.SearchCursor(random0_sorted, ["UniqueID"])] +[99999]
+    list_nearid = [r.getValue("NEAR_FID") for r in arcpy.SearchCursor(random0_sorted, ["NEAR_FID"])]\
+                  +[99999]
+    list_neardist = [r.getValue("NEAR_DIST") for r in arcpy.SearchCursor(random0_sorted, ["NEAR_DIST"])]\
+                    +[99999]
+
+    # Only take points with near feature within the specified threshold. If it's too far, it's not better
+    # than the others for a segment point
+    list_fid_filtered = [i for i in list_neardist if i < th]
+    # Then initiate a list o contain their Unique ID and Near ID
+    first_unique_id = []
+    first_near_id = []
+    # Get NEAR_ID and Unique ID for each of these points
+    for i in list_fid_filtered:
+        first_unique_id.append(list_fid[list_neardist.index(i)])
+        first_near_id.append(list_nearid[list_neardist.index(i)])
+
+    # Only take the unique values in case there are duplicates. This shoudn't happen. Just to make sure.
+    first_unique_id = [i for i in set(first_unique_id)]
+    first_near_id = [i for i in set(first_near_id)]
+
+
+    # Now create a new feature out of these points
+    # Frist let's create a Feature Layer
+    arcpy.MakeFeatureLayer_management("random0.shp", "random0_lyr")
+    # Let's select all points and export them into a new feature
+    random0_points = arcpy.SearchCursor(random0, ["UniqueID"])
+    point0 = random0_points.next()
+
+    for point0 in random0_points:
+        for i in range(len(first_unique_id)):
+            if point0.getValue("UniqueID") == first_unique_id[i]:
+                selector0 = arcpy.SelectLayerByAttribute_management(\
+                     "random0_lyr", "ADD_TO_SELECTION", '"UniqueID" = {0}'.format(first_unique_id[i]))
+
+    del point0, random0_points
+
+    new_random0 = arcpy.CopyFeatures_management(selector0, "new_random0")
+    arcpy.Delete_management('random0_lyr')
+
+
+    # Now for the new point feature, remove clusters of points around them and take only the ones
+    # with minimum NEAR_DIST
+    # First, get the geometry attributes of the new points
+    arcpy.AddGeometryAttributes_management(new_random0, "POINT_X_Y_Z_M", "", "", "")
+
+    # Create long enough list of the field of interest (same as the previous)
+    pointx = [r.getValue("POINT_X") for r in arcpy.SearchCursor(new_random0, ["POINT_X"])] +[99999]
+    pointy = [r.getValue("POINT_Y") for r in arcpy.SearchCursor(new_random0, ["POINT_Y"])] +[99999]
+    new_list_fid = [r.getValue("UniqueID") for r in arcpy.SearchCursor(new_random0, ["UniqueID"])]\
+                   +[99999]
+    new_list_nearid = [r.getValue("NEAR_FID") for r in arcpy.SearchCursor(new_random0, ["NEAR_FID"])]\
+                      +[99999]
+    new_list_neardist = [r.getValue("NEAR_DIST") for r in arcpy.SearchCursor(new_random0, ["NEAR_DIST"])]\
+                        +[99999]
+
+
+    # Initiate a list of every points that has already been compared to the near points
+    garbage = []
+    # Also initiate a list for the new Unique ID and NEAR ID
+    new_unique_ID = []
+    new_near_ID = []
+    # Then, check if the points are right next to them. If so, add them to a temporary list
+    # and find the one with closest near ID (or find minimum of their NEAR_DIST)
+    for i in range(len(pointx)):
+        if i+1 < len(pointx):
+
+            # If not within the th range
+            if not calculateDistance(pointx[i], pointy[i], pointx[i+1], pointy[i+1]) < float(th)*1.5:
+                # Skip if it's in garbage
+                if new_list_nearid[i] in garbage:
+                    continue
+                else:
+                    new_unique_ID.append(new_list_fid[i])
+                    new_near_ID.append(new_list_nearid[i])
+
+            # If within the range
+            else:
+                # Skip if it's in garbage
+                if new_list_nearid[i] in garbage:
+                    continue
+                else:
+                    temp_ID = []
+                    temp_NEAR = []
+                    temp_DIST = []
+                    while True:
+                        temp_ID.append(new_list_fid[i])
+                        temp_NEAR.append(new_list_nearid[i])
+                        temp_DIST.append(new_list_neardist[i])
+                        garbage.append(new_list_nearid[i])
+                        i = i+1
+                        # Stop when within the range again. And add the last point within the range
+                        if not calculateDistance(pointx[i], pointy[i], pointx[i+1], pointy[i+1]) < 200:
+                            temp_ID.append(new_list_fid[i])
+                            temp_NEAR.append(new_list_nearid[i])
+                            temp_DIST.append(new_list_neardist[i])
+                            garbage.append(new_list_nearid[i])
+
+                            # Calculate the minimum and get the Unique ID and Near ID
+                            minD = min(temp_DIST)
+                            new_unique_ID.append(new_list_fid[new_list_neardist.index(minD)])
+                            new_near_ID.append(new_list_nearid[new_list_neardist.index(minD)])
+
+                            del temp_ID, temp_NEAR, temp_DIST
+                            break
+
+
+    # Now select these final points export them into new feature.
+    # These are the end points for the segments to be created
+    # First, make a layer out of all the random points
+    arcpy.MakeFeatureLayer_management("random0.shp", "random0_lyr")
+    arcpy.MakeFeatureLayer_management("random1.shp", "random1_lyr")
+
+    # Then select and export the end points into feature0 and feature1
+    # Based on new_unique_ID for random0
+    random0_points = arcpy.SearchCursor(random0, ["UniqueID"])
+    point0 = random0_points.next()
+    for point0 in random0_points:
+        for i in range(len(new_unique_ID)):
+            if point0.getValue("UniqueID") == new_unique_ID[i]:
+                selected0 = arcpy.SelectLayerByAttribute_management(\
+                     "random0_lyr", "ADD_TO_SELECTION", '"UniqueID" = {0}'.format(new_unique_ID[i]))
+
+    feature0 = arcpy.CopyFeatures_management(selected0, "feature0")
+
+    # Based on new_near_ID for random1
+    random1_points = arcpy.SearchCursor(random1, ["UniqueID"])
+    point1 = random1_points.next()
+    for point1 in random1_points:
+        for k in range(len(new_near_ID)):
+            if point1.getValue("UniqueID") == new_near_ID[k]:
+                selected1 = arcpy.SelectLayerByAttribute_management(\
+                     "random1_lyr", "ADD_TO_SELECTION", '"UniqueID" = {0}'.format(new_near_ID[k]))
+
+    feature1 = arcpy.CopyFeatures_management(selected1, "feature1")
+
+    del point0, point1, random0_points, random1_points
+    arcpy.Delete_management('random0_lyr')
+    arcpy.Delete_management('random1_lyr')
+
+
+    # Now for the actual creation of the coastal segments
+    # Which include creation of polygon and splitting the contours as the corresponding points
+    # STEPS NECESSARY FOR POLYGON CREATION
+    # Let's first add geometry attributes to these points
+    arcpy.AddGeometryAttributes_management(feature0, "POINT_X_Y_Z_M", "", "", "")
+    arcpy.AddGeometryAttributes_management(feature1, "POINT_X_Y_Z_M", "", "", "")
+
+    # Let's create lines that connects points from feature0 to feature1
+    # Initiate a POLYLINE feature class for these lines
+    arcpy.CreateFeatureclass_management (arcpy.env.workspace, "connector_lines.shp", "POLYLINE")
+
+    # Then for each of the points in feature0, get the correspondingin feature1
+    # And create a line for each of the two points
+    with arcpy.da.SearchCursor(feature0, ["NEAR_FID", "POINT_X", "POINT_Y"]) as features0:
+        for feat0 in features0:
+
+            with arcpy.da.SearchCursor(feature1, ["UniqueID", "POINT_X", "POINT_Y"]) as features1:
+                x=0
+                for feat1 in features1:
+                    x = x+1
+                    theseTwoPoints = []
+
+                    if feat0[0] == feat1[0]:
+                        # Get coordinates
+                        X0, Y0 = feat0[1], feat0[2]
+                        X1, Y1 = feat1[1], feat1[2]
+                        # Append coordinates
+                        theseTwoPoints.append(arcpy.PointGeometry(arcpy.Point(X0, Y0)))
+                        theseTwoPoints.append(arcpy.PointGeometry(arcpy.Point(X1, Y1)))
+                        # Create line from the coordinates
+                        subline = arcpy.PointsToLine_management(theseTwoPoints, "subline"+str(x)+".shp")
+                        # Append all lines into one feature
+                        arcpy.Append_management(["subline"+str(x)+".shp"], "connector_lines.shp")
+                        # Then delete subline as it's now unnecessary
+                        arcpy.Delete_management(subline)
+
+                        continue
+
+
+    del feat0, feat1, features0, features1
+
+    # Now that the connectors are created, let's split the contours into segments at the end points
+    # The end points are located on the contours by their measure (distance along the line) and the contours are cut
+    # at these measures, which gives the segments and their exact lengths without Integrate or SplitLineAtPoint.
+    # 10 Feet is my assumption of tolerance based on my method
+    segments0, s_length0 = splitLines(readPolylines(contour_at_mean_high_water), readPoints("feature0.shp"), 10)[:2]
+    segments1, s_length1 = splitLines(readPolylines(contour_at_surge), readPoints("feature1.shp"), 10)[:2]
+    arcpy.AddMessage(str(len(segments0))+" segments at mean high water ("+str(int(s_length0.sum()*0.3048))+" m) and "\
+                     +str(len(segments1))+" at surge ("+str(int(s_length1.sum()*0.3048))+" m)")
+
+    # Now with the split segments and connector lines, let's make segment polygon of the segments
+    # The polygons are the faces of the planar graph made by these lines (see polygons.py). Only the faces bounded
+    # by a mean high water segment are kept (the others are surrounded by flooded areas at surge, so they are
+    # above the surge and technically safe), and their mean high water edges give the length of the seawall.
+    # The connectors start from the end points before they were moved onto the contours, hence the tolerance.
+    polygons = assemblePolygons(segments0, segments1, readPolylines("connector_lines.shp"),\
+                                tolerance=10, length_factor=0.3048) # in meters
+    low_lands = writePolygons(polygons, "low_lands_segments.shp",\
+                              arcpy.Describe(contour_at_mean_high_water).spatialReference)
+
+    # Stop the timer
+    time2 = clock()
+
+    arcpy.AddMessage("Seawall segments and regions successfully created. It took "\
+                     +str(time2-time1)+" seconds")
+
+
+    # Delete the created but now unnecessary files
+    arcpy.Delete_management("random0.shp")
+    arcpy.Delete_management("random1.shp")
+    arcpy.Delete_management("new_random0.shp")
+    arcpy.Delete_management("random0_sorted.shp")
+    arcpy.Delete_management("feature0.shp")
+    arcpy.Delete_management("feature1.shp")
+    arcpy.Delete_management("connector_lines.shp")
+
+
+    # These are the vulnerable areas
+    return low_lands
+
+#---------------------------------------------------------------------------------------------------------------------#
+# FUNCTION TO ADD THE PARCEL RESULTS TO THE SEGMENTS
+# Each parcel goes to the segments it belongs to, then all the totals are computed at once (aggregate.py) instead of
+# a spatial join with field mappings plus an update cursor for the damage per meter. The memberships are those of the
+# damage curves (parcels intersecting each segment, a parcel touching two segments counted in both) when given;
+# otherwise each parcel goes to the segment containing its centroid.
+#---------------------------------------------------------------------------------------------------------------------#
+def segmentResults(segments, properties, damageField, valueField, output, zoneField=None, memberships=None):
+    # memberships: (parcel ID, segment Id) pairs, e.g. those of the damage curves in run()
+    time1 = clock()
+    rings, rows = readPolygons(segments, ["Id", "AOI_Length"])
+    if memberships is None:
+        centroids, damages, values = [], [], []
+        with arcpy.da.SearchCursor(properties, ["SHAPE@TRUECENTROID", damageField, valueField]) as parcels:
+            for parcel in parcels:
+                centroids.append(parcel[0] if parcel[0][0] is not None else (np.nan, np.nan))
+                damages.append(float(parcel[1] or 0))
+                values.append(float(parcel[2] or 0))
+        segment_of_parcel = pointsInPolygons(centroids, rings)
+    else:
+        results = dict((parcelKey(parcel[0]), (float(parcel[1] or 0), float(parcel[2] or 0))) for parcel in
+                       arcpy.da.SearchCursor(properties, [zoneField, damageField, valueField]))
+        position = dict((parcelKey(row[0]), k) for k, row in enumerate(rows))
+        memberships = [(parcelKey(p), parcelKey(s_id)) for p, s_id in memberships]
+        segment_of_parcel = [position.get(s_id, -1) for p, s_id in memberships]
+        damages = [results.get(p, (0.0, 0.0))[0] for p, s_id in memberships]
+        values = [results.get(p, (0.0, 0.0))[1] for p, s_id in memberships]
+    table = segmentMetrics([row[0] for row in rows], [row[1] for row in rows], segment_of_parcel, damages, values)
+
+    # Same polygons, with the results as new fields
+    arcpy.CopyFeatures_management(segments, output)
+    fields = ["T_Damage", "PS_Damage", "Max_Damage", "Exposed", "Parcels"]
+    for field in fields:
+        arcpy.AddField_management(output, field, "LONG" if field == "Parcels" else "DOUBLE")
+    with arcpy.da.UpdateCursor(output, fields) as features:
+        for feature, result in zip(features, table):
+            features.updateRow([result[field].item() for field in fields])
+
+    time2 = clock()
+    arcpy.AddMessage("Results of "+str(len(damages))+" parcels added to "+str(len(rings))+" segments. It took "+\
+                     str(time2-time1)+" seconds")
+    return output
+
+#---------------------------------------------------------------------------------------------------------------------#
+# FINAL OUTPUT
+# A .gpkg or .parquet output is written in bulk from arrays (see writers.py): the segments with their results, the
+# parcels with their damage and, optionally, the damage curve of each segment over the surge levels.
+# Anything else is a feature class, copied with arcpy.
+#---------------------------------------------------------------------------------------------------------------------#
+def spatialReferenceOf(feature_class):
+    # (EPSG code, WKT) of a feature class (code 0 for a custom coordinate system)
+    reference = arcpy.Describe(feature_class).spatialReference
+    return reference.factoryCode or 0, reference.exportToString().split(";")[0]
+
+def writeResults(output, segments, properties, zoneField, damageField, valueField, segment_ids=None, surges=None,
+                 damage_curves=None):
+    time1 = clock()
+    fields = ["Id", "AOI_Length", "T_Damage", "PS_Damage", "Max_Damage", "Exposed", "Parcels"]
+    # Whole geometries (every part and hole), as for the parcels
+    with arcpy.da.SearchCursor(segments, ["SHAPE@WKB"] + fields) as features:
+        segment_rows = [row for row in features]
+    segment_wkb = [None if row[0] is None else bytes(row[0]) for row in segment_rows]
+    rows = [row[1:] for row in segment_rows]
+    segment_types = wkbTypes(segment_wkb)
+    segment_columns = [(name, np.array([row[i] for row in rows], dtype=np.int64 if name in ("Id", "Parcels")
+                                       else float)) for i, name in enumerate(fields)]
+    with arcpy.da.SearchCursor(properties, ["SHAPE@WKB", zoneField, valueField, "MEAN", damageField]) as parcels:
+        parcel_rows = [row for row in parcels]
+    parcel_wkb = [None if row[0] is None else bytes(row[0]) for row in parcel_rows]
+    parcel_columns = [(zoneField, np.array([row[1] for row in parcel_rows])),
+                      ("Value", np.array([row[2] or 0 for row in parcel_rows], dtype=float)),
+                      ("Elevation", np.array([np.nan if row[3] is None else row[3] for row in parcel_rows])),
+                      ("S_Damage", np.array([row[4] or 0 for row in parcel_rows], dtype=float))]
+    srs = spatialReferenceOf(segments)
+
+    # Damage curves of the output segments (segments x surges)
+    curves = None
+    if damage_curves is not None:
+        position = dict((str(s_id), k) for k, s_id in enumerate(segment_ids))
+        damage_curves = np.asarray(damage_curves, dtype=float).reshape(len(segment_ids), len(surges))
+        curves = np.array([damage_curves[position[str(row[0])]] if str(row[0]) in position else
+                           np.full(len(surges), np.nan) for row in rows]).reshape(len(rows), len(surges))
+
+    if output.lower().endswith(".parquet"):
+        metadata = {} if curves is None else {"surges": list(surges)}
+        extra = [] if curves is None else [("damage_curve", curves)]
+        writeGeoParquet(output, segment_columns + extra, segment_wkb, segment_types, projjson(srs), metadata)
+        writeGeoParquet(parquetPath(output, "parcels"), parcel_columns, parcel_wkb, [], projjson(srs))
+    else:
+        writeGeoPackage(output, "segments", segment_columns, segment_wkb,\
+                        "MULTIPOLYGON" if "MultiPolygon" in segment_types else "POLYGON", srs)
+        writeGeoPackage(output, "parcels", parcel_columns, parcel_wkb, "GEOMETRY", srs)
+        if curves is not None:
+            # One column per surge level (D_1_07 is the damage at 1.07 m)
+            writeGeoPackage(output, "damage_curves", [("Id", segment_columns[0][1])] +
+                            [("D_" + "{0:.2f}".format(h).replace(".", "_"), curves[:, i]) for i, h in enumerate(surges)])
+
+    time2 = clock()
+    arcpy.AddMessage("{0} segments and {1} parcels written to {2}. It took {3} seconds".format(
+                     len(rows), len(parcel_rows), output, time2-time1))
+    return output
+
+def addToMap(output):
+    # Adds the output to the current map: arcpy.mapping in ArcMap, arcpy.mp in ArcGIS Pro; outside of either (e.g.
+    # from the command line) there is no current map and nothing is added
+    if output.lower().endswith(".parquet"):
+        return False
+    layer = os.path.join(output, "main.segments") if output.lower().endswith(".gpkg") else output
+    try:
+        if hasattr(arcpy, "mp"):
+            arcpy.mp.ArcGISProject("CURRENT").activeMap.addDataFromPath(layer)
+        else:
+            mxd = arcpy.mapping.MapDocument("CURRENT")
+            dataFrame = arcpy.mapping.ListDataFrames(mxd, "*")[0]
+            arcpy.mapping.AddLayer(dataFrame, arcpy.mapping.Layer(layer))
+        return True
+    except (RuntimeError, AttributeError, OSError, IndexError, ValueError):
+        arcpy.AddMessage("No current map to add " + output + " to")
+        return False
+
+def intersectingSegments(geometries, rings, spatial_reference):
+    # Numbers of the segments (rings) each geometry intersects, like SelectLayerByLocation INTERSECT.
+    # Only the segments whose extent overlaps the geometry are tested.
+    extents = np.array([[r[:, 0].min(), r[:, 1].min(), r[:, 0].max(), r[:, 1].max()] if len(r) else [np.nan]*4
+                        for r in rings]).reshape(-1, 4)
+    polygons = {}
+    touching = []
+    for geometry in geometries:
+        e = geometry.extent
+        candidates = np.flatnonzero((extents[:, 0] <= e.XMax) & (extents[:, 2] >= e.XMin) &
+                                    (extents[:, 1] <= e.YMax) & (extents[:, 3] >= e.YMin))
+        found = []
+        for k in candidates.tolist():
+            if k not in polygons:
+                polygons[k] = arcpy.Polygon(arcpy.Array([arcpy.Point(x, y) for x, y in rings[k]]), spatial_reference)
+            if not geometry.disjoint(polygons[k]):
+                found.append(k)
+        touching.append(found)
+    return touching
+
+#---------------------------------------------------------------------------------------------------------------------#
+# FUNCTION TO GET THE MEAN ELEVATION OF EACH PARCEL
+# Zonal Statistics as Table, only for the parcels the elevation cache does not already know
+#---------------------------------------------------------------------------------------------------------------------#
+def zonalMean(properties, zoneField, raster_dem, parcel_ids, chunk_size=None):
+    # Mean elevation of the listed parcels, in the same order. With a chunk size, one zonal table per chunk of
+    # parcels so that only one of them is in memory at a time.
+    if len(parcel_ids) == 0:
+        return []
+    chunk_size = chunk_size or len(parcel_ids)
+    field = arcpy.AddFieldDelimiters(properties, zoneField)
+    quote = "" if isinstance(parcel_ids[0], (int, long, float)) else "'"
+    means = {}
+    for chunk in range(0, len(parcel_ids), chunk_size):
+        chunk_ids = parcel_ids[chunk:chunk+chunk_size]
+        arcpy.MakeFeatureLayer_management(properties, "zonal_parcels_lyr")
+        # Select the parcels by groups of 1000 so that the where clauses stay short
+        for start in range(0, len(chunk_ids), 1000):
+            values = ",".join(quote + str(p).replace("'", "''") + quote for p in chunk_ids[start:start+1000])
+            arcpy.SelectLayerByAttribute_management("zonal_parcels_lyr", "ADD_TO_SELECTION",
+                                                    "{0} IN ({1})".format(field, values))
+        zonal_stats = arcpy.sa.ZonalStatisticsAsTable("zonal_parcels_lyr", zoneField, raster_dem,\
+                                                      "zonal_stats", "NODATA", "MEAN")
+        means.update((row[0], row[1]) for row in arcpy.da.SearchCursor(zonal_stats, [zoneField, "MEAN"]))
+        arcpy.Delete_management("zonal_parcels_lyr")
+        arcpy.Delete_management(zonal_stats)
+    return [means.get(p, float("nan")) for p in parcel_ids]
+
+def rasterZonalMean(properties, zoneField, raster_dem, parcel_ids, tile_size=2048, memory_cap=None):
+    # Same means as zonalMean through the tile pipeline (pipeline.py): the parcels are rasterized on the grid of the
+    # DEM (cell centers, like Zonal Statistics), then the DEM and zone tiles are read ahead on a thread while the
+    # previous tiles are summed. Neither raster is ever read at once.
+    if len(parcel_ids) == 0:
+        return []
+    position = dict((p, i) for i, p in enumerate(parcel_ids))
+    # Zone numbers in a Double field: a float raster reads with NaN outside the parcels (exact up to 2^24 parcels)
+    arcpy.AddField_management(properties, "ZONE_N", "DOUBLE")
+    with arcpy.da.UpdateCursor(properties, [zoneField, "ZONE_N"]) as rows:
+        for row in rows:
+            rows.updateRow([row[0], position.get(row[0], -1)])
+    description = arcpy.Describe(raster_dem)
+    snap, extent = arcpy.env.snapRaster, arcpy.env.extent
+    arcpy.env.snapRaster, arcpy.env.extent = raster_dem, description.extent
+    try:
+        zones = arcpy.PolygonToRaster_conversion(properties, "ZONE_N", "zones_n", "CELL_CENTER", "",\
+                                                 description.meanCellWidth)
+        means = tiledZonalMean(RasterSource(raster_dem), RasterSource(zones), len(parcel_ids), tile_size,\
+                               message=arcpy.AddMessage, memory_cap=memory_cap)
+        arcpy.Delete_management(zones)
+    finally:
+        arcpy.env.snapRaster, arcpy.env.extent = snap, extent
+        arcpy.DeleteField_management(properties, "ZONE_N")
+    return list(means)
+
+def pointElevations(properties, zoneField, raster_dem, parcel_ids, points=None):
+    # Elevation at the centroid of the listed parcels (or at the point of points with the same zoneField value,
+    # e.g. building footprint centroids or first floor points), interpolated bilinearly, in the same order
+    if len(parcel_ids) == 0:
+        return []
+    if points is None:
+        cursor = arcpy.da.SearchCursor(properties, [zoneField, "SHAPE@TRUECENTROID"])
+    else:
+        cursor = arcpy.da.SearchCursor(points, [zoneField, "SHAPE@XY"])
+    located = {}
+    with cursor as rows:
+        for row in rows:
+            if row[1] is not None and row[1][0] is not None:
+                located.setdefault(row[0], row[1])
+    xy = np.array([located.get(p, (np.nan, np.nan)) for p in parcel_ids], dtype=float)
+    return bilinearSample(RasterSource(raster_dem), xy[:, 0], xy[:, 1])
+
+def parcelElevations(properties, zoneField, raster_dem, cache=None, mode="zonal", points=None, memory=None,\
+                     tile_size=None):
+    # Adds the MEAN field (elevation) to the properties. mode "zonal" is the mean over each parcel (Zonal Statistics
+    # as Table), "point" samples the DEM at the parcel centroids (or at points), much faster for dense parcels.
+    # With a memory monitor (memory.py) that has a budget, the zonal statistics are run by chunks that fit in it.
+    # With a tile size (tiled mode), the zonal means go through the tile pipeline instead (rasterZonalMean), with
+    # tiles capped by the memory budget.
+    time1 = clock()
+    rows = [(row[0], geometryHash(row[1])) for row in arcpy.da.SearchCursor(properties, [zoneField, "SHAPE@WKB"])]
+    parcel_ids = [row[0] for row in rows]
+    if mode == "zonal" and tile_size is not None:
+        memory_cap = memory.budget if memory is not None else None
+        compute = lambda missing: rasterZonalMean(properties, zoneField, raster_dem, [parcel_ids[i] for i in missing],
+                                                  tile_size, memory_cap)
+    elif mode == "zonal":
+        # Rough memory per parcel of a zonal statistics run (selection, zone raster and table)
+        chunk_size = memory.chunkSize(len(parcel_ids), 4096, 1000) if memory is not None else None
+        compute = lambda missing: zonalMean(properties, zoneField, raster_dem, [parcel_ids[i] for i in missing],
+                                            chunk_size)
+    elif mode == "point":
+        compute = lambda missing: pointElevations(properties, zoneField, raster_dem, [parcel_ids[i] for i in missing],
+                                                  points)
+    else:
+        raise ValueError("Unknown elevation mode: " + str(mode))
+
+    # The cache only knows the parcel geometries: not used with separate points
+    if cache is None or points is not None:
+        elevations = compute(range(len(parcel_ids)))
+    else:
+        path = arcpy.Describe(raster_dem).catalogPath
+        dem = cache.demFingerprint(RasterSource(raster_dem), path)
+        # Means and point samples of the same DEM are different values
+        dem = dem if mode == "zonal" else dem + ":" + mode
+        elevations = cachedElevations(cache, dem, parcel_ids, [row[1] for row in rows], compute)
+        cache.report(arcpy.AddMessage)
+
+    arcpy.AddField_management(properties, "MEAN", "DOUBLE")
+    with arcpy.da.UpdateCursor(properties, ["MEAN"]) as parcels:
+        for parcel, elevation in zip(parcels, elevations):
+            parcel[0] = None if elevation != elevation else float(elevation)    # NaN ==> NULL
+            parcels.updateRow(parcel)
+
+    time2 = clock()
+    arcpy.AddMessage("Parcel elevations obtained ("+mode+" mode). It took "+str(time2-time1)+" seconds")
+    return elevations
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from .geometry import dropRepeatedVertices, isClosed, cumulativeLength
+
+#---------------------------------------------------------------------------------------------------------------------#
+# LINEAR REFERENCING ON POLYLINE ARRAYS
+# A point is located on a polyline by its measure: the distance along the line to its closest projection.
+# Splitting the line at sorted measures gives the pieces and their exact lengths, without snapping (Integrate)
+# or writing anything.
+#---------------------------------------------------------------------------------------------------------------------#
+def locatePoints(line, points, max_pairs=2000000):
+    # Measure of the projection of each point on the line, and the distance from the point to the line
+    line = dropRepeatedVertices(line)
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    measures = np.zeros(len(points))
+    distances = np.full(len(points), np.inf)
+    if len(line) < 2 or len(points) == 0:
+        return measures, distances
+    start = line[:-1]
+    step = np.diff(line, axis=0)
+    squared = (step**2).sum(axis=1)
+    cumulative = cumulativeLength(line)
+    # All the point x segment pairs at once, by chunks of points to bound the memory
+    chunk = max(1, int(max_pairs // len(start)))
+    for first in range(0, len(points), chunk):
+        p = points[first:first+chunk]
+        t = np.clip(((p[:, None, :] - start[None]) * step[None]).sum(axis=2) / squared[None], 0.0, 1.0)
+        gap = ((p[:, None, :] - (start[None] + t[:, :, None]*step[None]))**2).sum(axis=2)
+        closest = np.argmin(gap, axis=1)
+        rows = np.arange(len(p))
+        measures[first:first+chunk] = cumulative[closest] + t[rows, closest]*np.sqrt(squared[closest])
+        distances[first:first+chunk] = np.sqrt(gap[rows, closest])
+    return measures, distances
+
+def pointsAtMeasures(line, measures):
+    cumulative = cumulativeLength(line)
+    return np.stack([np.interp(measures, cumulative, line[:, 0]), np.interp(measures, cumulative, line[:, 1])], axis=1)
+
+def splitAtMeasures(line, measures):
+    # Pieces of the line between consecutive measures. A closed line cut at k measures gives k pieces
+    # (the piece through its first vertex is joined back together).
+    line = dropRepeatedVertices(line)
+    cumulative = cumulativeLength(line)
+    total = cumulative[-1]
+    closed = isClosed(line)
+    measures = np.unique(np.clip(np.asarray(measures, dtype=np.float64), 0.0, total))
+    if not closed:
+        measures = measures[(measures > 0) & (measures < total)]
+    if len(measures) == 0:
+        return [line]
+    bounds = np.concatenate([[0.0], measures, [total]])
+    cuts = pointsAtMeasures(line, bounds)
+    # Vertices strictly between two bounds belong to the piece between them
+    first = np.searchsorted(cumulative, bounds[:-1], side="right")
+    last = np.searchsorted(cumulative, bounds[1:], side="left")
+    pieces = [np.concatenate([cuts[i:i+1], line[first[i]:last[i]], cuts[i+1:i+2]]) for i in range(len(bounds)-1)]
+    if closed:
+        pieces = [np.concatenate([pieces[-1], pieces[0][1:]])] + pieces[1:-1]
+    return [dropRepeatedVertices(piece) for piece in pieces if len(dropRepeatedVertices(piece)) >= 2]
+
+def splitLines(lines, points, tolerance):
+    # Split every line at the points within tolerance of it (each point goes to its closest line).
+    # Returns the pieces, their lengths, the line each piece comes from, and the points moved onto the lines.
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    lines = [dropRepeatedVertices(line) for line in lines]
+    located = [locatePoints(line, points) for line in lines]
+    if lines and len(points):
+        distances = np.array([d for m, d in located])
+        closest = np.argmin(distances, axis=0)
+        within = distances[closest, np.arange(len(points))] <= tolerance
+    else:
+        closest = np.zeros(len(points), dtype=int)
+        within = np.zeros(len(points), dtype=bool)
+
+    pieces, line_of_piece = [], []
+    snapped = points.copy()
+    for i, line in enumerate(lines):
+        mine = within & (closest == i)
+        measures = located[i][0][mine]
+        snapped[mine] = pointsAtMeasures(line, measures)
+        for piece in splitAtMeasures(line, measures):
+            pieces.append(piece)
+            line_of_piece.append(i)
+    lengths = np.array([cumulativeLength(piece)[-1] for piece in pieces])
+    return pieces, lengths, np.array(line_of_piece, dtype=int), snapped
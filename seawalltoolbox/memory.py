@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import os, sys
+from contextlib import contextmanager
+
+from ._compat import clock, addMessage
+
+try:
+    import tracemalloc
+except ImportError:     # Python 2
+    tracemalloc = None
+
+#---------------------------------------------------------------------------------------------------------------------#
+# PROCESS MEMORY
+# Resident set size (RSS) now and at its highest, in bytes: GetProcessMemoryInfo on Windows, /proc on Linux,
+# getrusage for the peak elsewhere (and psutil, when installed, for the current RSS). None when unknown.
+#---------------------------------------------------------------------------------------------------------------------#
+def _windowsRss():
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                    ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    process = ctypes.windll.kernel32.GetCurrentProcess()
+    if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+        return None, None
+    return counters.WorkingSetSize, counters.PeakWorkingSetSize
+
+def _procRss():
+    values = {}
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith(("VmRSS:", "VmHWM:")):
+                values[line[:5]] = int(line.split()[1]) * 1024
+    return values.get("VmRSS"), values.get("VmHWM")
+
+def processMemory():
+    try:
+        if sys.platform.startswith("win"):
+            return _windowsRss()
+        if os.path.exists("/proc/self/status"):
+            return _procRss()
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = peak if sys.platform == "darwin" else peak * 1024
+        try:
+            import psutil
+            return psutil.Process().memory_info().rss, peak
+        except ImportError:
+            return None, peak
+    except Exception:
+        return None, None
+
+#---------------------------------------------------------------------------------------------------------------------#
+# MEMORY MONITOR
+# Each stage (or segment) records its time, its RSS change, the process high-water mark at its end, and, when tracing
+# is on (Python 3 only, slows Python down), the Python allocations it kept and its own allocation peak.
+# With a budget (bytes), chunked stages ask chunkSize how many items they can take at once.
+#---------------------------------------------------------------------------------------------------------------------#
+def _megabytes(value):
+    return "n/a" if value is None else "{0:.1f} MB".format(value / 1048576.0)
+
+class MemoryMonitor(object):
+    def __init__(self, budget=None, trace=False, safety=0.5):
+        self.budget = budget
+        self.safety = safety
+        self.trace = trace and tracemalloc is not None
+        self.stages = []
+        if self.trace and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        rss_before, peak_before = processMemory()
+        if self.trace:
+            traced_before = tracemalloc.get_traced_memory()[0]
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+        start = clock()
+        try:
+            yield self
+        finally:
+            rss_after, peak_after = processMemory()
+            record = {"stage": name, "seconds": clock() - start, "rss": rss_after,
+                      "rss_delta": None if rss_before is None or rss_after is None else rss_after - rss_before,
+                      "peak": peak_after, "new_peak": peak_before is not None and peak_after is not None
+                                                     and peak_after > peak_before,
+                      "traced_delta": None, "traced_peak": None}
+            if self.trace:
+                traced, traced_peak = tracemalloc.get_traced_memory()
+                record["traced_delta"] = traced - traced_before
+                record["traced_peak"] = traced_peak - traced_before
+            self.stages.append(record)
+
+    def available(self):
+        # Bytes the next chunk may use: a share (safety) of what is left of the budget
+        if self.budget is None:
+            return None
+        rss = processMemory()[0]
+        return max(0, self.budget - (rss or 0)) * self.safety
+
+    def chunkSize(self, n_items, bytes_per_item, minimum=1):
+        # Items per chunk so that a chunk stays within the budget (all of them without a budget)
+        available = self.available()
+        if available is None:
+            return max(n_items, minimum)
+        return int(max(minimum, min(n_items, available // max(bytes_per_item, 1))))
+
+    def report(self, message=addMessage, top=None):
+        # The stages that raised the high-water mark are flagged with *
+        stages = self.stages if top is None else sorted(self.stages, key=lambda s: -(s["rss_delta"] or 0))[:top]
+        message("\nMemory by stage" + ("" if self.budget is None else " (budget " + _megabytes(self.budget) + ")"))
+        for s in stages:
+            line = "{0}{1}: {2:.2f} s, RSS {3} ({4}{5}), peak {6}".format(
+                "*" if s["new_peak"] else " ", s["stage"], s["seconds"], _megabytes(s["rss"]),
+                "+" if (s["rss_delta"] or 0) >= 0 else "", _megabytes(s["rss_delta"]), _megabytes(s["peak"]))
+            if s["traced_delta"] is not None:
+                line += ", Python allocations {0} kept, {1} at most".format(_megabytes(s["traced_delta"]),
+                                                                            _megabytes(s["traced_peak"]))
+            message(line)
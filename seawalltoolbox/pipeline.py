@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+import os, shutil, tempfile, threading
+
+try:
+    import queue
+except ImportError:     # Python 2
+    import Queue as queue
+
+import numpy as np
+
+from ._compat import clock, addMessage
+from .raster import tileWindows, coreSlices, cellCenters
+from .contours import marchingSquares, joinSegments
+from .flood import labelledFlood, spillLevels
+
+#---------------------------------------------------------------------------------------------------------------------#
+# OVERLAPPED I/O
+# Tiles are read by background threads while the current tile is processed. The queue is bounded (depth), so at most
+# depth tiles wait in memory. Results can also be written behind by another thread.
+# arcpy, numpy and file reads release the GIL, so reading and computing really happen at the same time.
+#---------------------------------------------------------------------------------------------------------------------#
+class PipelineTimer(object):
+    def __init__(self, name="pipeline"):
+        self.name = name
+        self.io_wait = 0.0      # compute thread waiting for a tile (or for room to write)
+        self.compute = 0.0      # compute thread working
+        self.read = 0.0         # reading threads working
+        self.write = 0.0        # writing thread working
+        self.tiles = 0
+        self._lock = threading.Lock()
+
+    def add(self, field, seconds):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + seconds)
+
+    def report(self, message=addMessage):
+        total = self.io_wait + self.compute
+        message("{0}: {1} tiles, {2:.2f} s computing, {3:.2f} s waiting on I/O ({4:.0f}% of the time), "
+                "{5:.2f} s reading and {6:.2f} s writing in the background".format(
+                    self.name, self.tiles, self.compute, self.io_wait, 100*self.io_wait/total if total else 0,
+                    self.read, self.write))
+
+_done = object()
+
+def prefetch(items, load, depth=2, io_threads=1, timer=None):
+    # Yields (item, load(item)) in the order of items, loading up to depth items ahead on io_threads threads
+    timer = timer or PipelineTimer()
+    items = list(items)
+    results = {}
+    condition = threading.Condition()
+    slots = threading.Semaphore(depth)
+    next_item = [0]
+    stop = [False]
+
+    def worker():
+        while True:
+            slots.acquire()
+            with condition:
+                if stop[0] or next_item[0] >= len(items):
+                    slots.release()
+                    return
+                index = next_item[0]
+                next_item[0] += 1
+            start = clock()
+            try:
+                value = (True, load(items[index]))
+            except Exception as e:
+                value = (False, e)
+            timer.add("read", clock()-start)
+            with condition:
+                results[index] = value
+                condition.notify_all()
+
+    threads = [threading.Thread(target=worker) for i in range(max(1, io_threads))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        for index in range(len(items)):
+            start = clock()
+            with condition:
+                while index not in results:
+                    condition.wait()
+                ok, value = results.pop(index)
+            timer.add("io_wait", clock()-start)
+            slots.release()
+            if not ok:
+                raise value
+            timer.tiles += 1
+            yield items[index], value
+    finally:
+        with condition:
+            stop[0] = True
+        for thread in threads:
+            slots.release()
+
+class WriteBehind(object):
+    # Calls write(*args) on a background thread, with at most depth pending writes
+    def __init__(self, write, depth=2, timer=None):
+        self.timer = timer or PipelineTimer()
+        self._write = write
+        self._queue = queue.Queue(maxsize=depth)
+        self._error = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            args = self._queue.get()
+            if args is _done:
+                return
+            if self._error is not None:
+                continue
+            start = clock()
+            try:
+                self._write(*args)
+            except Exception as e:
+                self._error = e
+            self.timer.add("write", clock()-start)
+
+    def put(self, *args):
+        if self._error is not None:
+            raise self._error
+        start = clock()
+        self._queue.put(args)
+        self.timer.add("io_wait", clock()-start)
+
+    def close(self):
+        self._queue.put(_done)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+def runTiles(windows, load, compute, write=None, depth=2, io_threads=1, name="pipeline", message=None):
+    # Generic producer/consumer stage: load(window) on I/O threads, compute(window, data) here, and
+    # write(window, result) behind on another thread. Returns the results of compute when there is no writer.
+    timer = PipelineTimer(name)
+    writer = WriteBehind(write, depth, timer) if write is not None else None
+    results = []
+    try:
+        for window, data in prefetch(windows, load, depth, io_threads, timer):
+            start = clock()
+            result = compute(window, data)
+            timer.add("compute", clock()-start)
+            if writer is not None:
+                writer.put(window, result)
+            else:
+                results.append(result)
+    finally:
+        if writer is not None:
+            writer.close()
+    if message is not None:
+        timer.report(message)
+    return results, timer
+
+#---------------------------------------------------------------------------------------------------------------------#
+# MEMORY CAP
+# Up to depth tiles wait in the queue, one is computed and one is written: the tile size is chosen so that these
+# tiles (with their halo) stay under the cap. Bytes per cell are rough figures for each stage, temporaries included.
+#---------------------------------------------------------------------------------------------------------------------#
+bytes_per_cell = {"contour": 40, "zonal": 48, "flood mask": 12, "priority-flood": 160}
+
+def tileSize(tile_size, memory_cap=None, stage="contour", depth=2, halo=0, cell_bytes=None):
+    # cell_bytes: for a stage whose bytes per cell depend on its parameters
+    if not memory_cap:
+        return tile_size
+    side = int(np.sqrt(float(memory_cap) / ((cell_bytes or bytes_per_cell[stage]) * (depth + 2)))) - 2*halo
+    if side < 64:
+        raise ValueError("A memory cap of {0} bytes is too small for the {1} stage".format(memory_cap, stage))
+    # Multiples of 64 cells, the block size of most rasters
+    side = side // 64 * 64
+    return min(side, tile_size) if tile_size else side
+
+#---------------------------------------------------------------------------------------------------------------------#
+# RASTER STAGES
+# All the stages give the same result whatever the tile size: only the cells of each core are counted once, and the
+# contour pieces are joined across the tile edges.
+#---------------------------------------------------------------------------------------------------------------------#
+def outsideRange(source, window, low, high):
+    # True when the source can tell without reading (e.g. TiledDem.valueRange) that no cell of the window
+    # is between low and high
+    if not hasattr(source, "valueRange"):
+        return False
+    vmin, vmax = source.valueRange(window.row, window.col, window.nrows, window.ncols)
+    return not (vmin <= high and vmax >= low)       # no data at all ==> NaN ==> outside
+
+def tiledContour(source, level, tile_size=2048, depth=2, io_threads=1, message=None, memory_cap=None):
+    # Contour polylines at level. The 1 cell halo gives each tile the last row and column of its squares.
+    # Tiles entirely above or below the level are not read when the source knows their range.
+    tile_size = tileSize(tile_size, memory_cap, "contour", depth, 1)
+    def compute(window, dem):
+        if dem is None:
+            return np.zeros((0, 2, 2))
+        x, y = cellCenters(source, window)
+        rows, cols = coreSlices(window)
+        return marchingSquares(dem, float(level), x, y, rows, cols)
+
+    def load(window):
+        if outsideRange(source, window, float(level), float(level)):
+            return None
+        return source.read(window.row, window.col, window.nrows, window.ncols)
+
+    segments, timer = runTiles(tileWindows(source.shape, tile_size, 1), load, compute, None, depth, io_threads,
+                               "Contour at " + str(level), message)
+    return joinSegments(np.concatenate(segments) if segments else np.zeros((0, 2, 2)))
+
+def tiledZonalMean(source, zones, n_zones, tile_size=2048, depth=2, io_threads=1, message=None, memory_cap=None):
+    # Mean elevation of each zone. zones is a raster source of zone numbers (0 to n_zones-1, NaN or negative
+    # outside the zones) aligned with the DEM, e.g. the parcels converted with PolygonToRaster.
+    tile_size = tileSize(tile_size, memory_cap, "zonal", depth)
+    def load(window):
+        return (source.read(window.row, window.col, window.nrows, window.ncols),
+                zones.read(window.row, window.col, window.nrows, window.ncols))
+
+    def compute(window, data):
+        dem, zone = data
+        inside = np.isfinite(dem) & np.isfinite(zone) & (zone >= 0)
+        zone = zone[inside].astype(np.int64)
+        return (np.bincount(zone, weights=dem[inside], minlength=n_zones),
+                np.bincount(zone, minlength=n_zones))
+
+    partial, timer = runTiles(tileWindows(source.shape, tile_size), load, compute, None, depth, io_threads,
+                              "Zonal elevation", message)
+    sums = np.sum([p[0] for p in partial], axis=0) if partial else np.zeros(n_zones)
+    counts = np.sum([p[1] for p in partial], axis=0) if partial else np.zeros(n_zones)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+def tiledFloodMask(source, surge, output, mean_high_water=None, tile_size=2048, depth=2, io_threads=1, message=None,
+                   memory_cap=None):
+    # Cells at or below the surge (and above mean high water when given) written into output, a 2-D array
+    # the size of the DEM (e.g. numpy.lib.format.open_memmap) so that the mask never has to fit in memory
+    tile_size = tileSize(tile_size, memory_cap, "flood mask", depth)
+    low = -np.inf if mean_high_water is None else float(mean_high_water)
+    def compute(window, dem):
+        if dem is None:
+            return np.zeros((window.nrows, window.ncols), dtype=bool)
+        flooded = dem <= float(surge)
+        if mean_high_water is not None:
+            flooded &= dem > float(mean_high_water)
+        return flooded
+
+    def write(window, flooded):
+        output[window.row:window.row+window.nrows, window.col:window.col+window.ncols] = flooded
+
+    def load(window):
+        # Tiles entirely above the surge or at or below mean high water are dry: not read
+        if outsideRange(source, window, np.nextafter(low, np.inf), float(surge)):
+            return None
+        return source.read(window.row, window.col, window.nrows, window.ncols)
+    results, timer = runTiles(tileWindows(source.shape, tile_size), load, compute, write, depth, io_threads,
+                              "Flood mask at " + str(surge), message)
+    return output
+
+def tiledInundationLevels(source, mean_high_water, output=None, sea=None, tile_size=2048, connectivity=8, depth=2,
+                          io_threads=1, message=None, memory_cap=None, scratch=None):
+    # Same levels as flood.inundationLevels over the whole DEM, in two passes over the tiles (Barnes 2016):
+    #   1. each tile is flooded from its edge; its levels go to output and its watershed labels to a scratch file
+    #   2. once the sea level of every label is known, each level becomes max(level in the tile, level of its label)
+    # output is a 2-D float array the size of the DEM (in memory if not given). sea is an optional boolean array of
+    # sea cells; by default the cells on the edge of the DEM at or below mean high water.
+    tile_size = tileSize(tile_size, memory_cap, "priority-flood", depth)
+    nrows, ncols = source.shape
+    if output is None:
+        output = np.empty(source.shape, dtype=np.float64)
+    own_scratch = scratch is None
+    scratch = tempfile.mkdtemp(prefix="seawall_") if own_scratch else scratch
+    labels = np.lib.format.open_memmap(os.path.join(scratch, "labels.npy"), "w+", np.int64, source.shape)
+    try:
+        def load(window):
+            dem = source.read(window.row, window.col, window.nrows, window.ncols)
+            if sea is not None:
+                return dem, np.asarray(sea[window.row:window.row+window.nrows, window.col:window.col+window.ncols])
+            rows = np.arange(window.row, window.row+window.nrows)[:, None]
+            cols = np.arange(window.col, window.col+window.ncols)[None, :]
+            border = (rows == 0) | (rows == nrows-1) | (cols == 0) | (cols == ncols-1)
+            with np.errstate(invalid="ignore"):
+                return dem, border & (dem <= float(mean_high_water))
+
+        # Pass 1: labels are numbered across all the tiles (0 stays the sea)
+        n_labels = [1]
+        spills = {}
+        def flood(window, data):
+            levels, tile_labels, n, tile_spills = labelledFlood(data[0], data[1], connectivity)
+            offset = n_labels[0] - 1
+            tile_labels[tile_labels > 0] += offset
+            for (a, b), level in tile_spills.items():
+                spills[(a + offset if a else a, b + offset)] = level
+            n_labels[0] += n - 1
+            return levels, tile_labels
+
+        def write(window, result):
+            output[window.row:window.row+window.nrows, window.col:window.col+window.ncols] = result[0]
+            labels[window.row:window.row+window.nrows, window.col:window.col+window.ncols] = result[1]
+
+        windows = list(tileWindows(source.shape, tile_size))
+        runTiles(windows, load, flood, write, depth, io_threads, "Priority-flood (tiles)", message)
+
+        # Spill edges across the tile edges: the two rows (or columns) on each side, one edge line at a time
+        reach = (-1, 0, 1) if connectivity == 8 else (0,)
+        def addSpills(a_labels, b_labels, a_levels, b_levels):
+            for shift in reach:
+                a = slice(max(0, -shift), len(a_labels) - max(0, shift))
+                b = slice(max(0, shift), len(b_labels) - max(0, -shift))
+                pair = np.stack([a_labels[a], b_labels[b]], axis=1)
+                level = np.maximum(a_levels[a], b_levels[b])
+                keep = (pair[:, 0] >= 0) & (pair[:, 1] >= 0) & (pair[:, 0] != pair[:, 1]) & np.isfinite(level)
+                pair, level = np.sort(pair[keep], axis=1), level[keep]
+                for (p, q), value in zip(pair.tolist(), level.tolist()):
+                    if value < spills.get((p, q), np.inf):
+                        spills[(p, q)] = value
+
+        for row in range(tile_size, nrows, tile_size):
+            addSpills(labels[row-1], labels[row], output[row-1], output[row])
+        for col in range(tile_size, ncols, tile_size):
+            addSpills(labels[:, col-1], labels[:, col], output[:, col-1], output[:, col])
+
+        # Pass 2
+        reached = np.append(spillLevels(n_labels[0], spills), np.inf)      # label -1 ==> never reached
+        for window in windows:
+            block = (slice(window.row, window.row+window.nrows), slice(window.col, window.col+window.ncols))
+            output[block] = np.maximum(output[block], reached[labels[block]])
+        if message is not None:
+            message("Priority-flood: {0} tiles, {1} watersheds, {2} spill edges".format(
+                    len(windows), n_labels[0], len(spills)))
+    finally:
+        # Releases the memory map before its file is removed (Windows). Not "del": Python 2 does not allow deleting a
+        # variable used by a nested function (write)
+        labels = None
+        if own_scratch:
+            shutil.rmtree(scratch, ignore_errors=True)
+    return output
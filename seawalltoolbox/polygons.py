@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from .geometry import dropRepeatedVertices
+
+#---------------------------------------------------------------------------------------------------------------------#
+# LOWLAND POLYGONS FROM A PLANAR GRAPH
+# The split contour pieces (mean high water and surge) and the connector lines are first cut where they cross each
+# other (a connector often crosses a noisy contour away from its ends), as FeatureToPolygon does, so that the lines
+# only meet at their ends. Their ends are the nodes of a planar graph and the lines its edges; the polygons are the
+# faces of that graph. Each face is walked by always turning to the next edge clockwise, which keeps the face on the
+# left (bounded faces come out counterclockwise, with a positive area).
+#---------------------------------------------------------------------------------------------------------------------#
+MHW, SURGE, CONNECTOR = 0, 1, 2
+
+def _cross(a, b):
+    return a[..., 0]*b[..., 1] - a[..., 1]*b[..., 0]
+
+def nodeLines(lines, max_pairs=4000000):
+    # Cuts the lines where they cross or touch one another (or themselves). Returns the pieces and the number of the
+    # line each piece comes from. Candidate pairs of segments come from a sweep along x (the later start of two
+    # overlapping x ranges lies in the other range), max_pairs at a time; collinear overlaps are not cut.
+    first = np.cumsum([0] + [len(line)-1 for line in lines])
+    line_of = np.repeat(np.arange(len(lines)), np.diff(first))
+    p = np.concatenate([line[:-1] for line in lines])
+    r = np.concatenate([line[1:] for line in lines]) - p
+    low, high = np.minimum(p, p + r), np.maximum(p, p + r)
+    order = np.argsort(low[:, 0], kind="mergesort")
+    last = np.searchsorted(low[order, 0], high[order, 0], side="right")     # candidates: order[i+1:last[i]]
+    counts = np.maximum(last - np.arange(len(order)) - 1, 0)
+
+    total = np.concatenate([[0], np.cumsum(counts)])
+    cuts = []       # (segment, t, x, y)
+    i = 0
+    while i < len(order):
+        # Enough segments for about max_pairs candidate pairs
+        j = max(i + 1, int(np.searchsorted(total, total[i] + max_pairs, side="right")) - 1)
+        n = counts[i:j]
+        a = np.repeat(np.arange(i, j), n)
+        b = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n) + a + 1
+        a, b = order[a], order[b]
+        keep = (low[a, 1] <= high[b, 1]) & (low[b, 1] <= high[a, 1])
+        # Consecutive segments of a line share a vertex: not a crossing
+        keep &= ~((line_of[a] == line_of[b]) & (np.abs(a - b) == 1))
+        a, b = a[keep], b[keep]
+        denominator = _cross(r[a], r[b])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            t = _cross(p[b] - p[a], r[b]) / denominator
+            u = _cross(p[b] - p[a], r[a]) / denominator
+        hit = (denominator != 0) & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+        a, b, t, u = a[hit], b[hit], t[hit], u[hit]
+        # One point for both lines, so that their pieces share the node exactly
+        xy = p[a] + t[:, None]*r[a]
+        cuts += zip(a.tolist(), t.tolist(), xy[:, 0].tolist(), xy[:, 1].tolist())
+        cuts += zip(b.tolist(), u.tolist(), xy[:, 0].tolist(), xy[:, 1].tolist())
+        i = j
+
+    # Cut positions along each line (vertex number + t), its own ends left out
+    positions = {}
+    for segment, t, x, y in cuts:
+        k = line_of[segment]
+        position = segment - first[k] + t
+        if 0 < position < first[k+1] - first[k]:
+            positions.setdefault(k, {}).setdefault(round(position, 9), (x, y))
+    pieces, origin = [], []
+    for k, line in enumerate(lines):
+        if k not in positions:
+            pieces.append(line)
+            origin.append(k)
+            continue
+        marks = sorted(positions[k].items())
+        bounds = [(0.0, tuple(line[0]))] + marks + [(float(len(line)-1), tuple(line[-1]))]
+        for (start, a), (end, b) in zip(bounds[:-1], bounds[1:]):
+            inner = line[int(np.floor(start))+1:int(np.ceil(end))]
+            piece = dropRepeatedVertices(np.concatenate([[a], inner, [b]]))
+            if len(piece) >= 2:
+                pieces.append(piece)
+                origin.append(k)
+    return pieces, np.array(origin, dtype=np.int64)
+
+def snapEndpoints(points, tolerance):
+    # Node number of each point: points closer than tolerance share the same node (grid hashing)
+    points = np.asarray(points, dtype=np.float64)
+    tolerance = float(tolerance) if tolerance else 1e-9
+    grid = {}
+    nodes = []
+    node_of = np.empty(len(points), dtype=np.int64)
+    for i, (x, y) in enumerate(points.tolist()):
+        gx, gy = int(np.floor(x/tolerance)), int(np.floor(y/tolerance))
+        found = -1
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for node in grid.get((gx+dx, gy+dy), ()):
+                    nx, ny = nodes[node]
+                    if (nx-x)**2 + (ny-y)**2 <= tolerance**2:
+                        found = node
+                        break
+                if found >= 0:
+                    break
+            if found >= 0:
+                break
+        if found < 0:
+            found = len(nodes)
+            nodes.append((x, y))
+            grid.setdefault((gx, gy), []).append(found)
+        node_of[i] = found
+    return node_of, np.array(nodes).reshape(-1, 2)
+
+def assemblePolygons(mhw_lines, surge_lines, connector_lines, tolerance=0.0, length_factor=1.0):
+    # Faces bounded by at least one mean high water piece (and not only by such pieces: closed mean high water
+    # rings are ponds or islands, not lowlands). Returns a list of dictionaries with the ring (closed array of
+    # coordinates), its area, and the wall length: length of its mean high water edges times length_factor.
+    lines, kinds = [], []
+    for kind, group in ((MHW, mhw_lines), (SURGE, surge_lines), (CONNECTOR, connector_lines)):
+        for line in group:
+            line = dropRepeatedVertices(line)
+            if len(line) >= 2:
+                lines.append(line)
+                kinds.append(kind)
+    if not lines:
+        return []
+    lines, origin = nodeLines(lines)
+    kinds = np.array(kinds)[origin]
+
+    # Nodes: the snapped ends of the lines
+    ends = np.array([[line[0], line[-1]] for line in lines])
+    node_of, nodes = snapEndpoints(ends.reshape(-1, 2), tolerance)
+    start, end = node_of[0::2], node_of[1::2]
+    for i, line in enumerate(lines):
+        line[0], line[-1] = nodes[start[i]], nodes[end[i]]
+        lines[i] = dropRepeatedVertices(line)
+
+    # Dangling lines do not bound any face: remove them until none is left
+    alive = np.array([len(line) >= 2 for line in lines])
+    while True:
+        degree = np.bincount(np.concatenate([start[alive], end[alive]]), minlength=len(nodes))
+        dangling = alive & ((degree[start] == 1) | (degree[end] == 1))
+        if not dangling.any():
+            break
+        alive &= ~dangling
+    edges = np.nonzero(alive)[0]
+    if len(edges) == 0:
+        return []
+
+    # Half edges: 2k goes along edge k, 2k+1 goes back
+    origin = np.empty(2*len(edges), dtype=np.int64)
+    origin[0::2], origin[1::2] = start[edges], end[edges]
+    first_step = np.empty((2*len(edges), 2))
+    first_step[0::2] = [lines[e][1] - lines[e][0] for e in edges]
+    first_step[1::2] = [lines[e][-2] - lines[e][-1] for e in edges]
+    angle = np.arctan2(first_step[:, 1], first_step[:, 0])
+
+    # Outgoing half edges of each node sorted counterclockwise
+    order = np.lexsort((angle, origin))
+    position = np.empty_like(order)
+    position[order] = np.arange(len(order))
+    group_start = np.searchsorted(origin[order], origin[order], side="left")[position]
+    group_size = np.bincount(origin, minlength=len(nodes))[origin]
+    # The half edge following h leaves its destination just clockwise of the way back (its twin)
+    twin = np.arange(len(order)) ^ 1
+    p = position[twin]
+    previous = np.where(p-1 >= group_start[twin], p-1, group_start[twin] + group_size[twin] - 1)
+    following = order[previous]
+
+    # Walk the faces
+    face_of = np.full(len(order), -1, dtype=np.int64)
+    faces = []
+    for h in range(len(order)):
+        if face_of[h] >= 0:
+            continue
+        cycle = []
+        while face_of[h] < 0:
+            face_of[h] = len(faces)
+            cycle.append(h)
+            h = following[h]
+        faces.append(cycle)
+
+    lengths = np.array([np.sqrt((np.diff(lines[e], axis=0)**2).sum(axis=1)).sum() for e in edges])
+    polygons = []
+    for cycle in faces:
+        cycle = np.array(cycle)
+        cycle_kinds = kinds[edges[cycle // 2]]
+        if not (cycle_kinds == MHW).any() or (cycle_kinds == MHW).all():
+            continue
+        ring = np.concatenate([lines[edges[h // 2]][:-1] if h % 2 == 0 else lines[edges[h // 2]][::-1][:-1]
+                               for h in cycle] + [[nodes[origin[cycle[0]]]]])
+        area = 0.5 * np.sum(ring[:-1, 0]*ring[1:, 1] - ring[1:, 0]*ring[:-1, 1])
+        if area <= 0:
+            continue        # the unbounded face around each group of lines
+        # The same mean high water piece can only be counted once, even if the face goes along both of its sides
+        mhw_edges = np.unique(cycle[cycle_kinds == MHW] // 2)
+        polygons.append({"ring": ring, "area": area, "wall_length": lengths[mhw_edges].sum() * length_factor,
+                         "mhw_edges": edges[mhw_edges]})
+    return polygons
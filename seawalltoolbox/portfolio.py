@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+#---------------------------------------------------------------------------------------------------------------------#
+# PORTFOLIO OF SEAWALLS UNDER A CAPITAL BUDGET
+# Multiple-choice knapsack: each segment gets exactly one option (option 0 is no wall, option i is a wall at surges[i])
+#---------------------------------------------------------------------------------------------------------------------#
+def portfolioCurves(marginal_benefits, marginal_costs):
+    # Total benefits and costs of each option, segments x options, consistent with efficientHeights:
+    # a wall at surges[i] gives sum(marginal_benefits[0:i]) for sum(marginal_costs[0:i])
+    marginal_benefits = np.atleast_2d(np.asarray(marginal_benefits, dtype=float))
+    marginal_costs = np.atleast_2d(np.asarray(marginal_costs, dtype=float))
+    zeros = np.zeros(marginal_benefits.shape[:-1] + (1,))
+    benefits = np.concatenate([zeros, np.cumsum(marginal_benefits, axis=-1)[..., :-1]], axis=-1)
+    costs = np.concatenate([zeros, np.cumsum(marginal_costs, axis=-1)[..., :-1]], axis=-1)
+    return benefits, costs
+
+def lagrangianPortfolio(benefits, costs, budget, tolerance=1e-6, max_iterations=100):
+    # Relax the budget with a price on capital (lambda) and bisect it. For a given lambda every segment
+    # independently takes its best option, which is one argmax over the whole segments x options array
+    net = benefits - costs
+    rows = np.arange(net.shape[0])
+
+    def choose(price):
+        choice = np.argmax(net - price*costs, axis=1)
+        return choice, costs[rows, choice].sum()
+
+    low, high = 0.0, 1.0
+    choice, spent = choose(low)
+    if spent <= budget:
+        return choice
+    # Find a price high enough to be within the budget
+    while choose(high)[1] > budget and high < 1e12:
+        low, high = high, high*2
+    for iteration in range(max_iterations):
+        if high-low <= tolerance*max(1.0, high):
+            break
+        middle = (low+high)/2
+        if choose(middle)[1] > budget:
+            low = middle
+        else:
+            high = middle
+    choice, spent = choose(high)
+
+    # The relaxation may leave some budget unspent: upgrade segments greedily while it fits
+    # (one vectorized pass per round, best gains first)
+    remaining = budget - spent
+    while True:
+        extra_cost = costs - costs[rows, choice][:, None]
+        gain = np.where((extra_cost <= remaining) & (extra_cost > 0), net - net[rows, choice][:, None], 0.0)
+        best = np.argmax(gain, axis=1)
+        upgraded = False
+        for j in np.argsort(-gain[rows, best]):
+            if gain[j, best[j]] <= 0:
+                break
+            if extra_cost[j, best[j]] <= remaining:
+                choice[j] = best[j]
+                remaining -= extra_cost[j, best[j]]
+                upgraded = True
+        if not upgraded:
+            break
+    return choice
+
+def dynamicPortfolio(benefits, costs, budget, budget_step):
+    # Exact dynamic programming over the budget discretized in budget_step units
+    # Options that cost more but return less than a cheaper one of the same segment are dropped first
+    net = benefits - costs
+    n_cells = int(budget // budget_step) + 1
+    units = np.ceil(costs / budget_step - 1e-9).astype(int)
+    cells = np.arange(n_cells)
+    value = np.zeros(n_cells)
+    decisions = np.zeros((net.shape[0], n_cells), dtype=np.int32)
+    for j in range(net.shape[0]):
+        order = np.lexsort((-net[j], units[j]))
+        keep = order[net[j, order] > np.maximum.accumulate(np.concatenate([[-np.inf], net[j, order]]))[:-1]]
+        keep = keep[units[j, keep] < n_cells]
+        # value[b] = max over the options h of (previous value[b-units[h]] + net[h])
+        candidates = np.where(cells[:, None] >= units[j, keep][None, :],
+                              value[np.maximum(cells[:, None] - units[j, keep][None, :], 0)] + net[j, keep][None, :],
+                              -np.inf)
+        best = np.argmax(candidates, axis=1)
+        value = candidates[cells, best]
+        decisions[j] = keep[best]
+    # Backtrack from the full budget
+    choice = np.zeros(net.shape[0], dtype=int)
+    b = n_cells-1
+    for j in range(net.shape[0]-1, -1, -1):
+        choice[j] = decisions[j, b]
+        b -= units[j, choice[j]]
+    return choice
+
+def portfolioOptimizer(benefits, costs, budget, method="lagrangian", budget_step=None):
+    # Returns the option chosen for each segment, the capital spent and the net benefits of the portfolio
+    # Copies: the arrays of the caller are not changed
+    benefits = np.atleast_2d(np.array(benefits, dtype=float))
+    costs = np.atleast_2d(np.array(costs, dtype=float))
+    # Option 0 must be the free "no wall" option so that a feasible portfolio always exists
+    costs[:, 0] = 0
+    benefits[:, 0] = 0
+    if method == "lagrangian":
+        choice = lagrangianPortfolio(benefits, costs, float(budget))
+    elif method == "dp":
+        if budget_step is None:
+            budget_step = float(budget)/1000
+        choice = dynamicPortfolio(benefits, costs, float(budget), float(budget_step))
+    else:
+        raise ValueError("Unknown portfolio method: " + str(method))
+    rows = np.arange(benefits.shape[0])
+    return choice, costs[rows, choice].sum(), (benefits-costs)[rows, choice].sum()
+#---------------------------------------------------------------------------------------------------------------------#
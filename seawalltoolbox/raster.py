@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+from collections import namedtuple
+
+import numpy as np
+
+from ._compat import arcpy
+
+#---------------------------------------------------------------------------------------------------------------------#
+# TILES OF A RASTER
+# A window is the block that is read (core + halo, clipped to the raster). The core is the part the tile "owns":
+# every cell belongs to exactly one core, so results computed on cores can simply be added or concatenated.
+#---------------------------------------------------------------------------------------------------------------------#
+Window = namedtuple("Window", ["row", "col", "nrows", "ncols", "core_row", "core_col", "core_nrows", "core_ncols"])
+
+def tileWindows(shape, tile_size, halo=0):
+    nrows, ncols = shape
+    for core_row in range(0, nrows, tile_size):
+        for core_col in range(0, ncols, tile_size):
+            core_nrows = min(tile_size, nrows-core_row)
+            core_ncols = min(tile_size, ncols-core_col)
+            row = max(core_row-halo, 0)
+            col = max(core_col-halo, 0)
+            yield Window(row, col, min(core_row+core_nrows+halo, nrows)-row, min(core_col+core_ncols+halo, ncols)-col,
+                         core_row, core_col, core_nrows, core_ncols)
+
+def coreSlices(window):
+    # Position of the core inside the array read for the window
+    return (slice(window.core_row-window.row, window.core_row-window.row+window.core_nrows),
+            slice(window.core_col-window.col, window.core_col-window.col+window.core_ncols))
+
+#---------------------------------------------------------------------------------------------------------------------#
+# RASTER SOURCES
+# Anything with shape, cellsize, x_min, y_max and read(row, col, nrows, ncols) can feed the raster stages.
+# Rows go from north to south, NoData is returned as NaN.
+#---------------------------------------------------------------------------------------------------------------------#
+class ArraySource(object):
+    def __init__(self, array, x_min=0.0, y_max=0.0, cellsize=1.0, nodata=None):
+        array = np.asarray(array, dtype=np.float32)
+        if nodata is not None:
+            array = np.where(array == nodata, np.nan, array)
+        self.array = array
+        self.shape = array.shape
+        self.x_min = float(x_min)
+        self.y_max = float(y_max)
+        self.cellsize = float(cellsize)
+
+    def read(self, row, col, nrows, ncols):
+        return self.array[row:row+nrows, col:col+ncols]
+
+class RasterSource(object):
+    # Reads blocks of a raster dataset or layer through arcpy, so only one tile is in memory at a time
+    def __init__(self, raster):
+        self.raster = raster
+        description = arcpy.Describe(raster)
+        self.x_min = description.extent.XMin
+        self.y_max = description.extent.YMax
+        self.cellsize = description.meanCellWidth
+        self.shape = (description.height, description.width)
+
+    def read(self, row, col, nrows, ncols):
+        lower_left = arcpy.Point(self.x_min + col*self.cellsize, self.y_max - (row+nrows)*self.cellsize)
+        return arcpy.RasterToNumPyArray(self.raster, lower_left, ncols, nrows, np.nan).astype(np.float32)
+
+def cellCenters(source, window):
+    # x of each column and y of each row of a window
+    x = source.x_min + (np.arange(window.col, window.col+window.ncols) + 0.5) * source.cellsize
+    y = source.y_max - (np.arange(window.row, window.row+window.nrows) + 0.5) * source.cellsize
+    return x, y
+
+#---------------------------------------------------------------------------------------------------------------------#
+# POINT SAMPLING
+# Bilinear interpolation between the 4 cell centers around each point. The points are grouped by tile so that only
+# the tiles holding points are read, each once. NoData neighbours are left out of the weights; NaN outside the raster.
+#---------------------------------------------------------------------------------------------------------------------#
+def bilinearSample(source, x, y, tile_size=2048):
+    x = np.asarray(x, dtype=np.float64).ravel()
+    y = np.asarray(y, dtype=np.float64).ravel()
+    nrows, ncols = source.shape
+    values = np.full(len(x), np.nan)
+    # Position in cells from the center of the first cell
+    c = (x - source.x_min) / source.cellsize - 0.5
+    r = (source.y_max - y) / source.cellsize - 0.5
+    with np.errstate(invalid="ignore"):
+        inside = (c >= -0.5) & (c <= ncols-0.5) & (r >= -0.5) & (r <= nrows-0.5)
+    points = np.flatnonzero(inside)
+    if len(points) == 0:
+        return values
+    c0 = np.clip(np.floor(c[points]), 0, max(ncols-2, 0)).astype(np.int64)
+    r0 = np.clip(np.floor(r[points]), 0, max(nrows-2, 0)).astype(np.int64)
+    fc = np.clip(c[points] - c0, 0.0, 1.0)
+    fr = np.clip(r[points] - r0, 0.0, 1.0)
+    weights = np.stack([(1-fr)*(1-fc), (1-fr)*fc, fr*(1-fc), fr*fc], axis=1)
+
+    tiles, tile_of = np.unique(np.stack([r0 // tile_size, c0 // tile_size], axis=1), axis=0, return_inverse=True)
+    tile_of = tile_of.ravel()
+    for k, (i, j) in enumerate(tiles):
+        mine = np.flatnonzero(tile_of == k)
+        row, col = i*tile_size, j*tile_size
+        block = source.read(row, col, min(tile_size+1, nrows-row), min(tile_size+1, ncols-col))
+        rr, cc = r0[mine] - row, c0[mine] - col
+        # A raster one cell wide or high has no second row or column
+        rr1, cc1 = np.minimum(rr+1, block.shape[0]-1), np.minimum(cc+1, block.shape[1]-1)
+        corners = np.stack([block[rr, cc], block[rr, cc1], block[rr1, cc], block[rr1, cc1]], axis=1)
+        w = np.where(np.isfinite(corners), weights[mine], 0.0)
+        total = w.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            values[points[mine]] = np.where(total > 0, (w * np.nan_to_num(corners)).sum(axis=1) / total, np.nan)
+    return values
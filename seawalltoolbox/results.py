@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import os, json, time, sqlite3
+
+import numpy as np
+
+from .economics import slr_scenarios, efficientHeights
+from .portfolio import portfolioCurves, portfolioOptimizer
+
+#---------------------------------------------------------------------------------------------------------------------#
+# RESULTS STORE
+# One SQLite file keeping every run: its parameters and surge levels, and for each segment its wall length, damage
+# curve and marginal costs, its marginal benefits under each sea level rise pathway, its efficient heights and its
+# portfolio wall. The curves are stored one row per segment (float64 arrays over the surge levels of the run), the
+# heights one row per crossing, so that a run of thousands of segments is one bulk insert of a few thousand rows.
+# Every table is indexed on (run, segment): runs can be queried and compared without running the tool again.
+#---------------------------------------------------------------------------------------------------------------------#
+def _blob(values):
+    return sqlite3.Binary(np.ascontiguousarray(values, dtype="<f8").tobytes())
+
+def _array(blob):
+    return np.frombuffer(bytes(blob), dtype="<f8")
+
+class ResultsStore(object):
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS runs "
+                                    "(run INTEGER PRIMARY KEY, created TEXT, label TEXT, parameters TEXT, surges TEXT)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS segments (run INTEGER, segment TEXT, wall_length REAL, "
+                                    "damage BLOB, marginal_cost BLOB, PRIMARY KEY (run, segment))")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS benefits (run INTEGER, scenario TEXT, segment TEXT, "
+                                    "marginal_benefit BLOB, PRIMARY KEY (run, scenario, segment))")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS heights "
+                                    "(run INTEGER, scenario TEXT, segment TEXT, height REAL, benefits REAL)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS portfolio "
+                                    "(run INTEGER, scenario TEXT, segment TEXT, height REAL)")
+            for table in ("heights", "portfolio"):
+                self.connection.execute("CREATE INDEX IF NOT EXISTS {0}_run_segment ON {0} (run, segment)".format(table))
+
+    def saveRun(self, parameters, surges, segment_ids, wall_lengths, damage_curves, marginal_costs,
+                marginal_benefits, budget=None, scenarios=slr_scenarios, label=None):
+        # marginal_benefits: scenarios x segments x surges, as returned by reportSegments. Returns the run number.
+        surges = np.asarray(surges, dtype=float)
+        n_segments, n_surges = len(segment_ids), len(surges)
+        damage_curves = np.asarray(damage_curves, dtype=float).reshape(n_segments, n_surges)
+        marginal_costs = np.asarray(marginal_costs, dtype=float).reshape(n_segments, n_surges)
+        marginal_benefits = np.asarray(marginal_benefits, dtype=float).reshape(len(scenarios), n_segments, n_surges)
+        segment_ids = [str(s_id) for s_id in segment_ids]
+        names = [scenario[0] for scenario in scenarios]
+        crossings, heights, totals = efficientHeights(surges, marginal_benefits, marginal_costs)
+
+        with self.connection:
+            run = self.connection.execute("INSERT INTO runs (created, label, parameters, surges) VALUES (?, ?, ?, ?)",
+                                          (time.strftime("%Y-%m-%d %H:%M:%S"), label, json.dumps(parameters),
+                                           json.dumps(surges.tolist()))).lastrowid
+            self.connection.executemany("INSERT INTO segments VALUES (?, ?, ?, ?, ?)", [
+                (run, s_id, float(length), _blob(damage), _blob(cost))
+                for s_id, length, damage, cost in zip(segment_ids, wall_lengths, damage_curves, marginal_costs)])
+            self.connection.executemany("INSERT INTO benefits VALUES (?, ?, ?, ?)", [
+                (run, name, s_id, _blob(benefit)) for name, benefits in zip(names, marginal_benefits)
+                for s_id, benefit in zip(segment_ids, benefits)])
+            self.connection.executemany("INSERT INTO heights VALUES (?, ?, ?, ?, ?)", [
+                (run, names[k], segment_ids[j], float(h), float(t))
+                for k, j, h, t in zip(crossings[0].tolist(), crossings[1].tolist(), heights, totals)])
+            if budget is not None:
+                for k, name in enumerate(names):
+                    benefits, costs = portfolioCurves(marginal_benefits[k], marginal_costs)
+                    choice = portfolioOptimizer(benefits, costs, budget)[0]
+                    self.connection.executemany("INSERT INTO portfolio VALUES (?, ?, ?, ?)", [
+                        (run, name, segment_ids[j], float(surges[choice[j]])) for j in np.nonzero(choice)[0]])
+        return run
+
+    def runs(self):
+        # (run, created, label, parameters) of every run, oldest first
+        return [(row[0], row[1], row[2], json.loads(row[3])) for row in
+                self.connection.execute("SELECT run, created, label, parameters FROM runs ORDER BY run")]
+
+    def lastRun(self):
+        row = self.connection.execute("SELECT MAX(run) FROM runs").fetchone()
+        return row[0]
+
+    def surges(self, run):
+        row = self.connection.execute("SELECT surges FROM runs WHERE run = ?", (run,)).fetchone()
+        return np.array(json.loads(row[0]) if row else [], dtype=float)
+
+    def curves(self, run, segments=None):
+        # Segment IDs, wall lengths, damage curves and marginal costs (segments x surges) of a run, of all its
+        # segments (in the order of the run) or of the given ones
+        query = "SELECT segment, wall_length, damage, marginal_cost FROM segments WHERE run = ?"
+        if segments is None:
+            rows = self.connection.execute(query + " ORDER BY rowid", (run,)).fetchall()
+        else:
+            segments = [str(s) for s in segments]
+            rows = []
+            for start in range(0, len(segments), 500):
+                chunk = segments[start:start+500]
+                rows += self.connection.execute(query + " AND segment IN ({0})".format(",".join("?"*len(chunk))),
+                                                [run] + chunk).fetchall()
+        n_surges = len(self.surges(run))
+        return ([row[0] for row in rows], np.array([row[1] for row in rows]),
+                np.array([_array(row[2]) for row in rows]).reshape(len(rows), n_surges),
+                np.array([_array(row[3]) for row in rows]).reshape(len(rows), n_surges))
+
+    def marginalBenefits(self, run, scenario):
+        # Segment IDs and marginal benefits (segments x surges) of a run under one pathway
+        rows = self.connection.execute("SELECT segment, marginal_benefit FROM benefits WHERE run = ? AND scenario = ? "
+                                       "ORDER BY rowid", (run, scenario)).fetchall()
+        return [row[0] for row in rows], np.array([_array(row[1]) for row in rows]).reshape(len(rows), -1)
+
+    def heights(self, run, scenario=None):
+        # (scenario, segment, height, benefits) of every efficient height of a run
+        query = "SELECT scenario, segment, height, benefits FROM heights WHERE run = ?"
+        if scenario is None:
+            return self.connection.execute(query + " ORDER BY scenario, segment, height", (run,)).fetchall()
+        return self.connection.execute(query + " AND scenario = ? ORDER BY segment, height", (run, scenario)).fetchall()
+
+    def compareHeights(self, run_a, run_b):
+        # (scenario, segment, highest efficient height in run_a, in run_b) of the segments of either run;
+        # None where a segment has no efficient height (or does not exist) in a run
+        query = ("SELECT a.scenario, a.segment, a.height, b.height FROM "
+                 "(SELECT scenario, segment, MAX(height) AS height FROM heights WHERE run = ? GROUP BY scenario, segment) a "
+                 "LEFT JOIN "
+                 "(SELECT scenario, segment, MAX(height) AS height FROM heights WHERE run = ? GROUP BY scenario, segment) b "
+                 "ON a.scenario = b.scenario AND a.segment = b.segment")
+        rows = self.connection.execute(query, (run_a, run_b)).fetchall()
+        only_b = self.connection.execute(query, (run_b, run_a)).fetchall()
+        rows += [(scenario, segment, None, height) for scenario, segment, height, other in only_b if other is None]
+        return sorted(rows)
+
+    def close(self):
+        self.connection.close()
+
+def defaultResultsPath(workspace):
+    # Next to the workspace, like the elevation cache
+    folder = os.path.dirname(workspace) if workspace.lower().endswith(".gdb") else workspace
+    return os.path.join(folder, "seawall_results.sqlite")
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+import json, threading
+
+import numpy as np
+
+from ._compat import addMessage, clock
+from .damage import segmentDamageCurves, damageMatrix
+from .economics import class_segment, slr_scenarios, slrPathways, expectedDamages, efficientHeights
+from .portfolio import portfolioCurves, portfolioOptimizer
+from .delta import ParcelState
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+    from queue import Queue
+except ImportError:     # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+    from Queue import Queue
+
+#---------------------------------------------------------------------------------------------------------------------#
+# STUDY SESSION
+# A study area loaded once and kept in memory: the parcels, their segments and the damage curves of the last run
+# (from its parcel state, see delta.py), the DEM, and what is derived from it on first use (the inundation index of
+# the priority-flood, contours by level). A new surge level or new economic parameters are then array operations on
+# what is loaded, instead of a new run of the tool.
+#---------------------------------------------------------------------------------------------------------------------#
+def _jsonable(value):
+    # Arrays to lists and NaN/infinity to null, so that the results are valid JSON
+    if isinstance(value, dict):
+        return dict((str(k), _jsonable(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return _jsonable(value.tolist())
+    if isinstance(value, (np.integer,)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        return float(value) if np.isfinite(value) else None
+    return value
+
+class StudySession(object):
+    def __init__(self, state, dem=None, mean_high_water=None, message=addMessage):
+        # state: ParcelState or its path, dem: raster source (RasterSource, TiledDem, ArraySource) or None
+        state = ParcelState(state) if not isinstance(state, ParcelState) else state
+        start = clock()
+        if state.isEmpty():
+            raise ValueError("No run is stored in " + state.path)
+        self.parameters = state.parameters()
+        self.surges = np.array(state.surges(), dtype=float)
+        self.segment_ids, self.wall_lengths, rings, self.damage_curves = state.segments()
+        self.parcel_ids, self.values, self.elevations, self.parcel_of, self.segment_of = state.arrays()
+        self._costs = {}
+        self.dem = dem
+        self.mean_high_water = float(mean_high_water if mean_high_water is not None
+                                     else self.parameters.get("mean_high_water", 0))
+        self.message = message
+        self._index = None
+        self._contours = {}
+        self._lock = threading.Lock()
+        message("Study area loaded: {0} parcels, {1} segments in {2:.2f} s".format(
+                len(self.parcel_ids), len(self.segment_ids), clock() - start))
+
+    def summary(self):
+        return {"parcels": len(self.parcel_ids), "segments": len(self.segment_ids),
+                "surges": [self.surges[0], self.surges[-1]] if len(self.surges) else [],
+                "dem": None if self.dem is None else list(self.dem.shape),
+                "inundation_index": self._index is not None, "contours": sorted(self._contours),
+                "parameters": self.parameters}
+
+    def damages(self, surge):
+        # Damage of each segment and of all the parcels (each counted once) at one surge level
+        surge = [float(surge)]
+        by_segment = segmentDamageCurves(self.segment_of, self.values[self.parcel_of],
+                                         self.elevations[self.parcel_of], surge, len(self.segment_ids))[:, 0]
+        parcels = damageMatrix(self.values, self.elevations, surge)[:, 0]
+        return {"surge": surge[0], "total": parcels.sum(), "damaged_parcels": int((parcels > 0).sum()),
+                "segments": dict(zip(self.segment_ids, by_segment))}
+
+    def marginalCosts(self, discount_rate=0.04):
+        # Marginal wall costs (segments x surges), maintenance discounted at the rate of the benefits; kept by rate
+        discount_rate = float(discount_rate)
+        with self._lock:
+            if discount_rate not in self._costs:
+                self._costs[discount_rate] = np.array([
+                    class_segment(s_id, length).wall_cost(self.surges, discount_rate)[1]
+                    for s_id, length in zip(self.segment_ids, self.wall_lengths)]).reshape(len(self.segment_ids), -1)
+            return self._costs[discount_rate]
+
+    def economics(self, years=30, discount_rate=0.04, budget=None):
+        # Efficient heights (and the portfolio within budget) of every segment under every pathway
+        marginal_benefits = expectedDamages(self.damage_curves, self.surges, slrPathways(slr_scenarios, years),
+                                            discount_rate)
+        marginal_costs = self.marginalCosts(discount_rate)
+        crossings, heights, totals = efficientHeights(self.surges, marginal_benefits, marginal_costs)
+        result = {}
+        for k, scenario in enumerate(slr_scenarios):
+            efficient = {}
+            for i in np.nonzero(crossings[0] == k)[0]:
+                efficient.setdefault(self.segment_ids[crossings[1][i]], []).append([heights[i], totals[i]])
+            result[scenario[0]] = {"heights": efficient}
+            if budget is not None:
+                benefits, costs = portfolioCurves(marginal_benefits[k], marginal_costs)
+                choice, spent, net = portfolioOptimizer(benefits, costs, float(budget))
+                result[scenario[0]]["portfolio"] = {"spent": spent, "net_benefits": net, "walls": dict(
+                    (self.segment_ids[j], self.surges[choice[j]]) for j in np.nonzero(choice)[0])}
+        return result
+
+    def inundationIndex(self, message=None):
+        # Priority-flood of the DEM, once: every surge level is then a threshold on it
+        with self._lock:
+            if self._index is None:
+                if self.dem is None:
+                    raise ValueError("The session has no DEM")
+                from .flood import InundationIndex
+                (message or self.message)("Priority-flood of the DEM (once per session)")
+                self._index = InundationIndex.fromSource(self.dem, self.mean_high_water)
+            return self._index
+
+    def flood(self, surge, message=None):
+        index = self.inundationIndex(message)
+        return {"surge": float(surge), "flooded_area": float(index.floodedArea([float(surge)])[0])}
+
+    def contour(self, level, message=None):
+        # Contour polylines at level, kept for the session
+        level = round(float(level), 2)
+        with self._lock:
+            if level not in self._contours:
+                if self.dem is None:
+                    raise ValueError("The session has no DEM")
+                from .pipeline import tiledContour
+                self._contours[level] = tiledContour(self.dem, level, message=message or self.message)
+            return {"level": level, "lines": [np.asarray(line).tolist() for line in self._contours[level]]}
+
+    def simulate(self, simulations=20000, years=30, discount_rate=0.04, heights=None, seed=None, message=None):
+        # Loss distributions from a storm catalog (see catalog.py), one pathway at a time
+        from .catalog import simulateSurges, catalogLosses
+        message = message or self.message
+        events = simulateSurges(int(simulations), int(years), slr_scenarios, seed)
+        result = {}
+        for k, scenario in enumerate(slr_scenarios):
+            message("Storm catalog: pathway {0} ({1} of {2})".format(scenario[0], k+1, len(slr_scenarios)))
+            losses = catalogLosses(self.surges, self.damage_curves, events[k], heights, discount_rate)
+            result[scenario[0]] = {"heights": losses["heights"], "aal": dict(zip(self.segment_ids, losses["aal"])),
+                                   "benefits": dict(zip(self.segment_ids, losses["benefits"]))}
+        return result
+
+#---------------------------------------------------------------------------------------------------------------------#
+# LOCAL HTTP SERVICE
+#   GET /status                                  what is loaded
+#   GET /damages?surge=2.6                       damage by segment at a surge level
+#   GET /economics?years=30&discount_rate=0.04&budget=5e6
+#   GET /flood?surge=2.6                         flooded area (the first query runs the priority-flood)
+#   GET /contour?level=2.6                       contour polylines
+#   GET /simulate?simulations=20000&seed=1       storm catalog losses
+# Answers are JSON. Long queries (flood, contour, simulate) stream their progress first, one JSON line per message
+# ({"progress": ...}), then the result ({"result": ...}) or the error ({"error": ...}). Only localhost is served.
+#---------------------------------------------------------------------------------------------------------------------#
+_queries = {"damages": ("damages", ["surge"], False),
+            "economics": ("economics", ["years", "discount_rate", "budget"], False),
+            "flood": ("flood", ["surge"], True),
+            "contour": ("contour", ["level"], True),
+            "simulate": ("simulate", ["simulations", "years", "discount_rate", "seed"], True)}
+
+def _number(text):
+    value = float(text)
+    return int(value) if value.is_integer() and "." not in text and "e" not in text.lower() else value
+
+class _ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class SessionHandler(BaseHTTPRequestHandler):
+    session = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json"):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        name = url.path.strip("/")
+        if name == "status":
+            return self._send(200, json.dumps(_jsonable(self.session.summary())))
+        if name not in _queries:
+            return self._send(404, json.dumps({"error": "Unknown query " + url.path}))
+        method, names, streamed = _queries[name]
+        try:
+            query = parse_qs(url.query)
+            kwargs = dict((key, _number(query[key][0])) for key in names if key in query)
+        except ValueError as e:
+            return self._send(400, json.dumps({"error": str(e)}))
+        if not streamed:
+            try:
+                result = getattr(self.session, method)(**kwargs)
+            except Exception as e:
+                return self._send(400, json.dumps({"error": str(e)}))
+            return self._send(200, json.dumps(_jsonable(result)))
+
+        # Streamed: the query runs in its own thread and its messages are sent as they come (HTTP/1.0: the answer
+        # ends when the connection is closed)
+        lines = Queue()
+        def work():
+            try:
+                kwargs["message"] = lambda text: lines.put({"progress": text})
+                lines.put({"result": getattr(self.session, method)(**kwargs)})
+            except Exception as e:
+                lines.put({"error": str(e)})
+        threading.Thread(target=work).start()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        while True:
+            line = lines.get()
+            self.wfile.write((json.dumps(_jsonable(line)) + "\n").encode("utf-8"))
+            self.wfile.flush()
+            if "progress" not in line:
+                break
+
+def serve(session, port=8765, host="127.0.0.1"):
+    # Serves the session until interrupted (Ctrl+C)
+    handler = type("Handler", (SessionHandler,), {"session": session})
+    server = _ThreadingServer((host, port), handler)
+    session.message("Serving the study area on http://{0}:{1}/ (Ctrl+C to stop)".format(host, server.server_port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
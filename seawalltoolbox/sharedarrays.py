@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+import os, atexit, shutil, tempfile, multiprocessing
+
+import numpy as np
+
+from .damage import segmentDamageCurves
+from .catalog import catalogLosses
+from .raster import tileWindows
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:     # Python 2 (ArcMap) and Python < 3.8: memory-mapped files
+    shared_memory = None
+
+#---------------------------------------------------------------------------------------------------------------------#
+# SHARED ARRAYS
+# The large arrays of a parallel step (DEM, parcel values and elevations, surge levels, damage curves, storm events)
+# are published once by the parent process: copied into shared memory (multiprocessing.shared_memory), or into
+# memory-mapped files when shared memory is not available or a folder is given. Each worker maps them once, when it
+# starts, and then reads them as read-only views without copying: a task only carries a few numbers (a window, a
+# range of segments or surge levels), whatever the size of the data or the number of workers. .npy files, like the
+# tiles of a DEM cache, are mapped by path without being copied at all.
+# The publisher owns the memory and releases it on close: at the end of the with block, on an error or at exit.
+# If the process is killed, Python's resource tracker unlinks the shared memory it leaves behind.
+#---------------------------------------------------------------------------------------------------------------------#
+class SharedArrays(object):
+    def __init__(self, folder=None):
+        # folder: memory-mapped files in a scratch folder inside it instead of shared memory
+        self.handles = {}       # name -> (kind, location, dtype, shape, writable): all that is sent to the workers
+        self.arrays = {}        # name -> view of the parent process
+        self._segments = []
+        self._folder = folder
+        self._scratch = None
+        self._closed = False
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, error, traceback):
+        self.close()
+
+    def _block(self, name, shape, dtype, writable):
+        if self._closed:
+            raise ValueError("The shared arrays are closed")
+        if name in self.handles:
+            raise ValueError("An array named {0} is already published".format(name))
+        dtype, shape = np.dtype(dtype), tuple(int(n) for n in shape)
+        size = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        if shared_memory is not None and self._folder is None:
+            segment = shared_memory.SharedMemory(create=True, size=size)
+            self._segments.append(segment)
+            kind, location, buffer = "memory", segment.name, segment.buf
+        else:
+            if self._scratch is None:
+                self._scratch = tempfile.mkdtemp(prefix="seawall_shared_", dir=self._folder)
+            kind, location = "file", os.path.join(self._scratch, name + ".bin")
+            buffer = np.memmap(location, np.uint8, "w+", shape=(size,))
+        array = np.ndarray(shape, dtype, buffer=buffer)
+        self.handles[name] = (kind, location, dtype.str, shape, writable)
+        self.arrays[name] = array
+        return array
+
+    def publish(self, name, array):
+        # Copy of array that the workers can read; returns the read-only view of the parent
+        array = np.ascontiguousarray(array)
+        shared = self._block(name, array.shape, array.dtype, False)
+        shared[...] = array
+        shared.flags.writeable = False
+        return shared
+
+    def publishFile(self, name, path):
+        # A .npy file mapped by every worker, without a copy (e.g. the tiles of a DEM cache, see tilecache.py)
+        if self._closed:
+            raise ValueError("The shared arrays are closed")
+        array = np.load(path, mmap_mode="r")
+        self.handles[name] = ("npy", os.path.abspath(path), array.dtype.str, array.shape, False)
+        self.arrays[name] = array
+        return array
+
+    def allocate(self, name, shape, dtype=np.float64):
+        # Zeroed output that the workers can write (each task to its own part of it)
+        array = self._block(name, shape, dtype, True)
+        array[...] = 0
+        return array
+
+    def close(self):
+        # Releases every array; the views still in use stay valid until they are dropped
+        if self._closed:
+            return
+        self._closed = True
+        self.arrays = {}
+        for segment in self._segments:
+            try:
+                segment.close()
+            except BufferError:     # a view is still referenced: the mapping goes with it
+                pass
+            try:
+                segment.unlink()
+            except OSError:
+                pass
+        self._segments = []
+        if self._scratch is not None:
+            shutil.rmtree(self._scratch, ignore_errors=True)
+
+#---------------------------------------------------------------------------------------------------------------------#
+# WORKERS
+# Each worker attaches the arrays once (pool initializer); tasks then get them by name with sharedArray.
+#---------------------------------------------------------------------------------------------------------------------#
+_worker_arrays = {}
+_worker_segments = []
+
+def attachArrays(handles):
+    # Views of the published arrays (read-only unless allocated as outputs)
+    arrays = {}
+    for name, (kind, location, dtype, shape, writable) in handles.items():
+        if kind == "npy":
+            arrays[name] = np.load(location, mmap_mode="r")
+            continue
+        if kind == "memory":
+            segment = shared_memory.SharedMemory(name=location)
+            _worker_segments.append(segment)        # the mapping lives as long as the worker
+            buffer = segment.buf
+        else:
+            buffer = np.memmap(location, np.uint8, "r+" if writable else "r")
+        array = np.ndarray(shape, np.dtype(dtype), buffer=buffer)
+        if not writable:
+            array.flags.writeable = False
+        arrays[name] = array
+    return arrays
+
+def _initWorker(handles):
+    _worker_arrays.update(attachArrays(handles))
+
+def sharedArray(name):
+    return _worker_arrays[name]
+
+class SharedPool(object):
+    # Worker processes that see the arrays of a SharedArrays. With processes=1 the tasks run in this process, on
+    # the same arrays (e.g. in ArcMap, where new Python processes cannot be started).
+    def __init__(self, arrays, processes=None):
+        self.arrays = arrays
+        self.processes = max(1, processes or multiprocessing.cpu_count())
+        self.pool = None
+        if self.processes > 1:
+            self.pool = multiprocessing.Pool(self.processes, _initWorker, (arrays.handles,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, error, traceback):
+        self.close(error is not None)
+
+    def map(self, function, tasks, chunksize=1):
+        # function must be defined at the top level of a module, so that the workers can find it
+        if self.pool is not None:
+            return self.pool.map(function, tasks, chunksize)
+        previous = dict(_worker_arrays)
+        _worker_arrays.update(self.arrays.arrays)
+        try:
+            return [function(task) for task in tasks]
+        finally:
+            _worker_arrays.clear()
+            _worker_arrays.update(previous)
+
+    def close(self, failed=False):
+        # After an error the workers are stopped without waiting for their tasks
+        if self.pool is None:
+            return
+        if failed:
+            self.pool.terminate()
+        else:
+            self.pool.close()
+        self.pool.join()
+        self.pool = None
+
+def _ranges(n, parts):
+    # About parts (first, last) ranges covering 0 to n
+    step = max(1, -(-n // max(1, parts)))
+    return [(first, min(first+step, n)) for first in range(0, n, step)]
+
+#---------------------------------------------------------------------------------------------------------------------#
+# PARALLEL DAMAGE CURVES
+# Same curves as segmentDamageCurves: each task computes the damages of every parcel at a range of surge levels and
+# writes them in its columns of the shared output.
+#---------------------------------------------------------------------------------------------------------------------#
+def _damageCurvesTask(task):
+    first, last, n_segments, chunk_size = task
+    curves = sharedArray("curves")
+    curves[:, first:last] = segmentDamageCurves(sharedArray("segment_of"), sharedArray("values"), sharedArray("dems"),
+                                                sharedArray("surges")[first:last], n_segments, chunk_size)
+    return last - first
+
+def parallelDamageCurves(segment_of_parcel, values, dems, surges, n_segments, processes=None, chunk_size=None):
+    processes = max(1, processes or multiprocessing.cpu_count())
+    with SharedArrays() as arrays:
+        arrays.publish("segment_of", np.asarray(segment_of_parcel, dtype=np.int64))
+        arrays.publish("values", np.asarray(values, dtype=float))
+        arrays.publish("dems", np.asarray(dems, dtype=float))
+        arrays.publish("surges", np.asarray(surges, dtype=float))
+        curves = arrays.allocate("curves", (n_segments, len(surges)))
+        tasks = [(first, last, n_segments, chunk_size) for first, last in _ranges(len(surges), 4*processes)]
+        with SharedPool(arrays, processes) as pool:
+            pool.map(_damageCurvesTask, tasks)
+        return np.array(curves)
+
+#---------------------------------------------------------------------------------------------------------------------#
+# PARALLEL ZONAL MEAN
+# Same means as tiledZonalMean, one task per tile. The DEM is an ArraySource (copied into shared memory once) or a
+# TiledDem (its tiles.npy is mapped by every worker: no copy), the zones an ArraySource or an array. Each task returns
+# the sums and counts of the few zones of its tile only.
+#---------------------------------------------------------------------------------------------------------------------#
+def _publishSource(arrays, name, source):
+    if hasattr(source, "tiles") and hasattr(source, "path"):
+        arrays.publishFile(name, os.path.join(source.path, "tiles.npy"))
+        return source.tile_size
+    if hasattr(source, "array") or isinstance(source, np.ndarray):
+        arrays.publish(name, np.asarray(getattr(source, "array", source), dtype=np.float32))
+        return None
+    raise ValueError("Only in-memory DEMs and DEM caches can be shared between processes: ingest the DEM first "
+                     "(see tilecache.py)")
+
+def _read(name, row, col, nrows, ncols):
+    array = sharedArray(name)
+    if array.ndim == 4:         # tiles of a DEM cache, the windows are tiles
+        t = array.shape[2]
+        return array[row // t, col // t, :nrows, :ncols]
+    return array[row:row+nrows, col:col+ncols]
+
+def _zonalTask(window):
+    row, col, nrows, ncols = window
+    dem = _read("dem", row, col, nrows, ncols)
+    zone = _read("zones", row, col, nrows, ncols)
+    inside = np.isfinite(dem) & np.isfinite(zone) & (zone >= 0)
+    zone, dem = zone[inside].astype(np.int64), dem[inside]
+    present, positions = np.unique(zone, return_inverse=True)
+    return present, np.bincount(positions, weights=dem), np.bincount(positions)
+
+def parallelZonalMean(source, zones, n_zones, tile_size=2048, processes=None):
+    with SharedArrays() as arrays:
+        tile_size = _publishSource(arrays, "dem", source) or tile_size
+        if _publishSource(arrays, "zones", zones) is not None:
+            raise ValueError("The zones must be an in-memory raster")
+        tasks = [(w.row, w.col, w.nrows, w.ncols) for w in tileWindows(source.shape, tile_size)]
+        sums, counts = np.zeros(n_zones), np.zeros(n_zones)
+        with SharedPool(arrays, processes) as pool:
+            for present, tile_sums, tile_counts in pool.map(_zonalTask, tasks):
+                keep = present < n_zones
+                sums[present[keep]] += tile_sums[keep]
+                counts[present[keep]] += tile_counts[keep]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+#---------------------------------------------------------------------------------------------------------------------#
+# PARALLEL STORM CATALOG
+# Same losses as catalogLosses for every pathway: the events (pathways x simulations x years) and the damage curves
+# are shared, each task evaluates one pathway for a range of segments.
+#---------------------------------------------------------------------------------------------------------------------#
+def _catalogTask(task):
+    k, first, last, heights, discount_rate, percentiles = task
+    return catalogLosses(sharedArray("surges"), sharedArray("curves")[first:last], sharedArray("events")[k], heights,
+                         discount_rate, percentiles)
+
+def parallelCatalogLosses(surges, damage_curves, events, heights=None, discount_rate=0.04,
+                          percentiles=(50, 90, 99, 99.5), processes=None):
+    # One catalogLosses dictionary per pathway of events
+    processes = max(1, processes or multiprocessing.cpu_count())
+    surges = np.asarray(surges, dtype=float)
+    damage_curves = np.asarray(damage_curves, dtype=float).reshape(-1, len(surges))
+    with SharedArrays() as arrays:
+        arrays.publish("surges", surges)
+        arrays.publish("curves", damage_curves)
+        arrays.publish("events", np.asarray(events, dtype=float))
+        parts = max(1, -(-4*processes // len(events)))
+        tasks = [(k, first, last, heights, discount_rate, percentiles) for k in range(len(events))
+                 for first, last in _ranges(len(damage_curves), parts)]
+        with SharedPool(arrays, processes) as pool:
+            partial = pool.map(_catalogTask, tasks)
+    losses = []
+    for k in range(len(events)):
+        parts = [p for task, p in zip(tasks, partial) if task[0] == k]
+        losses.append({"heights": parts[0]["heights"],
+                       "aal": np.concatenate([p["aal"] for p in parts]),
+                       "pv": np.concatenate([p["pv"] for p in parts]),
+                       "pv_percentiles": np.concatenate([p["pv_percentiles"] for p in parts], axis=1),
+                       "benefits": np.concatenate([p["benefits"] for p in parts])})
+    return losses
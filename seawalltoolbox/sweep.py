@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from .economics import class_segment, slr_scenarios, slrPathways, surgeProbability
+
+#---------------------------------------------------------------------------------------------------------------------#
+# ECONOMIC PARAMETER SWEEP
+# Sensitivity of the efficient walls to discount rate, useful life, maintenance (capex), wall base height and unit
+# cost. The surge probabilities are computed once, the discounted benefits once per discount rate, and the wall cost
+# is unit cost x maintenance factor x length x (height - base)^2, so every combination is a broadcast product.
+# Options follow portfolioCurves: option 0 is no wall, option i a wall at surges[i] with benefits sum(mb[0:i])
+# for costs sum(mc[0:i]). The efficient wall of each segment is its option with the largest net benefits.
+#---------------------------------------------------------------------------------------------------------------------#
+def maintenanceFactor(discount_rate, useful_life, capex):
+    # Building cost + discounted maintenance over the useful life, per unit of building cost (as in wall_cost)
+    discount_rate = np.asarray(discount_rate, dtype=float)
+    return 1 + capex * (1-np.exp(-discount_rate * useful_life)) / discount_rate
+
+def parameterSweep(surges, damage_curves, wall_lengths, discount_rate=0.04, useful_life=30,
+                   capex=class_segment.capex, wall_base_height=class_segment.wall_base_height,
+                   unit_cost=class_segment.unit_cost, years=30, scenarios=slr_scenarios, max_cells=2e7):
+    # Each parameter is a value or a list of values. Returns the efficient heights (NaN: no wall), their net
+    # benefits and option numbers, each of shape
+    #   discount rates x useful lives x capex x base heights x unit costs x scenarios x segments
+    surges = np.asarray(surges, dtype=float)
+    damage_curves = np.asarray(damage_curves, dtype=float).reshape(len(wall_lengths), len(surges))
+    wall_lengths = np.asarray(wall_lengths, dtype=float)
+    grid = [np.atleast_1d(np.asarray(values, dtype=float))
+            for values in (discount_rate, useful_life, capex, wall_base_height, unit_cost)]
+    rates, lives, capexes, bases, units = grid
+
+    # Shared by all the combinations: surge probabilities (scenarios x years x surges)
+    probabilities = surgeProbability(surges, slrPathways(scenarios, years))
+    # Discounted weights of each surge for each discount rate (rates x scenarios x surges)
+    discount = np.exp(-rates[:, None] * (np.arange(years)+1)[None, :])
+    weights = np.einsum("syh,dy->dsh", probabilities, discount)
+    # Option benefits (rates x scenarios x segments x options)
+    marginal = weights[:, :, None, :] * damage_curves[None, None, :, :]
+    benefits = np.concatenate([np.zeros(marginal.shape[:-1] + (1,)), np.cumsum(marginal, axis=-1)[..., :-1]],
+                              axis=-1)
+    # Option costs per unit cost and meter for each base height (base heights x options); no cost below the base
+    heights = np.maximum(surges[None, :] - bases[:, None], 0.0)**2
+    shape_costs = np.concatenate([np.zeros((len(bases), 1)), heights[:, :-1] - heights[:, :1]], axis=1)
+
+    # Cost scale of every combination but the base height (rates x lives x capex x unit costs)
+    scale = maintenanceFactor(rates[:, None, None], lives[None, :, None], capexes[None, None, :])
+    scale = scale[..., None] * units[None, None, None, :]
+
+    n_scenarios, n_segments, n_options = benefits.shape[1:]
+    shape = tuple(len(values) for values in grid) + (n_scenarios, n_segments)
+    choice = np.zeros(shape, dtype=np.int64)
+    net = np.zeros(shape)
+    # The other combinations of each discount rate and base height by chunks of bounded size
+    others = [(l, c, u) for l in range(len(lives)) for c in range(len(capexes)) for u in range(len(units))]
+    chunk = max(1, int(max_cells // (n_scenarios * n_segments * n_options)))
+    for d in range(len(rates)):
+        for b in range(len(bases)):
+            cost_per_scale = wall_lengths[:, None] * shape_costs[b][None, :]          # segments x options
+            for first in range(0, len(others), chunk):
+                l, c, u = np.array(others[first:first+chunk]).T
+                k = scale[d, l, c, u]
+                values = benefits[d][None] - k[:, None, None, None] * cost_per_scale[None, None]
+                best = np.argmax(values, axis=-1)
+                choice[d, l, c, b, u] = best
+                net[d, l, c, b, u] = np.take_along_axis(values, best[..., None], axis=-1)[..., 0]
+    efficient = np.where(choice > 0, surges[choice], np.nan)
+    return efficient, net, choice
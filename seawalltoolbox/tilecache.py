@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+import os, json
+
+import numpy as np
+
+from .raster import Window, tileWindows, cellCenters, ArraySource
+from .contours import marchingSquares, joinSegments
+from .pipeline import runTiles
+
+#---------------------------------------------------------------------------------------------------------------------#
+# TILED DEM CACHE
+# The DEM is converted once into a folder of .npy files that are memory-mapped when read:
+#   header.json             georeference, shape, tile size, number of overview levels
+#   tiles.npy               tile rows x tile cols x tile size x tile size, float32, NoData as NaN (edges padded)
+#   nodata.npy              same layout, True where the DEM has no data
+#   stats.npy               min, max and number of valid cells of each tile
+#   min_<k>.npy, max_<k>.npy  overviews: min and max of each 2^k x 2^k block of cells
+# A read inside one tile is a view of the file (no copy). Stages can ask for the range of values of a block before
+# reading it, and skip the tiles entirely above the surge or below mean high water.
+#---------------------------------------------------------------------------------------------------------------------#
+stats_fields = [("min", np.float32), ("max", np.float32), ("count", np.int64)]
+
+def ingestDem(source, path, tile_size=256, levels=4, depth=2, io_threads=1, message=None):
+    # source is any raster source (see raster.py), e.g. RasterSource(dem) to read a LiDAR raster through arcpy
+    if tile_size % 2**levels:
+        raise ValueError("The tile size must be a multiple of 2^levels ({0})".format(2**levels))
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    nrows, ncols = source.shape
+    tile_rows, tile_cols = -(-nrows // tile_size), -(-ncols // tile_size)
+    grid = (tile_rows, tile_cols, tile_size, tile_size)
+    open_memmap = np.lib.format.open_memmap
+    tiles = open_memmap(os.path.join(path, "tiles.npy"), "w+", np.float32, grid)
+    nodata = open_memmap(os.path.join(path, "nodata.npy"), "w+", np.bool_, grid)
+    stats = open_memmap(os.path.join(path, "stats.npy"), "w+", stats_fields, (tile_rows, tile_cols))
+    overviews = []
+    for k in range(1, levels+1):
+        shape = (tile_rows * (tile_size >> k), tile_cols * (tile_size >> k))
+        overviews.append((open_memmap(os.path.join(path, "min_{0}.npy".format(k)), "w+", np.float32, shape),
+                          open_memmap(os.path.join(path, "max_{0}.npy".format(k)), "w+", np.float32, shape)))
+
+    def load(window):
+        return source.read(window.row, window.col, window.nrows, window.ncols)
+
+    def compute(window, dem):
+        tile = np.full((tile_size, tile_size), np.nan, dtype=np.float32)
+        tile[:window.nrows, :window.ncols] = dem
+        valid = np.isfinite(tile)
+        blocks = []
+        for k in range(1, levels+1):
+            f = 2**k
+            block = tile.reshape(tile_size // f, f, tile_size // f, f)
+            # fmin/fmax ignore NaN (all NaN ==> NaN)
+            blocks.append((np.fmin.reduce(np.fmin.reduce(block, axis=3), axis=1),
+                           np.fmax.reduce(np.fmax.reduce(block, axis=3), axis=1)))
+        count = int(valid.sum())
+        low, high = (tile[valid].min(), tile[valid].max()) if count else (np.nan, np.nan)
+        return tile, ~valid, (low, high, count), blocks
+
+    def write(window, result):
+        i, j = window.row // tile_size, window.col // tile_size
+        tile, mask, tile_stats, blocks = result
+        tiles[i, j] = tile
+        nodata[i, j] = mask
+        stats[i, j] = tile_stats
+        for k, (low, high) in enumerate(blocks, 1):
+            size = tile_size >> k
+            overviews[k-1][0][i*size:(i+1)*size, j*size:(j+1)*size] = low
+            overviews[k-1][1][i*size:(i+1)*size, j*size:(j+1)*size] = high
+
+    runTiles(tileWindows(source.shape, tile_size), load, compute, write, depth, io_threads, "DEM cache", message)
+    for array in [tiles, nodata, stats] + [a for pair in overviews for a in pair]:
+        array.flush()
+    with open(os.path.join(path, "header.json"), "w") as f:
+        json.dump({"nrows": nrows, "ncols": ncols, "tile_size": tile_size, "levels": levels,
+                   "x_min": source.x_min, "y_max": source.y_max, "cellsize": source.cellsize}, f)
+    return TiledDem(path)
+
+class TiledDem(object):
+    # Raster source (shape, cellsize, x_min, y_max, read) over a folder written by ingestDem
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "header.json")) as f:
+            header = json.load(f)
+        self.shape = (header["nrows"], header["ncols"])
+        self.tile_size = header["tile_size"]
+        self.levels = header["levels"]
+        self.x_min = header["x_min"]
+        self.y_max = header["y_max"]
+        self.cellsize = header["cellsize"]
+        self.tiles = np.load(os.path.join(path, "tiles.npy"), mmap_mode="r")
+        self.nodata = np.load(os.path.join(path, "nodata.npy"), mmap_mode="r")
+        self.stats = np.load(os.path.join(path, "stats.npy"))
+
+    def read(self, row, col, nrows, ncols):
+        t = self.tile_size
+        first_row, first_col = row // t, col // t
+        last_row, last_col = (row+nrows-1) // t, (col+ncols-1) // t
+        if first_row == last_row and first_col == last_col:
+            # Zero-copy: a read-only view of the memory-mapped tile
+            return self.tiles[first_row, first_col, row-first_row*t:row-first_row*t+nrows,
+                              col-first_col*t:col-first_col*t+ncols]
+        block = np.empty((nrows, ncols), dtype=np.float32)
+        for i in range(first_row, last_row+1):
+            for j in range(first_col, last_col+1):
+                top, bottom = max(row, i*t), min(row+nrows, (i+1)*t)
+                left, right = max(col, j*t), min(col+ncols, (j+1)*t)
+                block[top-row:bottom-row, left-col:right-col] = self.tiles[i, j, top-i*t:bottom-i*t, left-j*t:right-j*t]
+        return block
+
+    def readMask(self, row, col, nrows, ncols):
+        # NoData mask of a block (True where no data)
+        t = self.tile_size
+        mask = np.empty((nrows, ncols), dtype=bool)
+        for i in range(row // t, (row+nrows-1) // t + 1):
+            for j in range(col // t, (col+ncols-1) // t + 1):
+                top, bottom = max(row, i*t), min(row+nrows, (i+1)*t)
+                left, right = max(col, j*t), min(col+ncols, (j+1)*t)
+                mask[top-row:bottom-row, left-col:right-col] = self.nodata[i, j, top-i*t:bottom-i*t, left-j*t:right-j*t]
+        return mask
+
+    def valueRange(self, row, col, nrows, ncols):
+        # Min and max of the tiles a block overlaps, without reading them (NaN, NaN when there is no data)
+        t = self.tile_size
+        stats = self.stats[row // t:(row+nrows-1) // t + 1, col // t:(col+ncols-1) // t + 1]
+        stats = stats[stats["count"] > 0]
+        if len(stats) == 0:
+            return np.nan, np.nan
+        return float(stats["min"].min()), float(stats["max"].max())
+
+    def tilesBetween(self, low, high):
+        # Windows of the tiles with values between low and high (e.g. mean high water and surge)
+        inside = (self.stats["count"] > 0) & (self.stats["max"] >= low) & (self.stats["min"] <= high)
+        return [window for window in tileWindows(self.shape, self.tile_size)
+                if inside[window.row // self.tile_size, window.col // self.tile_size]]
+
+    def overview(self, level, statistic="min"):
+        # Raster source of an overview: each cell is the min (or max) of 2^level x 2^level cells of the DEM
+        f = 2**level
+        array = np.load(os.path.join(self.path, "{0}_{1}.npy".format(statistic, level)), mmap_mode="r")
+        return ArraySource(array[:-(-self.shape[0] // f), :-(-self.shape[1] // f)], self.x_min, self.y_max,
+                           self.cellsize * f)
+
+#---------------------------------------------------------------------------------------------------------------------#
+# COARSE-TO-FINE EXTRACTION
+# The overviews tell which 2^k x 2^k blocks can hold the contour (or be partly flooded): only these blocks are read at
+# full resolution, one read per run of consecutive blocks. A contour square may span two blocks, so each block is
+# widened to its right, lower and lower-right neighbours: the squares found are exactly those of a full run.
+#---------------------------------------------------------------------------------------------------------------------#
+def _overviewRanges(dem, level):
+    level = dem.levels if level is None else level
+    f = 2**level
+    blocks = (-(-dem.shape[0] // f), -(-dem.shape[1] // f))
+    low = np.load(os.path.join(dem.path, "min_{0}.npy".format(level)), mmap_mode="r")[:blocks[0], :blocks[1]]
+    high = np.load(os.path.join(dem.path, "max_{0}.npy".format(level)), mmap_mode="r")[:blocks[0], :blocks[1]]
+    return f, np.asarray(low), np.asarray(high)
+
+def _runs(selected):
+    # (start, end) of each run of True values
+    edges = np.diff(np.concatenate([[0], selected.astype(np.int8), [0]]))
+    return zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1))
+
+def coarseToFineContour(dem, level, overview=None, message=None):
+    # Same polylines as tiledContour(dem, level), reading only the blocks the overview selects (dem is a TiledDem)
+    f, low, high = _overviewRanges(dem, overview)
+    # Values of each block and of the blocks its squares reach
+    padded_low = np.pad(low, ((0, 1), (0, 1)), constant_values=np.nan)
+    padded_high = np.pad(high, ((0, 1), (0, 1)), constant_values=np.nan)
+    reach_low = np.fmin(np.fmin(padded_low[:-1, :-1], padded_low[:-1, 1:]),
+                        np.fmin(padded_low[1:, :-1], padded_low[1:, 1:]))
+    reach_high = np.fmax(np.fmax(padded_high[:-1, :-1], padded_high[:-1, 1:]),
+                         np.fmax(padded_high[1:, :-1], padded_high[1:, 1:]))
+    candidates = (reach_low < float(level)) & (reach_high >= float(level))
+
+    segments, cells = [], 0
+    nrows, ncols = dem.shape
+    for i in range(candidates.shape[0]):
+        for start, end in _runs(candidates[i]):
+            row, col = i*f, start*f
+            window = Window(row, col, min(f+1, nrows-row), min((end-start)*f+1, ncols-col),
+                            row, col, f, (end-start)*f)
+            block = dem.read(window.row, window.col, window.nrows, window.ncols)
+            cells += block.size
+            x, y = cellCenters(dem, window)
+            segments.append(marchingSquares(block, float(level), x, y, slice(0, f), slice(0, (end-start)*f)))
+    if message is not None:
+        message("Contour at {0}: {1} of {2} blocks, {3:.1f}% of the cells read".format(
+                level, int(candidates.sum()), candidates.size, 100.0*cells/(nrows*ncols)))
+    return joinSegments(np.concatenate(segments) if segments else np.zeros((0, 2, 2)))
+
+def coarseToFineFloodMask(dem, surge, output, mean_high_water=None, overview=None, message=None):
+    # Same mask as tiledFloodMask: blocks entirely flooded or entirely dry are written without being read
+    f, low, high = _overviewRanges(dem, overview)
+    surge = float(surge)
+    mhw = -np.inf if mean_high_water is None else float(mean_high_water)
+    nrows, ncols = dem.shape
+    # Blocks of tiles with NoData cells are never assumed entirely flooded
+    t = dem.tile_size
+    tile_cells = np.outer(np.minimum(t, nrows - t*np.arange(dem.stats.shape[0])),
+                         np.minimum(t, ncols - t*np.arange(dem.stats.shape[1])))
+    complete = np.repeat(np.repeat(dem.stats["count"] == tile_cells, t // f, axis=0), t // f, axis=1)
+    complete = complete[:low.shape[0], :low.shape[1]]
+    with np.errstate(invalid="ignore"):
+        flooded = complete & (high <= surge) & (low > mhw)
+        dry = ~(low <= surge) | ~(high > mhw)         # NaN (no data) ==> dry
+    mixed = ~flooded & ~dry
+
+    output[...] = False
+    cells = 0
+    for i in range(low.shape[0]):
+        rows = slice(i*f, min((i+1)*f, nrows))
+        for start, end in _runs(flooded[i]):
+            output[rows, start*f:min(end*f, ncols)] = True
+        for start, end in _runs(mixed[i]):
+            cols = slice(start*f, min(end*f, ncols))
+            block = dem.read(rows.start, cols.start, rows.stop-rows.start, cols.stop-cols.start)
+            cells += block.size
+            output[rows, cols] = (block <= surge) & (block > mhw)
+    if message is not None:
+        message("Flood mask at {0}: {1} blocks flooded, {2} dry, {3} read ({4:.1f}% of the cells)".format(
+                surge, int(flooded.sum()), int(dry.sum()), int(mixed.sum()), 100.0*cells/(nrows*ncols)))
+    return output
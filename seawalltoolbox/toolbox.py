@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+import sys, traceback
+
+import numpy as np
+
+from ._compat import arcpy, addMessage
+from .damage import stormDamage, segmentDamageCurves
+from .economics import class_segment, slr_scenarios, slrPathways, expectedDamages, efficientHeights
+from .cache import ElevationCache, defaultCachePath, geometryHash
+from .delta import ParcelState, defaultStatePath, updateCurves
+from .results import ResultsStore, defaultResultsPath
+from .assessor import addAssessorValues
+from .geoprocessing import createContour, createSegmentsOfLowLands, parcelElevations, segmentResults, readPolygons,\
+                           zonalMean, pointElevations, intersectingSegments, writeResults, addToMap
+from .portfolio import portfolioCurves, portfolioOptimizer
+from .memory import MemoryMonitor
+
+#---------------------------------------------------------------------------------------------------------------------#
+# ECONOMIC EVALUATION OF THE SEGMENTS
+# damage_curves and marginal_costs are segments x surges. Also used by the command line without arcpy.
+#---------------------------------------------------------------------------------------------------------------------#
+def reportSegments(segment_ids, surges, damage_curves, marginal_costs, years=30, discount_rate=0.04, budget=None,\
+                   message=addMessage):
+    # Storm surge probability under each sea level rise pathway (scenarios x years)
+    p_slr = slrPathways(slr_scenarios, years)
+    # Expected damages for all the segments and all the scenarios at once (scenarios x segments x surges)
+    marginal_benefits = expectedDamages(np.array(damage_curves).reshape(len(segment_ids), len(surges)),\
+                                        surges, p_slr, discount_rate)
+
+    # Efficient defense
+    marginal_costs = np.array(marginal_costs).reshape(len(segment_ids), len(surges))
+    crossings, heights, totals = efficientHeights(surges, marginal_benefits, marginal_costs)
+    for k in range(len(slr_scenarios)):
+        message("\nSea level rise pathway: {0} ({1} m after {2} years)".format(
+                slr_scenarios[k][0], round(p_slr[k, -1], 2), years))
+        for j in range(len(segment_ids)):
+            message("\nSegment s_{0} | Parcels: p_{0}".format(str(segment_ids[j])))
+            for i in np.nonzero((crossings[0] == k) & (crossings[1] == j))[0]:
+                message("\nEfficient wall height at: {0} m with benefits totalling {1} USD".format(
+                        str(heights[i]), format(round(totals[i]),',.0f')))
+
+        # Which segments to wall, and how high, when all of them compete for the same budget
+        if budget is not None:
+            benefits, costs = portfolioCurves(marginal_benefits[k], marginal_costs)
+            choice, spent, net = portfolioOptimizer(benefits, costs, budget)
+            message("\nPortfolio within {0} USD: {1} walls costing {2} USD with net benefits of {3} USD".format(
+                    format(budget,',.0f'), int((choice > 0).sum()), format(round(spent),',.0f'), format(round(net),',.0f')))
+            for j in np.nonzero(choice)[0]:
+                message("Segment s_{0}: wall at {1} m".format(str(segment_ids[j]), str(surges[choice[j]])))
+
+    return marginal_benefits
+
+#---------------------------------------------------------------------------------------------------------------------#
+# THE WHOLE TOOL
+#---------------------------------------------------------------------------------------------------------------------#
+def run(raster_dem, raster_to_contours, mean_high_water, surge, properties, building, zoneField, workspace, output,\
+        years=30, discount_rate=0.04, budget=None, cache=None, add_to_map=True, elevation_mode="zonal",\
+        elevation_points=None, memory=None, state=None, results=None, assessor=None, assessor_id=None,\
+        assessor_value=None, write_curves=True, tile_size=None):
+    # memory: MemoryMonitor (memory.py) to set a memory budget or trace the Python allocations
+    # state: ParcelState (delta.py) where the parcels and curves are kept for later updates (see update)
+    # results: ResultsStore (results.py) where the curves and efficient heights of the run are recorded
+    # assessor: table (CSV or geodatabase) of building values to join on the parcel IDs instead of the building field
+    # output: feature class, or a .gpkg or .parquet file written in bulk with the parcels (and the damage curves)
+    # tile_size: tiled mode for DEMs too large for memory, the contours and the zonal parcel elevations are computed
+    # from the DEM tile by tile (tiles of at most tile_size cells, smaller if the memory budget needs it) and
+    # raster_to_contours is not used
+    memory = memory or MemoryMonitor()
+
+    # Set Workspace for the results as defined by the user
+    arcpy.env.workspace = workspace
+
+    # Let's first create a copy of the properties' feature we'll use
+    properties_copy = arcpy.CopyFeatures_management(properties, "properties_copy")
+
+    # Building values from an assessor table: streamed and joined on the parcel IDs, then used as the building field
+    if assessor:
+        with memory.stage("Assessor join"):
+            building = addAssessorValues(properties_copy, zoneField, assessor, assessor_id or zoneField,\
+                                         assessor_value or building, message=arcpy.AddMessage)
+
+    # Create layers for the properties and the raster
+    raster_dem_lyr = arcpy.MakeRasterLayer_management(raster_dem, "raster_dem_lyr")
+    properties_lyr = arcpy.MakeFeatureLayer_management(properties_copy, 'properties_lyr')
+
+    # Create contours from the raster layer
+    #raster_to_contours = arcpy.sa.Contour(raster_dem_lyr, "raster_to_contours.shp", 1)
+
+    with memory.stage("Contours"):
+        tiled = {} if tile_size is None else {"dem": raster_dem, "tile_size": tile_size, "memory_cap": memory.budget}
+        # Create contour line for the user-specificed mean high water
+        contour_mhw = createContour(raster_to_contours, mean_high_water, **tiled)
+        # Create contour line for the user-specificed storm surge level
+        contour_surge = createContour(raster_to_contours, surge, **tiled)
+    # Create the coastal segments
+    with memory.stage("Lowland segments"):
+        lowland_segments = createSegmentsOfLowLands(contour_mhw, contour_surge)
+
+    # Calculating storm damage for each properties
+    # Let's fits add a field
+    arcpy.AddField_management(properties_copy, "S_Damage", "LONG")
+
+    # Now let's get the mean elevation of each properties with zonal statistics (or the elevation at their centroid)
+    # Parcels already known by the elevation cache (same DEM, same geometry) are not resampled
+    with memory.stage("Parcel elevations"):
+        parcelElevations(properties_copy, zoneField, raster_dem_lyr, cache, elevation_mode, elevation_points, memory,\
+                         tile_size)
+    # Now the actual calculation, using UpdateCursor
+    with memory.stage("Storm damages"):
+        with arcpy.da.UpdateCursor(properties_copy, [building, "MEAN", "S_Damage"]) as segments:
+            for segment in segments:
+                value = 0.0 if segment[0] is None else float(segment[0])
+                dem = segment[1]
+                # No elevation (parcel off the DEM or on NoData): no damage, as in the damage curves
+                segment[2] = 0 if dem is None else stormDamage(value, dem, surge)
+                segments.updateRow(segment)
+        del segment, segments
+
+    ##-------------------------------------------------------------##
+    # Now simply create a shapefile of all the vulnerable properties
+    # Create Layer from the segment polygons UNNECESSARY??
+    lowland_segments_lyr = arcpy.MakeFeatureLayer_management(lowland_segments, 'lowland_segments_lyr')
+    lowland_properties = arcpy.SelectLayerByLocation_management('properties_lyr', 'INTERSECT', 'lowland_segments_lyr')
+    arcpy.CopyFeatures_management(lowland_properties, 'lowland_properties')
+    lowland_properties_lyr = arcpy.MakeFeatureLayer_management('lowland_properties.shp', 'lowland_properties_lyr')
+
+    # Handling segments
+    #segments = []
+    surges = list(np.arange(class_segment.wall_base_height, 4, 0.01)) # Mean high water ~ wall base height is at 1.07m
+    surges = [round(h, 2) for h in surges]
+    segment_ids = []
+    wall_lengths = []
+    marginal_costs = []
+    # Parcels of all the segments (a parcel touching two segments is listed for both)
+    parcel_ids, segment_of_parcel, values, dems = [], [], [], []
+    l_s_lyr = arcpy.MakeFeatureLayer_management(lowland_segments, "l_s_lyr")
+    with arcpy.da.SearchCursor(lowland_segments, ["Id", "AOI_Length"]) as l_s:
+        for s in l_s:
+            with memory.stage("Segment s_" + str(s[0])):
+                s_select = arcpy.SelectLayerByAttribute_management('l_s_lyr', "NEW_SELECTION", '"Id" = {0}'.format(s[0]))
+                p_select = arcpy.SelectLayerByLocation_management('lowland_properties_lyr', 'INTERSECT', s_select)
+                arcpy.CopyFeatures_management(s_select, 's_'+str(s[0])) # Creating segment shapefile
+                arcpy.CopyFeatures_management(p_select, 'p_'+str(s[0])) # Creating properties within the segment shapefile
+                #segments.append(segment(s[0], s[1]))    # Creating segment objects
+
+                # Handling parcels by segment
+                with arcpy.da.SearchCursor('p_'+str(s[0])+'.shp', [zoneField, building, "MEAN"]) as l_p:
+                    for p in l_p:
+                        parcel_ids.append(p[0])
+                        segment_of_parcel.append(len(segment_ids))
+                        values.append(0.0 if p[1] is None else float(p[1]))
+                        dems.append(np.nan if p[2] is None else p[2])
+
+                # Processing of the segment
+                test = class_segment(s[0], s[1])    # Creating segment objects
+                test_wall_cost = test.wall_cost(surges, discount_rate)     # same rate as the benefits
+
+                # Keep the curves: all the segments are evaluated together under every SLR pathway below
+                segment_ids.append(s[0])
+                wall_lengths.append(s[1])
+                marginal_costs.append(test_wall_cost[1])
+
+    # Let's add these results to the segment polygons: total damage (T_Damage), damage per meter of wall (PS_Damage),
+    # largest parcel damage, exposed building value and number of parcels, with the parcels of the damage curves
+    with memory.stage("Segment results"):
+        joined_r_p = segmentResults(lowland_segments, properties_copy, "S_Damage", building, "joined_r_p.shp",\
+                                    zoneField, [(p, segment_ids[k]) for p, k in zip(parcel_ids, segment_of_parcel)])
+
+    # Sum of all damages across all parcels in each segment, for each surge level (segments x surges),
+    # by chunks of parcels that fit in the memory budget
+    with memory.stage("Damage curves"):
+        chunk_size = memory.chunkSize(len(values), 3*8*len(surges))
+        damage_curves = segmentDamageCurves(segment_of_parcel, np.array(values), np.array(dems), surges,\
+                                            len(segment_ids), chunk_size)
+
+    with memory.stage("Economic evaluation"):
+        marginal_benefits = reportSegments(segment_ids, surges, damage_curves, marginal_costs, years, discount_rate,\
+                                           budget, arcpy.AddMessage)
+
+    parameters = {"raster_dem": raster_dem, "mean_high_water": mean_high_water, "surge": surge,\
+                  "properties": properties, "elevation_mode": elevation_mode, "years": years,\
+                  "discount_rate": discount_rate, "budget": budget}
+    if results is not None:
+        with memory.stage("Results store"):
+            run_number = results.saveRun(parameters, surges, segment_ids, wall_lengths, damage_curves, marginal_costs,\
+                                         marginal_benefits, budget)
+            arcpy.AddMessage("Run {0} recorded in {1}".format(run_number, results.path))
+
+    # Keep every parcel (also those outside the segments: they may move into one) for later updates
+    if state is not None:
+        with memory.stage("Parcel state"):
+            rings = readPolygons(lowland_segments, [])[0]
+            parcels = [(row[0], geometryHash(row[1]), 0.0 if row[2] is None else float(row[2]), row[3]) for row in\
+                       arcpy.da.SearchCursor(properties_copy, [zoneField, "SHAPE@WKB", building, "MEAN"])]
+            state.save(parameters, surges, segment_ids, wall_lengths, rings, damage_curves, parcels,\
+                       zip(parcel_ids, segment_of_parcel))
+
+    ##-------------------------------------------------------------##
+
+    # Let's remove the surrounded polygons which are not at risk but automatically
+    # created by spatial join
+    arcpy.MakeFeatureLayer_management(contour_mhw, 'contour_mhw_lyr')
+    arcpy.MakeFeatureLayer_management(joined_r_p, 'joined_r_p_lyr')
+    # Only those intersecting segments at mean high water are at risk
+    arcpy.SelectLayerByLocation_management('joined_r_p_lyr', 'INTERSECT', 'contour_mhw_lyr')
+
+    # Save results (the damage per segment length is already computed by segmentResults)
+    before_output = arcpy.CopyFeatures_management('joined_r_p_lyr', 'before_output')
+
+    # Let's delete all now unnecessary layers
+    arcpy.Delete_management('raster_dem_lyr')
+    arcpy.Delete_management('properties_lyr')
+    arcpy.Delete_management('regions_lyr')
+    arcpy.Delete_management('contour_mhw_lyr')
+    arcpy.Delete_management('joined_r_p_lyr')
+    arcpy.Delete_management('joined_r_p.shp')
+    arcpy.Delete_management('raster_to_contours.shp')
+    arcpy.Delete_management(contour_mhw)
+    arcpy.Delete_management(contour_surge)
+
+    # Save results
+    with memory.stage("Output"):
+        if output.lower().endswith((".gpkg", ".parquet")):
+            writeResults(output, before_output, properties_copy, zoneField, "S_Damage", building, segment_ids, surges,\
+                         damage_curves if write_curves else None)
+        else:
+            arcpy.CopyFeatures_management(before_output, output)
+    arcpy.Delete_management(before_output)
+
+    if add_to_map:
+        # Adding the results in the current map (when there is one)
+        addToMap(output)
+
+    # Which steps (or segments) used the most memory
+    memory.report(arcpy.AddMessage, top=None if len(memory.stages) <= 20 else 20)
+
+    return output
+
+#---------------------------------------------------------------------------------------------------------------------#
+# UPDATE AFTER A CHANGE OF THE PARCEL ROLL
+# Only the changed parcels are read, only the new or moved ones get a new elevation and new segments, and only the
+# segments they were or are in are re-evaluated: the time is proportional to the size of the change.
+#---------------------------------------------------------------------------------------------------------------------#
+def update(changed_parcels, building, zoneField, workspace, state, deleted=(), raster_dem=None, years=30,\
+           discount_rate=0.04, budget=None, memory=None):
+    # changed_parcels: the new or changed parcels (same fields as the properties), deleted: IDs of removed parcels
+    memory = memory or MemoryMonitor()
+    if state.isEmpty():
+        raise ValueError("No previous run is stored in " + state.path)
+    arcpy.env.workspace = workspace
+    parameters = state.parameters()
+    raster_dem = raster_dem or parameters["raster_dem"]
+    surges = state.surges()
+    segment_ids, wall_lengths, rings, curves = state.segments()
+
+    with memory.stage("Changed parcels"):
+        rows = [(row[0], row[1], geometryHash(row[1]), 0.0 if row[2] is None else float(row[2])) for row in\
+                arcpy.da.SearchCursor(changed_parcels, [zoneField, "SHAPE@", building])]
+        old = state.parcels([row[0] for row in rows] + list(deleted))
+        # New parcels and parcels with a new geometry need an elevation and their segments
+        moved = [i for i, row in enumerate(rows) if str(row[0]) not in old or old[str(row[0])][0] != row[2]]
+
+    with memory.stage("Parcel elevations"):
+        ids = [rows[i][0] for i in moved]
+        if parameters.get("elevation_mode") == "point":
+            elevations = pointElevations(changed_parcels, zoneField, raster_dem, ids)
+        else:
+            elevations = zonalMean(changed_parcels, zoneField, raster_dem, ids)
+        touching = intersectingSegments([rows[i][1] for i in moved], rings,\
+                                        arcpy.Describe(changed_parcels).spatialReference)
+
+    with memory.stage("Damage curves"):
+        new = {}
+        for i, row in enumerate(rows):
+            known = old.get(str(row[0]))
+            new[str(row[0])] = (row[2], row[3]) + (known[2:] if known is not None else (np.nan, []))
+        for i, elevation, segments in zip(moved, elevations, touching):
+            new[str(rows[i][0])] = (rows[i][2], rows[i][3], elevation, segments)
+        curves, affected = updateCurves(curves, surges, old, new)
+
+    with memory.stage("Economic evaluation"):
+        marginal_costs = [class_segment(segment_ids[k], wall_lengths[k]).wall_cost(surges, discount_rate)[1]\
+                          for k in affected]
+        reportSegments([segment_ids[k] for k in affected], surges, curves[affected], marginal_costs, years,\
+                       discount_rate, budget, addMessage)
+
+    state.applyDelta([(p, g, v, e) for p, (g, v, e, segments) in new.items()],\
+                     [(p, k) for p, (g, v, e, segments) in new.items() for k in segments],\
+                     deleted, dict((k, curves[k]) for k in affected))
+    addMessage("{0} parcels changed ({1} new or moved), {2} deleted: {3} of {4} segments re-evaluated".format(
+               len(rows), len(moved), len(deleted), len(affected), len(segment_ids)))
+    memory.report(addMessage)
+    return [segment_ids[k] for k in affected]
+
+#---------------------------------------------------------------------------------------------------------------------#
+# MAIN CODE (ArcToolbox script tool)
+#---------------------------------------------------------------------------------------------------------------------#
+def main():
+    # Check to see if Spatial Analyst license is available
+    if arcpy.CheckExtension("spatial") == "Available":
+
+        try:
+
+            # Activate Spatial Analyst
+            arcpy.CheckOutExtension("spatial")
+
+            # Necessary user inputs
+            raster_dem = arcpy.GetParameterAsText(0)       		# LIDAR DEM
+            raster_to_contours = arcpy.GetParameterAsText(1)    # Pre-created Contours (to improve performance)
+            mean_high_water = arcpy.GetParameterAsText(2)       # In meter recommended
+            surge = arcpy.GetParameterAsText(3)                 # In meter recommended
+            properties = arcpy.GetParameterAsText(4)            # Get geosptatial data of the properties
+            building = arcpy.GetParameterAsText(5)              # Field of Building value in the properties shapefile
+            zoneField = arcpy.GetParameterAsText(6)             # Field for unique ID of buildings the properties shapefile
+
+            # Set Workspace for the results as defined by the user
+            workspace = arcpy.GetParameterAsText(7)
+            # Save final Output
+            output = arcpy.GetParameterAsText(8)
+            # Planning horizon for the sea level rise pathways (optional, up to 100 years)
+            years = int(arcpy.GetParameterAsText(9)) if arcpy.GetArgumentCount() > 9 and arcpy.GetParameterAsText(9) else 30
+            # Capital budget for the whole portfolio of seawalls (optional, in USD)
+            budget = float(arcpy.GetParameterAsText(10)) if arcpy.GetArgumentCount() > 10 and arcpy.GetParameterAsText(10) else None
+            # Parcel elevation: "Zonal mean" (default) or "Centroid"
+            elevation_mode = "point" if arcpy.GetArgumentCount() > 11 and arcpy.GetParameterAsText(11) == "Centroid" else "zonal"
+            # Memory budget (optional, in MB): chunked steps take smaller chunks to stay within it
+            memory_budget = float(arcpy.GetParameterAsText(12))*1048576 if arcpy.GetArgumentCount() > 12 and arcpy.GetParameterAsText(12) else None
+            # Assessor table (optional, CSV or table) with its parcel ID field and building value field
+            assessor = arcpy.GetParameterAsText(13) if arcpy.GetArgumentCount() > 13 else ""
+            assessor_id = arcpy.GetParameterAsText(14) if arcpy.GetArgumentCount() > 14 else ""
+            assessor_value = arcpy.GetParameterAsText(15) if arcpy.GetArgumentCount() > 15 else ""
+            # Damage curves of the segments in a .gpkg or .parquet output (optional, checked by default)
+            write_curves = not (arcpy.GetArgumentCount() > 16 and arcpy.GetParameterAsText(16) == "false")
+            # Tile size in cells (optional): contours traced from the DEM tile by tile, for DEMs too large for memory
+            tile_size = int(arcpy.GetParameterAsText(17)) if arcpy.GetArgumentCount() > 17 and arcpy.GetParameterAsText(17) else None
+
+            # Parcel elevations are kept between runs next to the workspace, with the parcel state for updates
+            cache = ElevationCache(defaultCachePath(workspace))
+            state = ParcelState(defaultStatePath(workspace))
+            results = ResultsStore(defaultResultsPath(workspace))
+            try:
+                run(raster_dem, raster_to_contours, mean_high_water, surge, properties, building, zoneField, workspace,\
+                    output, years=years, budget=budget, cache=cache, elevation_mode=elevation_mode,\
+                    memory=MemoryMonitor(memory_budget), state=state, results=results, assessor=assessor,\
+                    assessor_id=assessor_id, assessor_value=assessor_value, write_curves=write_curves,\
+                    tile_size=tile_size)
+            finally:
+                cache.close()
+                state.close()
+                results.close()
+
+        except Exception as e:
+            arcpy.AddError('\n' + "Script failed because: \t\t" + str(e))
+            exceptionreport = sys.exc_info()[2]
+            fullermessage = traceback.format_tb(exceptionreport)[0]
+            arcpy.AddError("at this location: \n\n" + fullermessage + "\n")
+
+    else:
+        # Report error message if Spatial Analyst license is unavailable
+        arcpy.AddMessage("Spatial Analyst license is unavailable")
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+import os, json, struct, sqlite3
+
+import numpy as np
+
+from ._compat import LazyModule
+
+pa = LazyModule("pyarrow")
+pq = LazyModule("pyarrow.parquet")
+
+#---------------------------------------------------------------------------------------------------------------------#
+# WELL-KNOWN BINARY
+# Polygons (one ring, e.g. from assemblePolygons or readPolygons) and points are encoded with numpy; geometries read
+# from arcpy (SHAPE@WKB) are already WKB and are written as they are.
+#---------------------------------------------------------------------------------------------------------------------#
+def polygonWkb(ring):
+    ring = np.asarray(ring, dtype="<f8").reshape(-1, 2)
+    if len(ring) and not (ring[0] == ring[-1]).all():
+        ring = np.concatenate([ring, ring[:1]])
+    return struct.pack("<BIII", 1, 3, 1, len(ring)) + ring.tobytes()
+
+def pointWkb(x, y):
+    return struct.pack("<BIdd", 1, 1, x, y)
+
+def _wkb(geometry):
+    # WKB and envelope of a ring or of WKB (None, None for a null geometry)
+    if geometry is None:
+        return None, None
+    if isinstance(geometry, (bytes, bytearray)):
+        return bytes(geometry), wkbEnvelope(bytes(geometry))
+    ring = np.asarray(geometry, dtype=float).reshape(-1, 2)
+    low, high = ring.min(axis=0), ring.max(axis=0)
+    return polygonWkb(ring), ((low[0], low[1], high[0], high[1]) if len(ring) else None)
+
+def wkbEnvelope(wkb):
+    # (min x, min y, max x, max y) of a 2D WKB geometry of any type, None when it is empty
+    arrays = []
+    def coordinates(offset, order, count):
+        arrays.append(np.frombuffer(wkb, dtype=order + "f8", count=2*count, offset=offset).reshape(-1, 2))
+        return offset + 16*count
+
+    def walk(offset):
+        order = "<" if wkb[offset:offset+1] == b"\x01" else ">"
+        kind = struct.unpack(order + "I", wkb[offset+1:offset+5])[0] % 1000
+        if kind == 1:
+            return coordinates(offset+5, order, 1)
+        count = struct.unpack(order + "I", wkb[offset+5:offset+9])[0]
+        offset += 9
+        if kind == 2:
+            return coordinates(offset, order, count)
+        for part in range(count):
+            if kind == 3:       # rings
+                n = struct.unpack(order + "I", wkb[offset:offset+4])[0]
+                offset = coordinates(offset+4, order, n)
+            else:               # multi geometries and collections
+                offset = walk(offset)
+        return offset
+
+    walk(0)
+    xy = np.concatenate(arrays) if arrays else np.zeros((0, 2))
+    xy = xy[~np.isnan(xy).any(axis=1)]      # POINT EMPTY is NaN NaN
+    if not len(xy):
+        return None
+    return xy[:, 0].min(), xy[:, 1].min(), xy[:, 0].max(), xy[:, 1].max()
+
+_wkb_types = {1: "Point", 2: "LineString", 3: "Polygon", 4: "MultiPoint", 5: "MultiLineString", 6: "MultiPolygon",
+              7: "GeometryCollection"}
+
+def wkbTypes(geometries):
+    # Sorted names of the geometry types of WKB geometries (e.g. ["MultiPolygon", "Polygon"]), nulls left out
+    kinds = set()
+    for wkb in geometries:
+        if wkb:
+            order = "<" if wkb[0:1] == b"\x01" else ">"
+            kinds.add(_wkb_types.get(struct.unpack(order + "I", wkb[1:5])[0] % 1000, "Geometry"))
+    return sorted(kinds)
+
+#---------------------------------------------------------------------------------------------------------------------#
+# GEOPACKAGE
+# Written with sqlite3 (no GDAL): the GeoPackage 1.2 metadata tables, then each layer in one transaction with one bulk
+# insert. A geometry is the GeoPackage header (with its envelope) followed by its WKB.
+#---------------------------------------------------------------------------------------------------------------------#
+_gpkg_application_id = 0x47504B47      # "GPKG"
+
+def gpkgGeometry(wkb, srs_id, envelope=None):
+    envelope = envelope or wkbEnvelope(wkb)
+    if envelope is None:
+        return sqlite3.Binary(b"GP" + struct.pack("<BBi", 0, 0x11, srs_id) + wkb)      # empty, no envelope
+    return sqlite3.Binary(b"GP" + struct.pack("<BBi4d", 0, 0x03, srs_id, *envelope) + wkb)
+
+def _gpkgSpatialRefSys(connection, srs):
+    # srs: None (undefined), or (EPSG code, WKT) as from an arcpy spatial reference; a code of 0 with a WKT is a
+    # custom coordinate system. Returns the srs_id of the layers.
+    connection.execute("CREATE TABLE IF NOT EXISTS gpkg_spatial_ref_sys (srs_name TEXT NOT NULL, "
+                       "srs_id INTEGER NOT NULL PRIMARY KEY, organization TEXT NOT NULL, "
+                       "organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT)")
+    connection.executemany("INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)", [
+        ("Undefined cartesian SRS", -1, "NONE", -1, "undefined", "undefined cartesian coordinate reference system"),
+        ("Undefined geographic SRS", 0, "NONE", 0, "undefined", "undefined geographic coordinate reference system"),
+        ("WGS 84 geodetic", 4326, "EPSG", 4326,
+         'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],'
+         'AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],'
+         'UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4326"]]',
+         "longitude/latitude coordinates in decimal degrees on the WGS 84 spheroid")])
+    if srs is None or not (srs[0] or srs[1]):
+        return -1
+    code, definition = srs
+    srs_id, organization = (int(code), "EPSG") if code else (100000, "NONE")
+    connection.execute("INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)",
+                       (definition.split('"')[1] if '"' in definition else "Custom", srs_id, organization,
+                        int(code or srs_id), definition, None))
+    return srs_id
+
+def _sqlType(values):
+    kind = np.asarray(values).dtype.kind
+    return {"i": "INTEGER", "u": "INTEGER", "b": "BOOLEAN", "f": "DOUBLE"}.get(kind, "TEXT")
+
+def _column(values):
+    values = np.asarray(values)
+    if values.dtype.kind == "f":
+        return [None if v != v else v for v in values.tolist()]
+    if values.dtype.kind in "iub":
+        return values.tolist()
+    return [None if v is None else str(v) for v in values.tolist()]
+
+def writeGeoPackage(path, layer, columns, geometries=None, geometry_type="POLYGON", srs=None):
+    # Adds (or replaces) a layer: columns is a list of (name, values), geometries a list of rings or WKB (None: an
+    # attribute table). All the rows are written in one transaction.
+    connection = sqlite3.connect(path)
+    try:
+        with connection:
+            connection.execute("PRAGMA application_id = {0}".format(_gpkg_application_id))
+            connection.execute("PRAGMA user_version = 10200")
+            srs_id = _gpkgSpatialRefSys(connection, srs)
+            connection.execute("CREATE TABLE IF NOT EXISTS gpkg_contents (table_name TEXT NOT NULL PRIMARY KEY, "
+                               "data_type TEXT NOT NULL, identifier TEXT UNIQUE, description TEXT DEFAULT '', "
+                               "last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')), "
+                               "min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER, "
+                               "CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id))")
+            connection.execute("CREATE TABLE IF NOT EXISTS gpkg_geometry_columns (table_name TEXT NOT NULL, "
+                               "column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL, srs_id INTEGER NOT NULL, "
+                               "z TINYINT NOT NULL, m TINYINT NOT NULL, "
+                               "CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name), "
+                               "CONSTRAINT fk_gc_tn FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name), "
+                               "CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys (srs_id))")
+            for table in ("gpkg_geometry_columns", "gpkg_contents"):
+                connection.execute("DELETE FROM {0} WHERE table_name = ?".format(table), (layer,))
+            connection.execute('DROP TABLE IF EXISTS "{0}"'.format(layer))
+
+            names = [name for name, values in columns]
+            definitions = ['"{0}" {1}'.format(name, _sqlType(values)) for name, values in columns]
+            data = [_column(values) for name, values in columns]
+            if geometries is not None:
+                wkbs, envelopes = zip(*[_wkb(g) for g in geometries]) if len(geometries) else ((), ())
+                blobs = [None if w is None else gpkgGeometry(w, srs_id, e) for w, e in zip(wkbs, envelopes)]
+                envelopes = np.array([e for e in envelopes if e is not None])
+                extent = ([envelopes[:, 0].min(), envelopes[:, 1].min(), envelopes[:, 2].max(), envelopes[:, 3].max()]
+                          if len(envelopes) else [None]*4)
+                names, definitions, data = ["geom"] + names, ["geom " + geometry_type] + definitions, [blobs] + data
+            connection.execute('CREATE TABLE "{0}" (fid INTEGER PRIMARY KEY AUTOINCREMENT, {1})'.format(
+                               layer, ", ".join(definitions)))
+            connection.executemany('INSERT INTO "{0}" ({1}) VALUES ({2})'.format(
+                                   layer, ", ".join('"{0}"'.format(n) for n in names), ", ".join("?"*len(names))),
+                                   zip(*data))
+            if geometries is not None:
+                connection.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier, min_x, min_y, max_x, "
+                                   "max_y, srs_id) VALUES (?, 'features', ?, ?, ?, ?, ?, ?)",
+                                   [layer, layer] + extent + [srs_id])
+                connection.execute("INSERT INTO gpkg_geometry_columns VALUES (?, 'geom', ?, ?, 0, 0)",
+                                   (layer, geometry_type, srs_id))
+            else:
+                connection.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier) "
+                                   "VALUES (?, 'attributes', ?)", (layer, layer))
+    finally:
+        connection.close()
+    return path
+
+#---------------------------------------------------------------------------------------------------------------------#
+# GEOPARQUET (optional: needs pyarrow)
+# One Parquet file per layer, the geometry as a WKB column described by the "geo" metadata (GeoParquet 1.0). A column
+# of arrays (e.g. the damage curves, one array per segment) is written as a list column.
+#---------------------------------------------------------------------------------------------------------------------#
+def writeGeoParquet(path, columns, geometries=None, geometry_types=("Polygon",), crs=None, metadata=None):
+    # crs: PROJJSON dictionary of the coordinate system, or None when it is unknown
+    arrays, names = [], []
+    for name, values in columns:
+        values = np.asarray(values) if not isinstance(values, list) else values
+        if isinstance(values, np.ndarray) and values.ndim == 2:
+            arrays.append(pa.array(list(values), type=pa.list_(pa.float64())))
+        else:
+            arrays.append(pa.array(values.tolist() if isinstance(values, np.ndarray) else values))
+        names.append(name)
+    schema_metadata = dict((key, json.dumps(value)) for key, value in (metadata or {}).items())
+    if geometries is not None:
+        wkbs, envelopes = zip(*[_wkb(g) for g in geometries]) if len(geometries) else ((), ())
+        envelopes = np.array([e for e in envelopes if e is not None])
+        column = {"encoding": "WKB", "geometry_types": list(geometry_types), "crs": crs}
+        if len(envelopes):
+            column["bbox"] = [envelopes[:, 0].min(), envelopes[:, 1].min(), envelopes[:, 2].max(),
+                              envelopes[:, 3].max()]
+        arrays.append(pa.array(list(wkbs), type=pa.binary()))
+        names.append("geometry")
+        schema_metadata["geo"] = json.dumps({"version": "1.0.0", "primary_column": "geometry",
+                                             "columns": {"geometry": column}})
+    table = pa.Table.from_arrays(arrays, names=names)
+    table = table.replace_schema_metadata(dict((k.encode("utf-8"), v.encode("utf-8"))
+                                               for k, v in schema_metadata.items()))
+    pq.write_table(table, path)
+    return path
+
+def projjson(srs):
+    # PROJJSON of (EPSG code, WKT) for the GeoParquet metadata, with pyproj when it is installed; None otherwise
+    # (GeoParquet then reads the coordinates as undefined, not as longitude/latitude)
+    if srs is None or not (srs[0] or srs[1]):
+        return None
+    try:
+        import pyproj
+    except ImportError:
+        return None
+    return pyproj.CRS.from_user_input(int(srs[0]) if srs[0] else srs[1]).to_json_dict()
+
+def parquetPath(path, layer):
+    # results.parquet -> results_parcels.parquet
+    root, extension = os.path.splitext(path)
+    return root + "_" + layer + extension